@@ -1,7 +1,8 @@
 import os
 import json
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from typing import List, Dict, Any, Callable, Optional
 from pydantic import BaseModel, Field, validator
 from dotenv import load_dotenv
 
@@ -19,6 +20,12 @@ load_dotenv()
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.tools import tool
+
+from homework_dedup import DuplicateMatch, MinHashIndex
+from homework_prescorer import PreScore, PreScorer, feedback_for
+from metrics.llm_routing import CLINICAL_TRANSLATION, HOMEWORK_SCORING, get_router, routing_log
+from metrics.metric_graph import content_hash
+from metrics.prompt_budget import estimate_tokens, get_usage_ledger
 # -------------------------------------------------------------------------
 
 # ... (代码其余部分保持不变) ...
@@ -38,12 +45,16 @@ def get_api_key() -> str:
             raise ValueError("未提供有效的OpenRouter API密钥")
     return api_key
 
+def get_base_url() -> str:
+    """获取 LLM 服务地址（可指向本地 llm_stub_server 做离线压测）"""
+    return os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+
 # 初始化LLM
 def init_llm() -> ChatOpenAI:
     try:
         llm = ChatOpenAI(
             model="openai/gpt-4o",
-            openai_api_base="https://openrouter.ai/api/v1",
+            openai_api_base=get_base_url(),
             openai_api_key=get_api_key(),
             # OpenRouter 推荐的头部信息需要通过 default_headers 传入
             default_headers={
@@ -65,6 +76,28 @@ llm = init_llm()
 ################################################################################
 # II. 工具定义：CBT 作业评估工具 (此部分与之前相同)
 ################################################################################
+# 评分量表版本：修改评估提示词或评分维度时递增，用于区分不同量表下的评估结果（请求合并、缓存键等）
+RUBRIC_VERSION = "cbt-5d-v1"
+
+# 近似重复作业：与同一机构已评估过的作业相似度达到该阈值时沿用旧的评估结果（设为 0 关闭）
+DEDUP_THRESHOLD = float(os.getenv("CBT_HOMEWORK_DEDUP_THRESHOLD", "0.8"))
+# 按机构分开建索引，评估内容不会跨机构复用
+_dedup_indexes: Dict[str, MinHashIndex] = {}
+# 本地规则预评分：明显未完成的作业不调用 LLM（CBT_HOMEWORK_TRIAGE=0 关闭短路，仍计算预评分）
+TRIAGE_ENABLED = os.getenv("CBT_HOMEWORK_TRIAGE", "1") != "0"
+prescorer = PreScorer()
+_dedup_lock = threading.Lock()
+
+
+def _dedup_index(tenant: Optional[str]) -> Optional[MinHashIndex]:
+    if DEDUP_THRESHOLD <= 0:
+        return None
+    with _dedup_lock:
+        index = _dedup_indexes.get(tenant or "")
+        if index is None:
+            index = _dedup_indexes[tenant or ""] = MinHashIndex()
+        return index
+
 class EvaluationReport(BaseModel):
     """CBT作业评估报告"""
     score_context: int = Field(..., ge=0, le=20, description="情境描述分数 (0-20分)")
@@ -76,6 +109,15 @@ class EvaluationReport(BaseModel):
     # 给患者看的反馈可以在第二阶段临床转化时再填充，这里允许为空字符串
     patient_feedback: str = Field("", min_length=0, max_length=2000, description="面向来访者的反馈文本")
     total_score: int = Field(..., ge=0, le=100, description="总分 (100分制)")
+    # 本次评估各步骤实际使用的模型、回退与延迟（metrics.llm_routing.RoutingLog.summary）
+    routing: Dict[str, Any] = Field(default_factory=dict, description="模型路由记录")
+    token_usage: Dict[str, Any] = Field(default_factory=dict, description="token 用量与估算费用")
+    # 近似重复提交时指向被沿用的那次评估：{"submission_id", "similarity"}
+    duplicate_of: Optional[Dict[str, Any]] = Field(None, description="近似重复的原作业")
+    # homework_prescorer 的规则预评分（各维度字数、暂定分、是否送 LLM）
+    prescore: Dict[str, Any] = Field(default_factory=dict, description="本地规则预评分")
+    # 评估失败时为异常类型名；此时各项分数为 0 占位，不是真实评分
+    error: Optional[str] = Field(None, description="评估失败的原因（分数无效）")
 
     @validator('total_score')
     def validate_total_score(cls, v, values):
@@ -90,11 +132,58 @@ class EvaluationReport(BaseModel):
             raise ValueError('总分必须等于各项分数之和')
         return v
 
-def analyze_with_llm(submission_text: str) -> Dict[str, Any]:
+def _response_text(response: Any) -> str:
+    raw = getattr(response, "content", response)
+    # 兼容不同返回类型（str 或 list）
+    if isinstance(raw, list):
+        return "".join([seg.get("text", "") if isinstance(seg, dict) else str(seg) for seg in raw])
+    return str(raw)
+
+
+def _parse_json_text(raw_text: str) -> Dict[str, Any]:
+    raw_text = raw_text.strip()
+
+    # 尝试从第一个 "{" 到最后一个 "}" 截出 JSON 片段，避免 ```json 包裹等情况
+    start = raw_text.find("{")
+    end = raw_text.rfind("}")
+    if start != -1 and end != -1 and end > start:
+        json_str = raw_text[start:end+1]
+    else:
+        json_str = raw_text
+
+    try:
+        return json.loads(json_str)
+    except Exception as parse_err:
+        logger.error(f"JSON 解析失败, 原始内容如下:\n{raw_text}")
+        raise parse_err
+
+
+def _response_usage(response: Any) -> Optional[tuple]:
+    """LangChain 响应中的 (prompt_tokens, completion_tokens)；没有用量信息时返回 None。"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage")
+    if token_usage:
+        return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+    return None
+
+
+def _routed_invoke(prompt_type: str, prompt: str, parse: Callable[[str], Any], tenant: Optional[str]) -> Any:
+    """按路由表选择模型调用 LLM；调用或 parse 失败时按回退链换下一个模型。"""
+
+    def attempt(model: str, max_tokens: int, timeout: float) -> Any:
+        response = llm.invoke(prompt, model=model, max_tokens=max_tokens, timeout=timeout)
+        return parse(_response_text(response)), _response_usage(response)
+
+    return get_router().call(prompt_type, attempt, tenant=tenant, prompt_tokens=estimate_tokens(prompt))
+
+
+def analyze_with_llm(submission_text: str, tenant: Optional[str] = None) -> Dict[str, Any]:
     """使用LLM分析CBT作业"""
     try:
-        # 这里可以添加更复杂的提示工程
-        prompt = f"""
+        # 这里可以添加更复杂的提示工程；作业文本超出该路由的提示词预算时截短中间部分
+        prompt = get_router().build_prompt(HOMEWORK_SCORING, """
         你是一位经验丰富、但非常严谨的 CBT 督导师。
 
         你的任务是：只对下面这份 CBT 家庭作业做结构化、量表化的质量评估，输出 JSON 数据，不要输出任何多余说明。
@@ -125,57 +214,34 @@ def analyze_with_llm(submission_text: str) -> Dict[str, Any]:
         - 只输出 JSON，不要任何额外文字，不要解释
         - 确保 total_score = 5 项得分之和
         - 使用 utf-8 编码兼容的标准 JSON 格式
-        """
-
-        response = llm.invoke(prompt)
-        raw = getattr(response, "content", response)
-
-        # 兼容不同返回类型（str 或 list）
-        if isinstance(raw, list):
-            raw_text = "".join([seg.get("text", "") if isinstance(seg, dict) else str(seg) for seg in raw])
-        else:
-            raw_text = str(raw)
-
-        raw_text = raw_text.strip()
+        """, tenant=tenant, submission_text=submission_text)
 
-        # 尝试从第一个 "{" 到最后一个 "}" 截出 JSON 片段，避免 ```json 包裹等情况
-        start = raw_text.find("{")
-        end = raw_text.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            json_str = raw_text[start:end+1]
-        else:
-            json_str = raw_text
-
-        try:
-            return json.loads(json_str)
-        except Exception as parse_err:
-            logger.error(f"JSON 解析失败, 原始内容如下:\n{raw_text}")
-            raise parse_err
+        return _routed_invoke(HOMEWORK_SCORING, prompt, _parse_json_text, tenant)
     except Exception as e:
         logger.error(f"LLM分析失败: {str(e)}")
         raise
 
 
-def cbt_homework_quality_analyzer(submission_text: str) -> EvaluationReport:
+def cbt_homework_quality_analyzer(submission_text: str, tenant: Optional[str] = None) -> EvaluationReport:
     """纯数据层：调用 LLM 进行严谨 JSON 评估，返回 EvaluationReport。
 
     对应流程中的：
     - 调用专业工具 (CBT Analyzer)
     - API LLM 严谨评估 (JSON Output)
     """
-    analysis = analyze_with_llm(submission_text)
+    analysis = analyze_with_llm(submission_text, tenant)
     report = EvaluationReport(**analysis)
     return report
 
 
-def clinical_translation(submission_text: str, report: EvaluationReport) -> str:
+def clinical_translation(submission_text: str, report: EvaluationReport, tenant: Optional[str] = None) -> str:
     """临床转化层：把结构化评分 + 原始作业，转成面向来访者的温柔反馈。
 
     对应流程中的：
     - Agent 临床转化
     - 用户反馈（文本部分）
     """
-    clinical_prompt = f"""
+    clinical_prompt = get_router().build_prompt(CLINICAL_TRANSLATION, """
     你现在是一名富有同理心的 CBT 心理治疗师。
 
     下面是来访者的一份 CBT 家庭作业原文：
@@ -184,7 +250,7 @@ def clinical_translation(submission_text: str, report: EvaluationReport) -> str:
     --- 作业结束 ---
 
     下面是督导师对这份作业给出的结构化量表评估结果（JSON）：
-    {report.model_dump_json(ensure_ascii=False)}
+    {report_json}
 
     请你基于这份结构化评估结果，用「通俗、温柔、但专业」的中文，给来访者写一段反馈，要求：
     - 先简要肯定其完成作业的努力
@@ -193,19 +259,25 @@ def clinical_translation(submission_text: str, report: EvaluationReport) -> str:
     - 使用第二人称（“你”），避免专业术语堆砌
     - 用非评判性的方式，简要描述你对这份作业「完成度/是否认真投入」、「看起来更像是当时记录还是事后回忆补写」、「整体完成态度（例如是否愿意自我反思）」的观察，可以用“给我的感觉是…”这类表述，避免武断下结论
     - 字数建议在 200-500 字之间
-    """
+    """, tenant=tenant, submission_text=submission_text, report_json=report.model_dump_json(ensure_ascii=False, exclude={"routing", "token_usage", "duplicate_of", "prescore"}))
 
-    clinical_response = llm.invoke(clinical_prompt)
-    clinical_text = getattr(clinical_response, "content", clinical_response)
-    return str(clinical_text)
+    return _routed_invoke(CLINICAL_TRANSLATION, clinical_prompt, str, tenant)
 
 @tool
-def evaluate_cbt_homework(submission_text: str) -> EvaluationReport:
+def evaluate_cbt_homework(
+    submission_text: str,
+    tenant: Optional[str] = None,
+    session_id: Optional[str] = None,
+    therapist_id: Optional[str] = None,
+) -> EvaluationReport:
     """
     评估 CBT 作业质量并返回结构化评分报告
     
     Args:
         submission_text: 学生提交的CBT作业文本
+        tenant: 机构标识，用于选择该机构的模型路由（可选）
+        session_id: 作业所属会谈，用于 LLM 用量台账按会谈汇总（可选）
+        therapist_id: 负责的治疗师，用于 LLM 用量台账按治疗师汇总（可选）
         
     Returns:
         EvaluationReport: 包含详细评分的报告对象
@@ -217,33 +289,89 @@ def evaluate_cbt_homework(submission_text: str) -> EvaluationReport:
         raise ValueError("提交的作业文本过短或无效")
         
     logger.info(f"开始评估CBT作业，文本长度: {len(submission_text)} 字符")
-    
-    try:
-        # 第一步：严谨 JSON 评估（数据层）
-        report = cbt_homework_quality_analyzer(submission_text)
-
-        # 第二步：临床转化（体验层）
-        clinical_text = clinical_translation(submission_text, report)
-
-        # 用临床转化后的文字填充给患者看的反馈
-        report.patient_feedback = clinical_text
-
-        logger.info(f"评估完成，总分: {report.total_score}/100")
-        return report
 
-    except Exception as e:
-        logger.error(f"评估过程中发生错误: {str(e)}")
-        # 返回一个基本的错误报告
-        return EvaluationReport(
-            score_context=0,
-            score_emotion=0,
-            score_thought=0,
-            score_restructuring=0,
-            score_action_plan=0,
-            doctor_comments="评估过程中发生错误，请稍后重试（技术层）。",
-            patient_feedback="评估过程中发生了一些技术问题，目前暂时无法给出完整反馈，可以稍后再试一次。",
-            total_score=0
-        )
+    prescore = prescorer.score(submission_text)
+    if TRIAGE_ENABLED:
+        # 节省的提示词 token 只计作业文本本身（两次调用各一次），不含指令模板，为下限
+        prescorer.record(prescore, prompt_tokens=2 * estimate_tokens(submission_text))
+        if not prescore.substantive:
+            logger.info(f"作业未完成（{prescore.reason}），使用本地预评分，不调用 LLM")
+            return _prescored_report(prescore)
+
+    index = _dedup_index(tenant)
+    if index is not None:
+        match = index.best_match(submission_text, DEDUP_THRESHOLD)
+        if match is not None:
+            logger.info(f"近似重复提交（相似度 {match.similarity:.2f}），沿用作业 {match.key} 的评估")
+            return _reuse_report(match)
+
+    with routing_log() as routing:
+        try:
+            # 第一步：严谨 JSON 评估（数据层）
+            report = cbt_homework_quality_analyzer(submission_text, tenant)
+
+            # 第二步：临床转化（体验层）
+            clinical_text = clinical_translation(submission_text, report, tenant)
+
+            # 用临床转化后的文字填充给患者看的反馈
+            report.patient_feedback = clinical_text
+            report.routing = routing.summary()
+            report.token_usage = routing.totals()
+            report.prescore = prescore.to_dict()
+
+            logger.info(f"评估完成，总分: {report.total_score}/100")
+            if index is not None:
+                index.add(content_hash(RUBRIC_VERSION, submission_text)[:16], submission_text, report)
+            return report
+
+        except Exception as e:
+            logger.error(f"评估过程中发生错误: {str(e)}")
+            # 返回一个基本的错误报告
+            return EvaluationReport(
+                score_context=0,
+                score_emotion=0,
+                score_thought=0,
+                score_restructuring=0,
+                score_action_plan=0,
+                doctor_comments="评估过程中发生错误，请稍后重试（技术层）。",
+                patient_feedback="评估过程中发生了一些技术问题，目前暂时无法给出完整反馈，可以稍后再试一次。",
+                total_score=0,
+                routing=routing.summary(),
+                token_usage=routing.totals(),
+                prescore=prescore.to_dict(),
+                error=type(e).__name__,
+            )
+        finally:
+            # 失败的评估同样计入用量（已发出的调用照常计费）
+            get_usage_ledger().record(routing.decisions, session_id=session_id or "", therapist_id=therapist_id or "")
+
+def _prescored_report(prescore: PreScore) -> EvaluationReport:
+    """未完成作业的模板化报告：分数为规则暂定分。"""
+    doctor_comments, patient_feedback = feedback_for(prescore)
+    return EvaluationReport(
+        score_context=prescore.scores["context"],
+        score_emotion=prescore.scores["emotion"],
+        score_thought=prescore.scores["thought"],
+        score_restructuring=prescore.scores["restructuring"],
+        score_action_plan=prescore.scores["action_plan"],
+        total_score=prescore.total_score,
+        doctor_comments=doctor_comments,
+        patient_feedback=patient_feedback,
+        prescore=prescore.to_dict(),
+    )
+
+def _reuse_report(match: DuplicateMatch) -> EvaluationReport:
+    """沿用旧评估：分数与患者反馈不变，在医生版评语前注明重复提交（没有新的 LLM 调用）。"""
+    report: EvaluationReport = match.payload
+    note = f"【近似重复提交】与先前评估过的作业 {match.key} 相似度 {match.similarity:.0%}，沿用该次评分。\n"
+    return report.model_copy(
+        update={
+            "doctor_comments": (note + report.doctor_comments)[:2000],
+            "routing": {},
+            "token_usage": {},
+            "duplicate_of": {"submission_id": match.key, "similarity": match.similarity},
+        }
+    )
 
 ################################################################################
 # III. 测试运行：模拟完整 6 步流程
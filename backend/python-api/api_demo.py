@@ -1,11 +1,82 @@
-from fastapi import FastAPI
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from functools import lru_cache
+from typing import Any, Dict, List, Literal, Optional, Set, Tuple
+
+from fastapi import FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from openai import OpenAI
 from pydantic import BaseModel
-from typing import Any, Dict
 
-from agent_homework_evaluator import evaluate_cbt_homework
+from agent_homework_evaluator import RUBRIC_VERSION, evaluate_cbt_homework, prescorer
+from archive_store import ArchiveReader
+from cohort_analytics import CohortAnalytics, CohortHistory
+from homework_history import HomeworkHistory
+from compatibility_agent import CompatibilityMetricsAgent
+from live_session import LiveSessionState
+from metrics.downsampling import CurvePyramid
+from metrics.llm_scheduler import INTERACTIVE, get_scheduler, llm_priority
+from metrics.metric_graph import content_hash
+from metrics.prompt_budget import get_usage_ledger
+from metrics.tracing import get_tracer
+from metrics_executor import MetricsExecutor, MetricsExecutorBusy, MetricsTaskTimeout
+from request_coalescing import SingleFlight
+
+# CPU 密集指标的进程池（池大小 / 超时 / 排队上限见 metrics_executor 的环境变量）
+metrics_executor = MetricsExecutor()
+
+# 会谈契合度 Agent：有 OPENROUTER_API_KEY 时启用 LLM 语义分析
+compat_agent = CompatibilityMetricsAgent(multi_speaker=os.getenv("CBT_MULTI_SPEAKER") == "1")
+if os.getenv("OPENROUTER_API_KEY"):
+    compat_agent.set_semantic_client(
+        OpenAI(
+            base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+            api_key=os.getenv("OPENROUTER_API_KEY"),
+        )
+    )
+
+
+# 相同作业文本 + 量表版本的并发评估只调用一次 LLM（重试风暴、多标签页同时打开）
+evaluation_flight = SingleFlight()
+get_tracer().registry.register_gauges("evaluate_cbt_singleflight", evaluation_flight.stats)
+# 本地预评分分流：短路的作业数与节省的 LLM 调用（homework_prescorer）
+get_tracer().registry.register_gauges("homework_triage", prescorer.stats)
+
+# 所有 LLM 调用共享的调度器：交互请求优先，批量重算只用剩余名额（metrics.llm_scheduler）
+get_tracer().registry.register_gauges("llm_scheduler", get_scheduler().stats)
+# 交互请求每次 LLM 调用从入队起排队等待名额的上限秒数，超过后该步骤放弃调用（批量请求不设截止）
+INTERACTIVE_DEADLINE_S = float(os.getenv("CBT_LLM_INTERACTIVE_DEADLINE", "60"))
+
+
+# 作业评分历史：CBT_HOMEWORK_HISTORY 指定 .npz 文件时启动载入、关闭时保存
+HOMEWORK_HISTORY_PATH = os.getenv("CBT_HOMEWORK_HISTORY")
+homework_history = (
+    HomeworkHistory.load(HOMEWORK_HISTORY_PATH)
+    if HOMEWORK_HISTORY_PATH and os.path.exists(HOMEWORK_HISTORY_PATH)
+    else HomeworkHistory()
+)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # 启动时拉起并预热工作进程，避免第一个请求承担进程启动与导入开销
+    metrics_executor.start()
+    try:
+        yield
+    finally:
+        metrics_executor.shutdown()
+        if HOMEWORK_HISTORY_PATH:
+            homework_history.save(HOMEWORK_HISTORY_PATH)
 
-app = FastAPI(title="CBT Homework Evaluator API")
+
+app = FastAPI(title="CBT Homework Evaluator API", lifespan=lifespan)
+
+# 会话归档目录（archive_store.ArchiveWriter 写入的位置）
+ARCHIVE_ROOT = os.getenv("CBT_ARCHIVE_ROOT", "archive")
 
 # 添加 CORS 中间件，允许前端跨域调用
 app.add_middleware(
@@ -19,6 +90,15 @@ app.add_middleware(
 
 class HomeworkRequest(BaseModel):
     submission_text: str
+    # 机构标识：按该机构的路由表选择模型（metrics.llm_routing）
+    tenant: Optional[str] = None
+    # 用于 LLM 用量台账按会谈 / 治疗师汇总（不参与请求合并：合并后只产生一次调用费用）
+    session_id: Optional[str] = None
+    # 提供时评估结果记入该患者的作业评分历史
+    patient_id: Optional[str] = None
+    therapist_id: Optional[str] = None
+    # 批量重算请求传 "batch"：只使用交互请求剩余的 LLM 名额
+    priority: Literal["interactive", "batch"] = "interactive"
 
 
 class HomeworkResponse(BaseModel):
@@ -30,12 +110,30 @@ class HomeworkResponse(BaseModel):
     score_action_plan: int
     doctor_comments: str
     patient_feedback: str
+    routing: Dict[str, Any] = {}
+    token_usage: Dict[str, Any] = {}
+    # 近似重复提交时沿用的原作业（见 homework_dedup），供治疗师留意
+    duplicate_of: Optional[Dict[str, Any]] = None
+    # 本地规则预评分；prescore["substantive"] 为 False 时本次没有调用 LLM
+    prescore: Dict[str, Any] = {}
+    # 评估失败时为异常类型名，各项分数为 0 占位（不计入作业趋势）
+    error: Optional[str] = None
 
 
 @app.post("/evaluate_cbt", response_model=HomeworkResponse)
 async def evaluate_cbt(req: HomeworkRequest) -> HomeworkResponse:
-    """评估一份 CBT 作业并返回两份报告（医生版 + 患者版）。"""
-    report = evaluate_cbt_homework.invoke({"submission_text": req.submission_text})
+    """评估一份 CBT 作业并返回两份报告（医生版 + 患者版）。
+
+    同一作业文本的并发请求共享一次评估（见 request_coalescing.SingleFlight）。
+    """
+    # 合并键含优先级：交互请求不会挂在一次批量评估上（按 batch 排队、没有截止时间）
+    key = content_hash(RUBRIC_VERSION, req.tenant or "", req.priority, req.submission_text)
+    report, recorded = await evaluation_flight.do(key, lambda: _evaluate_shared(req))
+    # 合并键不含 patient_id：每个调用方按自己的患者记入历史（不同患者提交相同的模板文本时各记一条），
+    # 同一合并组内同一患者只记一次（患者端超时重试不会重复计入）
+    if req.patient_id and req.patient_id not in recorded:
+        recorded.add(req.patient_id)
+        homework_history.append_report(req.patient_id, req.therapist_id or "", report)
 
     return HomeworkResponse(
         total_score=report.total_score,
@@ -46,9 +144,179 @@ async def evaluate_cbt(req: HomeworkRequest) -> HomeworkResponse:
         score_action_plan=report.score_action_plan,
         doctor_comments=report.doctor_comments,
         patient_feedback=report.patient_feedback,
+        routing=report.routing,
+        token_usage=report.token_usage,
+        duplicate_of=report.duplicate_of,
+        prescore=report.prescore,
+        error=report.error,
     )
 
 
+async def _evaluate_shared(req: HomeworkRequest) -> Tuple[Any, Set[str]]:
+    """合并组共享的结果：评估报告 + 本组已记入历史的 patient_id。"""
+    report = await asyncio.to_thread(_evaluate, req)
+    return report, set()
+
+
+def _evaluate(req: HomeworkRequest) -> Any:
+    # 在线程中执行：LLM 调用是同步阻塞的，不能占住事件循环
+    with get_tracer().trace(
+        "evaluate_cbt", text_length=len(req.submission_text), tenant=req.tenant, priority=req.priority
+    ), _priority_scope(req.priority):
+        report = evaluate_cbt_homework.invoke(
+            {
+                "submission_text": req.submission_text,
+                "tenant": req.tenant,
+                "session_id": req.session_id,
+                "therapist_id": req.therapist_id,
+            }
+        )
+    return report
+
+
+def _priority_scope(priority: str) -> Any:
+    return llm_priority(priority, INTERACTIVE_DEADLINE_S if priority == INTERACTIVE else None)
+
+
+@app.post("/analyze_session")
+async def analyze_session(
+    session: Dict[str, Any],
+    priority: Literal["interactive", "batch"] = Query("interactive", description="批量重算传 batch"),
+) -> Dict[str, Any]:
+    """会谈契合度分析：情绪同步等 CPU 指标在进程池中计算，LLM 语义分析异步等待。"""
+    try:
+        # 优先级上下文会随 asyncio.to_thread 带进语义分析线程
+        with _priority_scope(priority):
+            output = await compat_agent.analyze_session_async(session, metrics_executor)
+    except TypeError as e:
+        raise HTTPException(status_code=422, detail=f"会话数据格式错误: {e}")
+    except KeyError as e:
+        raise HTTPException(status_code=422, detail=f"会话数据缺少字段: {e}")
+    except MetricsExecutorBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except MetricsTaskTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    return asdict(output)
+
+
+@app.get("/usage")
+async def llm_usage(
+    by: str = Query("session", description="session / therapist / day / prompt_type / model"),
+    day: Optional[str] = Query(None, description="只看某一天（YYYY-MM-DD）"),
+) -> Dict[str, Any]:
+    """LLM 调用用量报告：按维度汇总调用数、token、估算费用与延迟。"""
+    try:
+        return {"by": by, "day": day, "groups": get_usage_ledger().report(by=by, day=day)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> str:
+    """Prometheus 抓取端点（需设置 CBT_TRACING=1 或调用 configure_tracing 开启追踪）。"""
+    return get_tracer().registry.render()
+
+
+@app.websocket("/ws/live_session/{session_id}")
+async def live_session(websocket: WebSocket, session_id: str) -> None:
+    """实时会话：客户端逐条推送 turn / emotion 事件，服务端每条事件后回推最新指标与新触发的告警。"""
+    await websocket.accept()
+    state = LiveSessionState(session_id)
+    try:
+        while True:
+            event = await websocket.receive_json()
+            try:
+                payload = state.handle_event(event)
+            except (KeyError, TypeError, ValueError) as e:
+                await websocket.send_json({"type": "error", "session_id": session_id, "message": str(e)})
+                continue
+            await websocket.send_json(payload)
+    except WebSocketDisconnect:
+        pass
+
+
+# 常驻的归档读取器：维护 session_id → 所在段的索引，单会话查询只读该会话自己的段
+_archive_reader = ArchiveReader(ARCHIVE_ROOT)
+
+
+@lru_cache(maxsize=128)
+def _emotion_curve_pyramid(session_id: str, method: str, segment: str) -> CurvePyramid:
+    """从归档读取会话情绪曲线并构建金字塔（找不到时抛 KeyError，不缓存）。
+
+    缓存键含会话最新所在的段（ArchiveReader.session_segment）：段写入后不可变，
+    其他会话写入新段不影响已缓存的金字塔；本会话被重新归档（例如转写更正后）时
+    指向新段，旧金字塔不再命中；其他进程（如 session_ingest）写入的段同样生效。
+    """
+    curves = _archive_reader.read_session_curves(session_id, segment=segment)
+    if "time_bins" not in curves:
+        raise KeyError(session_id)
+    time_bins = curves.pop("time_bins")
+    return CurvePyramid(time_bins, curves, method=method)
+
+
+def _session_pyramid(session_id: str, method: str) -> CurvePyramid:
+    segment = _archive_reader.session_segment(session_id)
+    if segment is None:
+        raise KeyError(session_id)
+    return _emotion_curve_pyramid(session_id, method, segment)
+
+
+@app.get("/sessions/{session_id}/emotion_curves")
+async def emotion_curves(
+    session_id: str,
+    max_points: int = Query(200, ge=3, le=20000, description="每条曲线最多返回的点数"),
+    start: Optional[float] = Query(None, description="起始时间（秒）"),
+    end: Optional[float] = Query(None, description="结束时间（秒）"),
+    method: str = Query("lttb", pattern="^(lttb|minmax)$"),
+) -> Dict[str, Any]:
+    """情绪曲线的多分辨率查询：返回时间范围内不超过 max_points 的最细分辨率数据。"""
+    try:
+        pyramid = await asyncio.to_thread(_session_pyramid, session_id, method)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"未找到会话 {session_id} 的情绪曲线")
+    return {"session_id": session_id, **pyramid.query(max_points=max_points, start=start, end=end)}
+
+
+@app.get("/patients/{patient_id}/homework_history")
+async def patient_homework_history(patient_id: str) -> Dict[str, Any]:
+    """患者的作业评分轨迹（各维度）与趋势：移动平均、斜率、平台期。"""
+    trajectory = homework_history.patient(patient_id)
+    if trajectory is None:
+        raise HTTPException(status_code=404, detail=f"患者 {patient_id} 没有作业评估记录")
+    return trajectory
+
+
+@app.get("/therapists/{therapist_id}/homework_trajectories")
+async def therapist_homework_trajectories(therapist_id: str) -> Dict[str, Any]:
+    """治疗师名下所有患者的作业评分轨迹（一次批量查询，不重跑 LLM 评估）。"""
+    return {"therapist_id": therapist_id, "patients": homework_history.caseload(therapist_id)}
+
+
+# 个案告警引擎常驻内存：归档版本变化时只读入新写入的段，未变化时直接复用缓存的统计
+_cohort_history = CohortHistory()
+_cohort_engine = CohortAnalytics(_cohort_history)
+_cohort_state = {"archive_version": ""}
+_cohort_lock = threading.Lock()
+
+
+def _cohort_alerts(therapist_id: str) -> List[Dict[str, Any]]:
+    reader = ArchiveReader(ARCHIVE_ROOT)
+    # 请求在线程池里并发执行，增量读入与重算需要串行
+    with _cohort_lock:
+        version = reader.version()
+        if version != _cohort_state["archive_version"]:
+            _cohort_history.sync_archive(reader)
+            _cohort_state["archive_version"] = version
+        return _cohort_engine.evaluate_alerts(therapist_id)
+
+
+@app.get("/therapists/{therapist_id}/cohort_alerts")
+async def therapist_cohort_alerts(therapist_id: str) -> Dict[str, Any]:
+    """治疗师名下全部患者的会谈指标告警（从归档整列读入，向量化计算趋势与告警规则）。"""
+    alerts = await asyncio.to_thread(_cohort_alerts, therapist_id)
+    return {"therapist_id": therapist_id, "alerts": alerts}
+
+
 # 方便直接用 `python api_demo.py` 本地跑
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,515 @@
+"""会话归档的列式存储（ArchiveData + 可视化曲线）。
+
+目录结构：
+    <root>/
+      seg-<时间戳>-<随机串>/
+        meta.json                 段元数据（行数、列类型、段内 session_id/patient_id/therapist_id 集合）
+        # pyarrow 可用时（backend="arrow"）
+        metrics.parquet           每行一次会话：id 列 + raw.* + computed.*
+        curves.arrow              Arrow IPC 文件：每条曲线一个 list<float32> 列
+        # 无 pyarrow 时（backend="npy"）
+        <列名>.npy                每列一个 .npy（可 mmap）
+        curve.<名>.values.npy     所有会话该曲线拼接后的 float32 数组
+        curve.<名>.offsets.npy    int64，长度 rows+1，第 i 行对应 values[offsets[i]:offsets[i+1]]
+
+读取：
+- 段级谓词下推：先比对 meta.json 中的 id 集合，整段跳过不相关数据
+- 段内：parquet 走 filters 下推；npy 先只读 id 列算出掩码，再取需要的行
+- 单会话查询：ArchiveReader 常驻时维护 session_id → 最新所在段的索引（只为新段读 meta），只读该段
+- 默认 memory_map=True，曲线在未过滤时直接返回 mmap 视图（零拷贝进入 NumPy）
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from metrics.archive_data import ArchiveData
+
+try:  # 可选依赖：有 pyarrow 时用 Parquet/Arrow，否则回退到 .npy 列文件
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - 取决于部署环境
+    pa = None
+
+ID_COLUMNS = ("session_id", "patient_id", "therapist_id", "session_date")
+FORMAT_VERSION = 1
+
+
+@dataclass
+class CurveBatch:
+    """一批会话的同名曲线：扁平 values + offsets（CSR 风格，避免逐会话的小数组）。"""
+
+    session_ids: np.ndarray
+    offsets: np.ndarray
+    values: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.session_ids)
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self.values[self.offsets[i] : self.offsets[i + 1]]
+
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+
+# =============================
+# 写入
+# =============================
+
+
+class ArchiveWriter:
+    """按段批量写入归档数据。
+
+    用法：
+        with ArchiveWriter("archive/") as writer:
+            writer.append(output.archive_data, emotion_detail["visualization_data"])
+    """
+
+    def __init__(self, root: str, backend: str = "auto", segment_rows: int = 1024) -> None:
+        if backend == "auto":
+            backend = "arrow" if pa is not None else "npy"
+        if backend == "arrow" and pa is None:
+            raise ImportError("backend='arrow' 需要安装 pyarrow")
+        if backend not in {"arrow", "npy"}:
+            raise ValueError(f"未知的归档后端: {backend}")
+        self.root = root
+        self.backend = backend
+        self.segment_rows = segment_rows
+        self._rows: List[Tuple[ArchiveData, Dict[str, Any]]] = []
+        os.makedirs(root, exist_ok=True)
+
+    def append(self, archive: ArchiveData, visualization_data: Optional[Dict[str, Any]] = None) -> None:
+        self._rows.append((archive, visualization_data or {}))
+        if len(self._rows) >= self.segment_rows:
+            self.flush()
+
+    def flush(self) -> Optional[str]:
+        if not self._rows:
+            return None
+        columns, curves = _build_columns(self._rows)
+        seg_dir = os.path.join(self.root, f"seg-{time.time_ns():020d}-{uuid.uuid4().hex[:6]}")
+        tmp_dir = seg_dir + ".tmp"
+        os.makedirs(tmp_dir)
+        if self.backend == "arrow":
+            _write_arrow_segment(tmp_dir, columns, curves)
+        else:
+            _write_npy_segment(tmp_dir, columns, curves)
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "backend": self.backend,
+            "rows": len(self._rows),
+            "columns": {name: str(arr.dtype) for name, arr in columns.items()},
+            "curves": sorted(curves),
+            "session_ids": sorted(set(columns["session_id"].tolist())),
+            "patient_ids": sorted(set(columns["patient_id"].tolist())),
+            "therapist_ids": sorted(set(columns["therapist_id"].tolist())),
+        }
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        # 先写临时目录再改名，读方不会看到写了一半的段
+        os.rename(tmp_dir, seg_dir)
+        self._rows = []
+        return seg_dir
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "ArchiveWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+def _build_columns(
+    rows: Sequence[Tuple[ArchiveData, Dict[str, Any]]]
+) -> Tuple[Dict[str, np.ndarray], Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+    n = len(rows)
+    columns: Dict[str, np.ndarray] = {
+        name: np.array([str(getattr(a, name)) for a, _ in rows], dtype=str) for name in ID_COLUMNS
+    }
+
+    raw_names = sorted({k for a, _ in rows for k in a.raw_metrics})
+    for name in raw_names:
+        col = np.full(n, np.nan, dtype=np.float64)
+        for i, (a, _) in enumerate(rows):
+            v = a.raw_metrics.get(name)
+            if v is not None:
+                col[i] = float(v)
+        columns[f"raw.{name}"] = col
+
+    computed_names = sorted({k for a, _ in rows for k in a.computed_fields})
+    for name in computed_names:
+        values = [a.computed_fields.get(name) for a, _ in rows]
+        if all(v is None or isinstance(v, (int, float)) for v in values):
+            columns[f"computed.{name}"] = np.array(
+                [np.nan if v is None else float(v) for v in values], dtype=np.float64
+            )
+        else:
+            columns[f"computed.{name}"] = np.array(["" if v is None else str(v) for v in values], dtype=str)
+
+    curve_names = sorted(
+        {
+            k
+            for _, viz in rows
+            for k, v in viz.items()
+            if isinstance(v, (list, tuple, np.ndarray))
+        }
+    )
+    curves: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    for name in curve_names:
+        parts = [np.asarray(viz.get(name, ()), dtype=np.float32).ravel() for _, viz in rows]
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in parts], out=offsets[1:])
+        values = np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+        curves[name] = (offsets, values.astype(np.float32, copy=False))
+    return columns, curves
+
+
+def _write_npy_segment(
+    seg_dir: str,
+    columns: Dict[str, np.ndarray],
+    curves: Dict[str, Tuple[np.ndarray, np.ndarray]],
+) -> None:
+    for name, arr in columns.items():
+        np.save(os.path.join(seg_dir, f"{name}.npy"), arr, allow_pickle=False)
+    for name, (offsets, values) in curves.items():
+        np.save(os.path.join(seg_dir, f"curve.{name}.offsets.npy"), offsets, allow_pickle=False)
+        np.save(os.path.join(seg_dir, f"curve.{name}.values.npy"), values, allow_pickle=False)
+
+
+def _write_arrow_segment(
+    seg_dir: str,
+    columns: Dict[str, np.ndarray],
+    curves: Dict[str, Tuple[np.ndarray, np.ndarray]],
+) -> None:
+    table = pa.table({name: pa.array(arr.tolist() if arr.dtype.kind == "U" else arr) for name, arr in columns.items()})
+    pq.write_table(table, os.path.join(seg_dir, "metrics.parquet"))
+
+    curve_cols: Dict[str, Any] = {"session_id": pa.array(columns["session_id"].tolist())}
+    for name, (offsets, values) in curves.items():
+        curve_cols[name] = pa.LargeListArray.from_arrays(pa.array(offsets), pa.array(values))
+    curve_table = pa.table(curve_cols)
+    with pa.OSFile(os.path.join(seg_dir, "curves.arrow"), "wb") as sink:
+        with pa_ipc.new_file(sink, curve_table.schema) as writer:
+            writer.write_table(curve_table)
+
+
+# =============================
+# 读取
+# =============================
+
+
+class ArchiveReader:
+    """归档读取器：段级 + 段内谓词下推，曲线默认零拷贝。"""
+
+    def __init__(self, root: str, memory_map: bool = True) -> None:
+        self.root = root
+        self.memory_map = memory_map
+        # 段提交后不可变：meta 与 session_id → 段的索引都只需为新出现的段读取一次
+        self._meta_cache: Dict[str, Dict[str, Any]] = {}
+        self._session_index: Dict[str, str] = {}
+        self._indexed: Set[str] = set()
+        self._index_lock = threading.Lock()
+
+    def version(self) -> str:
+        """归档版本：已提交的段数 + 最新段名。段只追加且按时间命名，有新段写入即改变（不读 meta）。"""
+        if not os.path.isdir(self.root):
+            return "0:"
+        names = sorted(
+            name for name in os.listdir(self.root) if name.startswith("seg-") and not name.endswith(".tmp")
+        )
+        return f"{len(names)}:{names[-1] if names else ''}"
+
+    def segments(self) -> List[Tuple[str, Dict[str, Any]]]:
+        if not os.path.isdir(self.root):
+            return []
+        result: List[Tuple[str, Dict[str, Any]]] = []
+        for name in sorted(os.listdir(self.root)):
+            seg_dir = os.path.join(self.root, name)
+            meta_path = os.path.join(seg_dir, "meta.json")
+            if not name.startswith("seg-") or name.endswith(".tmp"):
+                continue
+            meta = self._meta_cache.get(seg_dir)
+            if meta is None:
+                if not os.path.exists(meta_path):
+                    continue
+                with open(meta_path, encoding="utf-8") as f:
+                    meta = self._meta_cache.setdefault(seg_dir, json.load(f))
+            result.append((seg_dir, meta))
+        return result
+
+    def session_segment(self, session_id: str) -> Optional[str]:
+        """会话最新一次归档所在的段目录（没有时返回 None）。
+
+        段目录不可变，返回值可直接作为该会话派生结果的缓存键：其他会话写入新段不会改变它，
+        本会话被重新归档时则指向新段。
+        """
+        with self._index_lock:
+            for seg_dir, meta in self.segments():
+                if seg_dir in self._indexed:
+                    continue
+                ids = meta.get("session_ids")
+                if ids is None:  # 旧格式的段没有 session_ids，只读 id 列
+                    ids = self.read_metrics(columns=["session_id"], segments=[seg_dir])["session_id"].tolist()
+                for sid in ids:
+                    # 段名按写入时间排序；并发写入方可能乱序提交，只让更晚的段覆盖
+                    if self._session_index.get(sid, "") < seg_dir:
+                        self._session_index[sid] = seg_dir
+                self._indexed.add(seg_dir)
+            return self._session_index.get(session_id)
+
+    # ----- 原始指标表 -----
+
+    def read_metrics(
+        self,
+        patient_ids: Optional[Iterable[str]] = None,
+        therapist_ids: Optional[Iterable[str]] = None,
+        columns: Optional[Sequence[str]] = None,
+        segments: Optional[Iterable[str]] = None,
+    ) -> Dict[str, np.ndarray]:
+        """读取指标表，返回 {列名: ndarray}（多段结果按写入顺序拼接）。
+
+        segments：只读这些段目录（segments() 返回的 seg_dir），用于增量读入新写入的段。
+        """
+        pids = set(patient_ids) if patient_ids is not None else None
+        tids = set(therapist_ids) if therapist_ids is not None else None
+        parts: List[Dict[str, np.ndarray]] = []
+        for seg_dir, meta in self._matching_segments(pids, tids, segments):
+            wanted = list(columns) if columns is not None else list(meta["columns"])
+            if meta["backend"] == "arrow":
+                parts.append(self._read_arrow_metrics(seg_dir, meta, wanted, pids, tids))
+            else:
+                mask = self._npy_mask(seg_dir, pids, tids)
+                parts.append(
+                    {
+                        name: self._take(self._load_npy(seg_dir, name, meta), mask)
+                        for name in wanted
+                    }
+                )
+        return _concat_parts(parts, columns)
+
+    # ----- 曲线 -----
+
+    def iter_curve_segments(
+        self,
+        curve: str,
+        patient_ids: Optional[Iterable[str]] = None,
+        therapist_ids: Optional[Iterable[str]] = None,
+        segments: Optional[Iterable[str]] = None,
+    ) -> Iterator[CurveBatch]:
+        """逐段返回曲线；无段内过滤时 values/offsets 是 mmap 视图，不发生拷贝。"""
+        pids = set(patient_ids) if patient_ids is not None else None
+        tids = set(therapist_ids) if therapist_ids is not None else None
+        for seg_dir, meta in self._matching_segments(pids, tids, segments):
+            if curve not in meta["curves"]:
+                continue
+            if meta["backend"] == "arrow":
+                batch = self._read_arrow_curve(seg_dir, meta, curve, pids, tids)
+            else:
+                mask = self._npy_mask(seg_dir, pids, tids)
+                session_ids = self._load_npy(seg_dir, "session_id", meta)
+                offsets = self._load_npy(seg_dir, f"curve.{curve}.offsets", meta)
+                values = self._load_npy(seg_dir, f"curve.{curve}.values", meta)
+                batch = _select_rows(session_ids, offsets, values, mask)
+            if len(batch):
+                yield batch
+
+    def read_curves(
+        self,
+        curve: str,
+        patient_ids: Optional[Iterable[str]] = None,
+        therapist_ids: Optional[Iterable[str]] = None,
+    ) -> CurveBatch:
+        """读取所有匹配会话的某条曲线；只有一段时直接返回该段（可能是零拷贝视图）。"""
+        batches = list(self.iter_curve_segments(curve, patient_ids, therapist_ids))
+        if len(batches) == 1:
+            return batches[0]
+        if not batches:
+            return CurveBatch(np.array([], dtype=str), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        offsets = [np.zeros(1, dtype=np.int64)]
+        base = 0
+        for b in batches:
+            offsets.append(b.offsets[1:] - b.offsets[0] + base)
+            base += int(b.offsets[-1] - b.offsets[0])
+        return CurveBatch(
+            session_ids=np.concatenate([b.session_ids for b in batches]),
+            offsets=np.concatenate(offsets),
+            values=np.concatenate([b.values[b.offsets[0] : b.offsets[-1]] for b in batches]),
+        )
+
+    def read_session_curves(
+        self,
+        session_id: str,
+        curves: Sequence[str] = ("time_bins", "therapist_curve", "patient_curve"),
+        patient_ids: Optional[Iterable[str]] = None,
+        segment: Optional[str] = None,
+    ) -> Dict[str, np.ndarray]:
+        """读取单次会话的若干曲线；同一会话归档多次时取最新一次。
+
+        传入 patient_ids 可跳过无关段；传入 segment（session_segment 的返回值）则只读该段。
+        """
+        segments = [segment] if segment is not None else None
+        result: Dict[str, np.ndarray] = {}
+        for curve in curves:
+            for batch in self.iter_curve_segments(curve, patient_ids=patient_ids, segments=segments):
+                hits = np.flatnonzero(batch.session_ids == session_id)
+                if len(hits):
+                    result[curve] = np.asarray(batch[int(hits[-1])])
+        return result
+
+    # ----- 内部工具 -----
+
+    def _matching_segments(
+        self, pids: Optional[set], tids: Optional[set], segments: Optional[Iterable[str]] = None
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        wanted = set(segments) if segments is not None else None
+        for seg_dir, meta in self.segments():
+            if wanted is not None and seg_dir not in wanted:
+                continue
+            if pids is not None and pids.isdisjoint(meta["patient_ids"]):
+                continue
+            if tids is not None and tids.isdisjoint(meta["therapist_ids"]):
+                continue
+            yield seg_dir, meta
+
+    def _load_npy(self, seg_dir: str, name: str, meta: Dict[str, Any]) -> np.ndarray:
+        path = os.path.join(seg_dir, f"{name}.npy")
+        if not os.path.exists(path):
+            return np.full(meta["rows"], np.nan, dtype=np.float64)
+        return np.load(path, mmap_mode="r" if self.memory_map else None, allow_pickle=False)
+
+    def _npy_mask(self, seg_dir: str, pids: Optional[set], tids: Optional[set]) -> Optional[np.ndarray]:
+        if pids is None and tids is None:
+            return None
+        rows = None
+        mask: Optional[np.ndarray] = None
+        for name, ids in (("patient_id", pids), ("therapist_id", tids)):
+            if ids is None:
+                continue
+            col = np.load(os.path.join(seg_dir, f"{name}.npy"), mmap_mode="r" if self.memory_map else None)
+            rows = len(col)
+            m = np.isin(col, np.array(sorted(ids), dtype=str))
+            mask = m if mask is None else (mask & m)
+        if mask is not None and rows is not None and mask.all():
+            return None
+        return mask
+
+    @staticmethod
+    def _take(arr: np.ndarray, mask: Optional[np.ndarray]) -> np.ndarray:
+        return arr if mask is None else np.asarray(arr[mask])
+
+    def _arrow_filters(self, pids: Optional[set], tids: Optional[set]) -> Optional[List[Tuple[str, str, List[str]]]]:
+        filters: List[Tuple[str, str, List[str]]] = []
+        if pids is not None:
+            filters.append(("patient_id", "in", sorted(pids)))
+        if tids is not None:
+            filters.append(("therapist_id", "in", sorted(tids)))
+        return filters or None
+
+    def _read_arrow_metrics(
+        self,
+        seg_dir: str,
+        meta: Dict[str, Any],
+        wanted: List[str],
+        pids: Optional[set],
+        tids: Optional[set],
+    ) -> Dict[str, np.ndarray]:
+        present = [c for c in wanted if c in meta["columns"]]
+        table = pq.read_table(
+            os.path.join(seg_dir, "metrics.parquet"),
+            columns=present,
+            filters=self._arrow_filters(pids, tids),
+            memory_map=self.memory_map,
+        )
+        out: Dict[str, np.ndarray] = {}
+        for name in wanted:
+            if name not in present:
+                out[name] = np.full(table.num_rows, np.nan, dtype=np.float64)
+                continue
+            col = table.column(name).to_numpy()
+            out[name] = col.astype(str) if col.dtype == object else col
+        return out
+
+    def _read_arrow_curve(
+        self,
+        seg_dir: str,
+        meta: Dict[str, Any],
+        curve: str,
+        pids: Optional[set],
+        tids: Optional[set],
+    ) -> CurveBatch:
+        source = (
+            pa.memory_map(os.path.join(seg_dir, "curves.arrow"), "r")
+            if self.memory_map
+            else pa.OSFile(os.path.join(seg_dir, "curves.arrow"), "rb")
+        )
+        table = pa_ipc.open_file(source).read_all()
+        list_col = table.column(curve).combine_chunks()
+        session_ids = np.asarray(table.column("session_id").to_pylist(), dtype=str)
+        offsets = list_col.offsets.to_numpy(zero_copy_only=True)
+        values = list_col.values.to_numpy(zero_copy_only=True)
+        mask = None
+        if pids is not None or tids is not None:
+            ids = pq.read_table(
+                os.path.join(seg_dir, "metrics.parquet"),
+                columns=["patient_id", "therapist_id"],
+                memory_map=self.memory_map,
+            )
+            mask = np.ones(meta["rows"], dtype=bool)
+            if pids is not None:
+                mask &= np.isin(np.asarray(ids.column("patient_id").to_pylist(), dtype=str), sorted(pids))
+            if tids is not None:
+                mask &= np.isin(np.asarray(ids.column("therapist_id").to_pylist(), dtype=str), sorted(tids))
+            if mask.all():
+                mask = None
+        return _select_rows(session_ids, offsets, values, mask)
+
+
+def _select_rows(
+    session_ids: np.ndarray, offsets: np.ndarray, values: np.ndarray, mask: Optional[np.ndarray]
+) -> CurveBatch:
+    if mask is None:
+        return CurveBatch(session_ids=session_ids, offsets=np.asarray(offsets), values=values)
+    idx = np.flatnonzero(mask)
+    starts = np.asarray(offsets[idx])
+    ends = np.asarray(offsets[idx + 1])
+    lengths = ends - starts
+    new_offsets = np.zeros(len(idx) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    # 向量化收集所选行的区间：每个元素的源下标 = 行起点 + 行内偏移
+    gather = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+    return CurveBatch(
+        session_ids=np.asarray(session_ids)[mask],
+        offsets=new_offsets,
+        values=np.asarray(values[gather]),
+    )
+
+
+def _concat_parts(parts: List[Dict[str, np.ndarray]], columns: Optional[Sequence[str]]) -> Dict[str, np.ndarray]:
+    if not parts:
+        return {name: np.array([]) for name in (columns or ID_COLUMNS)}
+    if len(parts) == 1:
+        return parts[0]
+    names: List[str] = []
+    for p in parts:
+        names.extend(n for n in p if n not in names)
+    out: Dict[str, np.ndarray] = {}
+    for name in names:
+        arrays = []
+        for p in parts:
+            if name in p:
+                arrays.append(np.asarray(p[name]))
+            else:
+                n_rows = len(next(iter(p.values()))) if p else 0
+                arrays.append(np.full(n_rows, np.nan, dtype=np.float64))
+        out[name] = np.concatenate(arrays)
+    return out
@@ -0,0 +1,691 @@
+"""指标链路端到端基准测试。
+
+用法（在 backend/python-api 目录下）：
+    python -m benchmarks.run_benchmarks                      # 默认 medium 规模
+    python -m benchmarks.run_benchmarks --profile long --repeat 5
+    python -m benchmarks.run_benchmarks --duration 1800 --turns 200 --emotion-rate 4
+    python -m benchmarks.run_benchmarks --save                # 保存基线到 benchmarks/baselines/<git sha>.json
+    python -m benchmarks.run_benchmarks --compare benchmarks/baselines/abc1234.json --fail-on-regression 0.2
+
+覆盖：
+- AdvancedEmotionSynchronyCalculator.calculate 及其各子步骤
+- CompatibilityMetricsAgent 的启发式指标
+- EmpathyCompositeCalculator.calculate
+- 作业本地预评分（homework_prescorer）与近似重复检索（homework_dedup）；TRIAGE_EXPECTATIONS 中的
+  分流结果不符时退出码为非零
+- 会话导出的流式导入（session_ingest，JSONL 与 JSON 数组 → SessionFrame）
+- 4 小时长会话的情绪同步：memory_bounded 模式逐行消费生成器，峰值内存超过
+  --memory-budget-mb（默认 LONG_SESSION_BUDGET_MB）时退出码为非零；同时给出先物化 dict 列表的默认模式作对照
+- 语义契合度（进程内客户端）：更正患者语句后逐句契合度缓存的失效范围与
+  ALIGNMENT_CASCADE_EXPECTATIONS 不符时退出码为非零
+- 冷启动导入耗时（新解释器中导入各模块，含解释器启动）；导入后若已加载 SciPy / dtaidistance /
+  openai / dotenv 等应延迟加载的依赖，退出码为非零
+- 完整 analyze_session（语义部分走本地 LLM 桩服务，见 llm_stub_server.py）
+
+输出：吞吐（次/秒）、p50/p99 延迟（毫秒）、峰值内存（tracemalloc，MB）。
+"""
+
+import argparse
+import copy
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from benchmarks.synthetic_sessions import generate_session, iter_emotion_timeline  # noqa: E402
+
+PROFILES: Dict[str, Dict[str, float]] = {
+    "small": {"duration": 600.0, "turns": 80, "emotion_rate": 1.0},
+    "medium": {"duration": 3000.0, "turns": 400, "emotion_rate": 1.0},
+    "long": {"duration": 7200.0, "turns": 1200, "emotion_rate": 2.0},
+}
+
+BASELINE_DIR = os.path.join(HERE, "baselines")
+
+# 冷启动导入：这些模块被导入时不应连带加载 LAZY_DEPENDENCIES（首次使用时才加载）
+IMPORT_TARGETS = (
+    "compatibility_agent",
+    "metrics.emotion_sync_advanced",
+    "metrics.multi_party_sync",
+    "metrics.semantic_alignment_advanced",
+)
+LAZY_DEPENDENCIES = ("scipy", "dtaidistance", "openai", "dotenv")
+
+# 作业预评分的分流回归样例：(作业文本, 是否应交给 LLM)
+TRIAGE_EXPECTATIONS = (
+    ("", False),
+    ("情境：开会\n情绪：\n想法：", False),
+    ("情境：上周开会时被老板点名\n情绪：焦虑 80%", False),
+    # 完整的自由叙述，只偶然出现一个标签词（“想法”）
+    (
+        "昨天下午三点在公司开周会，老板当着大家的面说我的方案考虑不周，我当时脸一下就红了，"
+        "心里特别紧张和羞愧，大概有八十分那么强烈。我脑子里第一个想法就是大家肯定都觉得我很无能，"
+        "我迟早会被开除。后来回家冷静下来想了想，其实老板只是指出了两处需要补充的数据，"
+        "上个月他还表扬过我的报告，同事下班时也来安慰我。所以更平衡的看法是：这次方案有不足，"
+        "但不代表我整个人不行。我打算明天上午十点前把数据补齐，再主动找老板确认一下修改方向。",
+        True,
+    ),
+)
+
+# 长会话内存预算：4 小时、每位说话人 2 Hz 的情绪时间线（约 11.5 万个采样点），
+# memory_bounded 模式下 tracemalloc 峰值应与采样点数无关
+LONG_SESSION_SECONDS = 4 * 3600.0
+LONG_SESSION_RATE_HZ = 2.0
+LONG_SESSION_BUDGET_MB = 8.0
+LONG_SESSION_CASE = "emotion_sync.calculate[4h,memory_bounded]"
+
+
+@dataclass
+class BenchResult:
+    name: str
+    iterations: int
+    throughput_per_s: float
+    p50_ms: float
+    p99_ms: float
+    mean_ms: float
+    peak_memory_mb: float
+
+
+@dataclass
+class BenchCase:
+    name: str
+    fn: Callable[[], Any]
+    # 单次耗时较长的用例（例如走 LLM 桩服务）可单独降低重复次数
+    repeat: Optional[int] = None
+
+
+# =============================
+# 计时与统计
+# =============================
+
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[idx]
+
+
+def run_case(case: BenchCase, repeat: int, warmup: int = 1) -> BenchResult:
+    n = case.repeat or repeat
+    for _ in range(warmup):
+        case.fn()
+
+    gc.collect()
+    timings: List[float] = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        case.fn()
+        timings.append(time.perf_counter() - t0)
+
+    # 峰值内存单独跑一次：tracemalloc 本身会显著拖慢执行，不能混进计时
+    gc.collect()
+    tracemalloc.start()
+    case.fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    total = sum(timings)
+    return BenchResult(
+        name=case.name,
+        iterations=n,
+        throughput_per_s=round(n / total, 3) if total > 0 else 0.0,
+        p50_ms=round(_percentile(timings, 0.50) * 1000, 3),
+        p99_ms=round(_percentile(timings, 0.99) * 1000, 3),
+        mean_ms=round(statistics.mean(timings) * 1000, 3),
+        peak_memory_mb=round(peak / (1024 * 1024), 3),
+    )
+
+
+# =============================
+# 用例
+# =============================
+
+
+def import_probe(module: str) -> List[str]:
+    """在新解释器中导入 module，返回随之被加载的延迟依赖（应为空）。"""
+    code = (
+        f"import sys; import {module}; "
+        f"print(','.join(m for m in {LAZY_DEPENDENCIES!r} if m in sys.modules))"
+    )
+    env = {**os.environ, "OPENROUTER_API_KEY": os.environ.get("OPENROUTER_API_KEY", "bench")}
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(HERE),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    loaded = out.stdout.strip()
+    return loaded.split(",") if loaded else []
+
+
+def find_eager_imports(modules=IMPORT_TARGETS) -> List[str]:
+    eager: List[str] = []
+    for module in modules:
+        eager.extend(f"{module} → {dep}" for dep in import_probe(module))
+    return eager
+
+
+def find_triage_mismatches(expectations=TRIAGE_EXPECTATIONS) -> List[str]:
+    from homework_prescorer import PreScorer
+
+    prescorer = PreScorer()
+    mismatches: List[str] = []
+    for text, expected in expectations:
+        prescore = prescorer.score(text)
+        if prescore.substantive != expected:
+            mismatches.append(
+                f"{text[:24]!r}…（{prescore.total_chars} 字）：期望 substantive={expected}，"
+                f"实际 {prescore.substantive}（{prescore.reason}）"
+            )
+    return mismatches
+
+
+class _FixedIssuesClient:
+    """进程内的 OpenAI 兼容客户端：核心议题固定为给定列表，其余提示词沿用桩服务的确定性响应，并按提示词类型计数。"""
+
+    def __init__(self, core_issues: List[Dict[str, Any]]) -> None:
+        self.core_issues = core_issues
+        self.calls: Dict[str, int] = {}
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, messages: List[Dict[str, Any]], **_: Any) -> Any:
+        from llm_stub_server import build_response_content, classify_prompt
+
+        prompt_type = classify_prompt(messages)
+        self.calls[prompt_type] = self.calls.get(prompt_type, 0) + 1
+        if prompt_type == "core_issues":
+            content = json.dumps({"core_issues": self.core_issues}, ensure_ascii=False)
+        else:
+            content = build_response_content(prompt_type, messages)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+# 逐句契合度缓存的级联预期：(场景, 核心议题是否改变, 改动的说话人) → 需重算的契合度调用数
+# "all" 表示前 15 句治疗师语句（去重后）都要重算
+ALIGNMENT_CASCADE_EXPECTATIONS = (
+    ("患者语句更正，抽出的议题不变（顺序/大小写不同）", "same", "patient", 0),
+    ("治疗师语句更正", "same", "therapist", 1),
+    ("患者语句更正，抽出的议题改变", "changed", "patient", "all"),
+)
+
+
+def find_alignment_cascades(session: Dict[str, Any], expectations=ALIGNMENT_CASCADE_EXPECTATIONS) -> List[str]:
+    from metrics.semantic_alignment_advanced import AdvancedSemanticAlignmentCalculator
+
+    issues = [
+        {"issue": "工作压力与自我价值感", "priority": "high"},
+        {"issue": "Sleep problems", "priority": "medium"},
+    ]
+    variants = {
+        "same": [{"issue": "sleep  problems", "priority": "Medium"}, {"issue": " 工作压力与自我价值感", "priority": "high"}],
+        "changed": issues + [{"issue": "人际冲突", "priority": "low"}],
+    }
+    transcript = session["transcript"]
+    # 同一会话里重复的治疗师语句共用一条缓存，按去重后的句数计
+    n_therapist = len(set([t["text"] for t in transcript if t["speaker"] == "therapist"][:15]))
+    mismatches: List[str] = []
+    for label, variant, speaker, expected in expectations:
+        client = _FixedIssuesClient(issues)
+        calc = AdvancedSemanticAlignmentCalculator(client)
+        calc.calculate(transcript)
+        client.core_issues = variants[variant]
+        client.calls.clear()
+        edited = copy.deepcopy(transcript)
+        turn = next(t for t in edited if t["speaker"] == speaker)
+        turn["text"] = f"{turn['text']}（更正）"
+        calc.calculate(edited)
+        want = n_therapist if expected == "all" else expected
+        got = client.calls.get("turn_alignment", 0)
+        if got != want:
+            mismatches.append(f"{label}：期望重算 {want} 次契合度调用，实际 {got} 次")
+    return mismatches
+
+
+def build_cases(session: Dict[str, Any], llm_base_url: Optional[str]) -> List[BenchCase]:
+    from compatibility_agent import CompatibilityMetricsAgent, SessionInput
+    from metrics.emotion_sync_advanced import AdvancedEmotionSynchronyCalculator
+    from metrics.empathy_composite import EmpathyCompositeCalculator
+    from metrics.multi_party_sync import MultiPartySynchronyCalculator
+    from metrics.turn_intervals import analyze_frame_intervals, analyze_turn_intervals
+    from metrics.session_frame import SessionFrame
+
+    timeline = session["emotion_timeline"]
+    emo = AdvancedEmotionSynchronyCalculator()
+    t_curve, p_curve, t_bins = emo._build_emotion_curves(timeline)
+    emotion_detail = emo.calculate(timeline)
+
+    # 每次调用都新建生成器，采样点边生成边消费（计入 tracemalloc 峰值的只有在途的几行）
+    bounded_emo = AdvancedEmotionSynchronyCalculator(memory_bounded=True)
+
+    def long_timeline() -> Any:
+        return iter_emotion_timeline(LONG_SESSION_SECONDS, LONG_SESSION_RATE_HZ, seed=7)
+
+    agent = CompatibilityMetricsAgent()
+    frame = SessionFrame.from_session(SessionInput(**session))
+
+    empathy = EmpathyCompositeCalculator()
+    multi_party = MultiPartySynchronyCalculator()
+
+    # 词级 ASR：把每个轮次切成约 0.4 秒的分段，模拟数十万分段的输入
+    seg_counts = np.maximum(1, np.ceil((frame.turn_end - frame.turn_start) / 0.4).astype(np.int64))
+    seg_turn = np.repeat(np.arange(frame.n_turns), seg_counts)
+    seg_rank = np.arange(len(seg_turn)) - np.repeat(np.cumsum(seg_counts) - seg_counts, seg_counts)
+    seg_start = frame.turn_start[seg_turn] + seg_rank * 0.4
+    seg_end = np.minimum(seg_start + 0.45, frame.turn_end[seg_turn])
+    seg_speaker = frame.turn_speaker[seg_turn]
+    semantic_detail = {
+        "overall_alignment": 0.62,
+        "reflective_language": {"reflective_rate": 0.35},
+        "cognitive_empathy": {"cognitive_empathy_score": 0.58},
+    }
+
+    cases = [
+        BenchCase("emotion_sync.calculate", lambda: emo.calculate(timeline)),
+        BenchCase("emotion_sync.build_curves", lambda: emo._build_emotion_curves(timeline)),
+        BenchCase("emotion_sync.instant_sync", lambda: emo._calculate_instant_sync(t_curve, p_curve)),
+        BenchCase("emotion_sync.lagged_sync", lambda: emo._calculate_lagged_sync(t_curve, p_curve)),
+        BenchCase("emotion_sync.dtw", lambda: emo._calculate_dtw_similarity(t_curve, p_curve)),
+        BenchCase(
+            "emotion_sync.stability", lambda: emo._analyze_therapist_stability(t_curve, p_curve)
+        ),
+        BenchCase(
+            "emotion_sync.over_sync",
+            lambda: emo._detect_over_synchronization(t_curve, p_curve, timeline),
+        ),
+        BenchCase("emotion_sync.permutation_test", lambda: emo._permutation_test(t_curve, p_curve)),
+        BenchCase(
+            "emotion_sync.rolling_sync",
+            lambda: emo._calculate_rolling_sync(t_curve, p_curve, t_bins),
+        ),
+        BenchCase(
+            LONG_SESSION_CASE,
+            lambda: bounded_emo.calculate(long_timeline()),
+            repeat=1,
+        ),
+        BenchCase(
+            "emotion_sync.calculate[4h]",
+            lambda: emo.calculate(list(long_timeline())),
+            repeat=1,
+        ),
+        BenchCase("agent.session_frame", lambda: SessionFrame.from_session(SessionInput(**session))),
+        BenchCase("agent.emotion_synchrony", lambda: agent._metric_emotion_synchrony(frame)),
+        BenchCase(
+            "agent.emotion_synchrony_fallback", lambda: agent._fallback_emotion_synchrony(frame)
+        ),
+        BenchCase(
+            "agent.emotion_synchrony_fallback[pure_python]",
+            lambda: agent._fallback_emotion_synchrony(frame, use_numpy=False),
+        ),
+        BenchCase("agent.linguistic_mirroring", lambda: agent._metric_linguistic_mirroring(frame)),
+        BenchCase(
+            "agent.semantic_alignment_heuristic",
+            lambda: agent._metric_semantic_alignment(frame),
+        ),
+        BenchCase("multi_party.calculate", lambda: multi_party.calculate(frame)),
+        BenchCase("turn_intervals.analyze", lambda: analyze_frame_intervals(frame)),
+        BenchCase(
+            f"turn_intervals.analyze[word_level,{len(seg_turn)}]",
+            lambda: analyze_turn_intervals(seg_speaker, seg_start, seg_end, len(frame.speakers)),
+        ),
+        BenchCase("agent.talk_ratio", lambda: agent._metric_talk_ratio(frame)),
+        BenchCase("agent.response_latency", lambda: agent._metric_response_latency(frame)),
+        BenchCase(
+            "empathy_composite.calculate",
+            lambda: empathy.calculate(
+                emotion_sync_data=emotion_detail,
+                semantic_alignment_data=semantic_detail,
+                linguistic_mirroring_data={"overall_score": 0.3},
+            ),
+        ),
+    ]
+
+    # 归档回算：10 万次会话的分量矩阵批量评分 / 拟合权重（不调用 LLM）
+    archive_rng = np.random.default_rng(0)
+    archive_components = archive_rng.random((100_000, 6))
+    archive_ratings = np.clip(
+        empathy.calculate_batch(archive_components).scores + archive_rng.normal(0, 5, 100_000), 0, 100
+    )
+    cases.append(
+        BenchCase(
+            "empathy_composite.calculate_batch[100000]",
+            lambda: empathy.calculate_batch(archive_components),
+        )
+    )
+    cases.append(
+        BenchCase(
+            "empathy_composite.fit_weights[100000]",
+            lambda: empathy.fit_weights(archive_components, archive_ratings),
+            repeat=5,
+        )
+    )
+
+    # 流式导入：同一会话重复 20 次的导出（内存中的字节，不含磁盘 I/O）
+    from session_ingest import SessionIngestor
+
+    export_line = json.dumps(session, ensure_ascii=False).encode("utf-8")
+    export_jsonl = b"\n".join([export_line] * 20)
+    export_array = b"[" + b",".join([export_line] * 20) + b"]"
+    cases.append(
+        BenchCase(
+            "session_ingest.jsonl[20_sessions]",
+            lambda: sum(1 for _ in SessionIngestor().iter_sessions(io.BytesIO(export_jsonl))),
+            repeat=3,
+        )
+    )
+    cases.append(
+        BenchCase(
+            "session_ingest.json_array[20_sessions]",
+            lambda: sum(1 for _ in SessionIngestor().iter_sessions(io.BytesIO(export_array))),
+            repeat=3,
+        )
+    )
+
+    from homework_prescorer import PreScorer
+
+    prescorer = PreScorer()
+    homework_text = "情境：" + "".join(t["text"] for t in session["transcript"][:4]) + "\n情绪：焦虑 80%\n" + (
+        "自动想法：我做不好。证据：上次被批评。替代想法：这次只是部分要改。行动计划：明天 3 点前列出修改点"
+    )
+    cases.append(BenchCase("homework_prescorer.score", lambda: prescorer.score(homework_text)))
+
+    # 近似重复作业检索：索引在预热调用中建立（不计入计时）
+    dedup_state: Dict[str, Any] = {}
+    dedup_size = 5000
+
+    def dedup_query() -> Any:
+        if not dedup_state:
+            from homework_dedup import MinHashIndex
+
+            rng = np.random.default_rng(0)
+            pieces = [t["text"] for t in session["transcript"]]
+            index = MinHashIndex()
+            for i in range(dedup_size):
+                picks = rng.choice(len(pieces), size=min(6, len(pieces)), replace=False)
+                index.add(str(i), "".join(pieces[j] for j in picks))
+            dedup_state.update(index=index, probe="".join(pieces[:6]), counter=0)
+        dedup_state["counter"] += 1
+        return dedup_state["index"].query(f"{dedup_state['probe']}{dedup_state['counter']}")
+
+    cases.append(BenchCase(f"homework_dedup.query[{dedup_size}]", dedup_query))
+
+    # 语义契合度（进程内客户端）：每轮更正一句患者发言，核心议题重新抽取但结果不变
+    semantic_client = _FixedIssuesClient([{"issue": "工作压力与自我价值感", "priority": "high"}])
+    semantic_calc = None
+    patient_turn = next((i for i, t in enumerate(session["transcript"]) if t["speaker"] == "patient"), None)
+    patient_edits = [0]
+
+    def semantic_patient_edit() -> Any:
+        nonlocal semantic_calc
+        if semantic_calc is None:
+            from metrics.semantic_alignment_advanced import AdvancedSemanticAlignmentCalculator
+
+            semantic_calc = AdvancedSemanticAlignmentCalculator(semantic_client)
+        patient_edits[0] += 1
+        edited = copy.deepcopy(session["transcript"])
+        if patient_turn is not None:
+            edited[patient_turn]["text"] = f"{edited[patient_turn]['text']}（更正 {patient_edits[0]}）"
+        return semantic_calc.calculate(edited)
+
+    if patient_turn is not None:
+        cases.append(BenchCase("semantic.alignment[patient_edit]", semantic_patient_edit))
+
+    # 冷启动导入（每次起一个新解释器，耗时含解释器启动）
+    cases.append(BenchCase("import.python[startup]", lambda: import_probe("sys"), repeat=5))
+    for module in IMPORT_TARGETS:
+        cases.append(BenchCase(f"import.{module}[cold]", lambda m=module: import_probe(m), repeat=5))
+
+    if llm_base_url:
+        from openai import OpenAI
+
+        full_agent = CompatibilityMetricsAgent()
+        full_agent.set_semantic_client(OpenAI(base_url=llm_base_url, api_key="stub"))
+
+        def analyze_cold() -> Any:
+            full_agent.clear_metric_cache()
+            return full_agent.analyze_session(copy.deepcopy(session))
+
+        # 增量：预热一次后，每轮只改写一句治疗师发言（模拟 ASR 更正）
+        incremental_agent = CompatibilityMetricsAgent()
+        incremental_agent.set_semantic_client(OpenAI(base_url=llm_base_url, api_key="stub"))
+        incremental_agent.analyze_session(copy.deepcopy(session))
+        therapist_turns = [i for i, t in enumerate(session["transcript"]) if t["speaker"] == "therapist"]
+        edit_counter = [0]
+
+        def analyze_one_turn_edit() -> Any:
+            edit_counter[0] += 1
+            edited = copy.deepcopy(session)
+            if therapist_turns:
+                turn = edited["transcript"][therapist_turns[0]]
+                turn["text"] = f"{turn['text']}（更正 {edit_counter[0]}）"
+            return incremental_agent.analyze_session(edited)
+
+        cases.append(BenchCase("agent.analyze_session[stub_llm]", analyze_cold, repeat=3))
+        cases.append(
+            BenchCase("agent.analyze_session[stub_llm,one_turn_edit]", analyze_one_turn_edit, repeat=3)
+        )
+    return cases
+
+
+# =============================
+# 输出 / 基线
+# =============================
+
+
+def print_table(results: List[BenchResult], baseline: Optional[Dict[str, Any]] = None) -> None:
+    header = f"{'benchmark':<48}{'iters':>6}{'ops/s':>12}{'p50 ms':>12}{'p99 ms':>12}{'peak MB':>10}"
+    if baseline:
+        header += f"{'Δp50':>10}"
+    print(header)
+    print("-" * len(header))
+    base_results = (baseline or {}).get("results", {})
+    for r in results:
+        line = (
+            f"{r.name:<48}{r.iterations:>6}{r.throughput_per_s:>12.2f}"
+            f"{r.p50_ms:>12.3f}{r.p99_ms:>12.3f}{r.peak_memory_mb:>10.2f}"
+        )
+        if baseline:
+            prev = base_results.get(r.name)
+            if prev and prev.get("p50_ms"):
+                delta = (r.p50_ms - prev["p50_ms"]) / prev["p50_ms"] * 100
+                line += f"{delta:>+9.1f}%"
+            else:
+                line += f"{'n/a':>10}"
+        print(line)
+
+
+def find_regressions(
+    results: List[BenchResult], baseline: Dict[str, Any], threshold: float
+) -> List[str]:
+    """p50 延迟或峰值内存相对基线增长超过 threshold（比例）即视为回归。"""
+    regressions: List[str] = []
+    base_results = baseline.get("results", {})
+    for r in results:
+        prev = base_results.get(r.name)
+        if not prev:
+            continue
+        for key in ("p50_ms", "peak_memory_mb"):
+            old = float(prev.get(key) or 0.0)
+            new = float(getattr(r, key))
+            if old > 0 and (new - old) / old > threshold:
+                regressions.append(f"{r.name}.{key}: {old:.3f} → {new:.3f}")
+    return regressions
+
+
+def _git_revision() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=HERE,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return out.stdout.strip()
+    except Exception:  # noqa: BLE001
+        return "unknown"
+
+
+def save_baseline(results: List[BenchResult], config: Dict[str, Any], path: Optional[str]) -> str:
+    revision = _git_revision()
+    if path is None:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{revision}.json")
+    payload = {
+        "meta": {
+            "git_revision": revision,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": config,
+        },
+        "results": {r.name: asdict(r) for r in results},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    return path
+
+
+# =============================
+# 入口
+# =============================
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="CBT 指标链路基准测试")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="medium")
+    parser.add_argument("--duration", type=float, help="会话时长（秒），覆盖 profile")
+    parser.add_argument("--turns", type=int, help="转写轮次数，覆盖 profile")
+    parser.add_argument("--emotion-rate", type=float, help="情绪采样率（Hz），覆盖 profile")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--filter", default="", help="只运行名称包含该子串的用例")
+    parser.add_argument("--no-llm", action="store_true", help="跳过走 LLM 桩服务的完整 analyze_session")
+    parser.add_argument("--llm-base-url", help="使用已运行的桩服务/网关，而不是自动启动本地桩服务")
+    parser.add_argument("--stub-port", type=int, default=8010)
+    parser.add_argument("--save", nargs="?", const="", help="保存 JSON 基线（可指定路径）")
+    parser.add_argument("--compare", help="与指定 JSON 基线对比")
+    parser.add_argument(
+        "--fail-on-regression",
+        type=float,
+        metavar="RATIO",
+        help="与基线相比 p50/峰值内存增长超过该比例时返回非零退出码（例如 0.2）",
+    )
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=float,
+        default=LONG_SESSION_BUDGET_MB,
+        help=f"{LONG_SESSION_CASE} 的峰值内存上限（MB），超出时返回非零退出码",
+    )
+    args = parser.parse_args(argv)
+
+    cfg = dict(PROFILES[args.profile])
+    if args.duration is not None:
+        cfg["duration"] = args.duration
+    if args.turns is not None:
+        cfg["turns"] = args.turns
+    if args.emotion_rate is not None:
+        cfg["emotion_rate"] = args.emotion_rate
+    config = {**cfg, "profile": args.profile, "seed": args.seed, "repeat": args.repeat}
+
+    session = generate_session(
+        duration_seconds=cfg["duration"],
+        n_turns=int(cfg["turns"]),
+        emotion_rate_hz=cfg["emotion_rate"],
+        seed=args.seed,
+    )
+    print(
+        f"会话规模：{cfg['duration']:.0f}s，{len(session['transcript'])} 轮，"
+        f"{len(session['emotion_timeline'])} 个情绪采样点"
+    )
+
+    server = thread = None
+    llm_base_url = args.llm_base_url
+    if not args.no_llm and not llm_base_url:
+        from llm_stub_server import StubConfig, start_stub_server_in_thread
+
+        server, thread, llm_base_url = start_stub_server_in_thread(
+            StubConfig(seed=args.seed), port=args.stub_port
+        )
+
+    try:
+        cases = build_cases(session, None if args.no_llm else llm_base_url)
+        if args.filter:
+            cases = [c for c in cases if args.filter in c.name]
+        results = [run_case(c, args.repeat) for c in cases]
+    finally:
+        if server is not None:
+            server.should_exit = True
+            thread.join(timeout=5)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+
+    exit_code = 0
+    import_targets = [m for m in IMPORT_TARGETS if any(c.name == f"import.{m}[cold]" for c in cases)]
+    if import_targets:
+        eager = find_eager_imports(import_targets)
+        if eager:
+            print("\n⚠️ 导入时加载了应延迟加载的依赖：")
+            for item in eager:
+                print(f"  - {item}")
+            exit_code = 1
+
+    if any(c.name == "semantic.alignment[patient_edit]" for c in cases):
+        cascades = find_alignment_cascades(session)
+        if cascades:
+            print("\n⚠️ 逐句契合度缓存的失效范围与预期不符：")
+            for item in cascades:
+                print(f"  - {item}")
+            exit_code = 1
+
+    if any(c.name == "homework_prescorer.score" for c in cases):
+        mismatches = find_triage_mismatches()
+        if mismatches:
+            print("\n⚠️ 作业预评分分流与预期不符：")
+            for item in mismatches:
+                print(f"  - {item}")
+            exit_code = 1
+
+    for r in results:
+        if r.name == LONG_SESSION_CASE and r.peak_memory_mb > args.memory_budget_mb:
+            print(f"\n⚠️ {r.name} 峰值内存 {r.peak_memory_mb:.2f} MB，超出预算 {args.memory_budget_mb:.2f} MB")
+            exit_code = 1
+
+    if args.save is not None:
+        path = save_baseline(results, config, args.save or None)
+        print(f"\n基线已保存：{path}")
+
+    if baseline is not None and args.fail_on_regression is not None:
+        regressions = find_regressions(results, baseline, args.fail_on_regression)
+        if regressions:
+            print("\n⚠️ 检测到性能回归：")
+            for item in regressions:
+                print(f"  - {item}")
+            return 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""合成会话数据生成器（基准测试用）。
+
+生成与 `SessionInput` 字段一致的会话字典：
+- 转写：治疗师/患者交替发言，时长、间隔带随机抖动，偶尔出现抢话重叠
+- 情绪时间线：按采样率为每位说话人生成 valence/arousal，患者曲线为随机游走，
+  治疗师曲线带滞后地跟随患者（便于同步类指标得到有意义的数值）
+同一 seed 生成的数据完全一致，保证不同提交之间的基准可比。
+"""
+
+import random
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, Iterator, List, Sequence
+
+_THERAPIST_LINES = [
+    "你好，最近感觉怎么样？",
+    "听起来你对自己的要求很高。",
+    "当时你脑海里闪过的第一个想法是什么？",
+    "有没有什么证据支持或者反对这个想法？",
+    "我听到你说你很失望，也有些生气。",
+    "如果朋友遇到同样的事情，你会怎么对他说？",
+    "我们可以试着把这个想法写下来再看看。",
+    "这周有没有哪一刻你觉得稍微轻松一点？",
+]
+_PATIENT_LINES = [
+    "最近压力挺大的，总觉得自己做得不够好。",
+    "是的，总觉得如果做不好就完蛋了。",
+    "老板批评我的时候我整个人都僵住了。",
+    "晚上经常睡不着，一直在想白天的事情。",
+    "我知道这样想不太合理，但就是控制不住。",
+    "好像所有人都在看我出丑。",
+    "其实上周有一次汇报还挺顺利的。",
+    "我不确定自己能不能做到。",
+]
+
+
+def generate_session(
+    duration_seconds: float = 3000.0,
+    n_turns: int = 400,
+    emotion_rate_hz: float = 1.0,
+    seed: int = 0,
+    speakers: Sequence[str] = ("therapist", "patient"),
+    overlap_prob: float = 0.05,
+    session_index: int = 0,
+) -> Dict[str, Any]:
+    """生成单次会话。
+
+    Args:
+        duration_seconds: 会话时长（秒）
+        n_turns: 转写轮次数（按时长均分，带抖动）
+        emotion_rate_hz: 每位说话人的情绪采样率（次/秒）
+        seed: 随机种子
+        speakers: 说话人标签，按顺序轮流发言
+        overlap_prob: 下一轮抢在上一轮结束前开始的概率
+        session_index: 会话序号（用于生成 session_id 与日期）
+    """
+    rng = random.Random(seed)
+    transcript: List[Dict[str, Any]] = []
+    slot = duration_seconds / max(1, n_turns)
+    cursor = 0.0
+    for i in range(n_turns):
+        speaker = speakers[i % len(speakers)]
+        pool = _THERAPIST_LINES if speaker == "therapist" else _PATIENT_LINES
+        if i > 0 and rng.random() < overlap_prob:
+            start = max(0.0, cursor - rng.uniform(0.1, 0.8))
+        else:
+            start = cursor + rng.uniform(0.2, min(2.0, slot * 0.3))
+        end = start + max(0.5, slot * rng.uniform(0.5, 0.9))
+        transcript.append(
+            {"speaker": speaker, "text": rng.choice(pool), "start": round(start, 3), "end": round(end, 3)}
+        )
+        cursor = end
+
+    emotion_timeline = list(_emotion_rows(rng, duration_seconds, emotion_rate_hz, speakers))
+
+    session_date = datetime(2025, 1, 6) + timedelta(days=7 * session_index)
+    return {
+        "session_id": f"bench_session_{seed}_{session_index:04d}",
+        "patient_id": f"bench_patient_{seed % 97:03d}",
+        "therapist_id": f"bench_therapist_{seed % 7:02d}",
+        "session_date": session_date.isoformat(),
+        "transcript": transcript,
+        "emotion_timeline": emotion_timeline,
+        "cbt_indicators": {"techniques_used": ["苏格拉底提问"], "technique_quality": 0.7},
+        "homework_quality": {"completion_rate": 0.8, "discussion_depth": 0.6},
+    }
+
+
+def iter_emotion_timeline(
+    duration_seconds: float = 3000.0,
+    emotion_rate_hz: float = 1.0,
+    seed: int = 0,
+    speakers: Sequence[str] = ("therapist", "patient"),
+) -> Iterator[Dict[str, Any]]:
+    """逐行生成情绪时间线（不物化列表，用于数小时长会话的内存基准）。
+
+    曲线形态与 generate_session 相同，但使用独立的随机流（不先生成转写），
+    同一 seed 的结果与 generate_session(...)["emotion_timeline"] 不同。
+    """
+    return _emotion_rows(random.Random(seed), duration_seconds, emotion_rate_hz, speakers)
+
+
+def _emotion_rows(
+    rng: random.Random, duration_seconds: float, emotion_rate_hz: float, speakers: Sequence[str]
+) -> Iterator[Dict[str, Any]]:
+    if emotion_rate_hz <= 0:
+        return
+    step = 1.0 / emotion_rate_hz
+    n_points = int(duration_seconds / step)
+    walk = 0.0
+    lag_points = max(1, int(3.0 / step))
+    # 只保留滞后窗口内的患者取值，history[0] 即 lag_points 个采样点之前的值
+    history: Deque[float] = deque(maxlen=lag_points)
+    for k in range(n_points):
+        ts = round(k * step, 3)
+        walk = max(-1.0, min(1.0, 0.97 * walk + rng.gauss(0.0, 0.08)))
+        history.append(walk)
+        follow = history[0] if len(history) >= lag_points else 0.0
+        for speaker in speakers:
+            if speaker == "patient":
+                valence = walk
+            else:
+                valence = max(-1.0, min(1.0, 0.6 * follow + rng.gauss(0.0, 0.05)))
+            yield {
+                "speaker": speaker,
+                "timestamp": ts,
+                "valence": round(valence, 4),
+                "arousal": round(min(1.0, max(0.0, 0.5 + abs(valence) * 0.4 + rng.gauss(0.0, 0.05))), 4),
+            }
+
+
+def generate_sessions(count: int, seed: int = 0, **kwargs: Any) -> List[Dict[str, Any]]:
+    """批量生成会话（每个会话使用不同的派生种子）。"""
+    return [generate_session(seed=seed * 100003 + i, session_index=i, **kwargs) for i in range(count)]
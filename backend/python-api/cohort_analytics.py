@@ -0,0 +1,366 @@
+"""全量个案（cohort）的向量化趋势与告警引擎。
+
+与 `CompatibilityMetricsAgent._analyze_trends/_check_alerts` 的区别：
+- 一次处理所有患者：历史按 (patient, 会话日期) 排序后分组，用 bincount/reduceat 做分组聚合
+- 变化率全程为数值（百分比），不再格式化成字符串再解析
+- 告警规则是对整列数组求布尔掩码，可直接回答
+  “治疗师 X 名下情绪同步下降 ≥30% 的所有患者” 这类督导查询
+
+用法：
+    history = CohortHistory.from_archive(ArchiveReader("archive/"))
+    engine = CohortAnalytics(history)
+    engine.query(metric="emotion_synchrony", field="change_rate", op="<=", value=-30.0, therapist_id="t01")
+    engine.caseload("t01")
+"""
+
+import operator
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+METRIC_NAMES = (
+    "emotion_synchrony",
+    "linguistic_mirroring",
+    "semantic_alignment",
+    "talk_ratio",
+    "response_latency",
+)
+
+_OPS: Dict[str, Callable[[np.ndarray, Any], np.ndarray]] = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "outside": lambda arr, bounds: (arr < bounds[0]) | (arr > bounds[1]),
+    "inside": lambda arr, bounds: (arr >= bounds[0]) & (arr <= bounds[1]),
+}
+
+
+# =============================
+# 历史数据（列式）
+# =============================
+
+
+class CohortHistory:
+    """按会话存储的历史指标（列式）。
+
+    - patient_codes / therapist_codes: 每行的整数编码（对应 patient_ids / therapist_ids 词表）
+    - order_keys: 会话排序键（session_date 字符串，ISO 格式可直接字典序比较）
+    - values: (n_sessions, n_metrics) float64 矩阵，缺失为 NaN
+    """
+
+    def __init__(self, metric_names: Sequence[str] = METRIC_NAMES) -> None:
+        self.metric_names = list(metric_names)
+        self._patients: List[str] = []
+        self._therapists: List[str] = []
+        self._patient_index: Dict[str, int] = {}
+        self._therapist_index: Dict[str, int] = {}
+        self._pending: List[Tuple[int, int, str, List[float]]] = []
+        self._patient_codes = np.zeros(0, dtype=np.int64)
+        self._therapist_codes = np.zeros(0, dtype=np.int64)
+        self._order_keys = np.zeros(0, dtype=str)
+        self._values = np.zeros((0, len(self.metric_names)), dtype=np.float64)
+        # 已读入的归档段目录（sync_archive 增量读取用）
+        self._archive_segments: Set[str] = set()
+        self.version = 0
+
+    # ----- 构建 -----
+
+    @classmethod
+    def from_archive(cls, reader: Any, metric_names: Sequence[str] = METRIC_NAMES) -> "CohortHistory":
+        """从 archive_store.ArchiveReader 整列读入。"""
+        history = cls(metric_names)
+        history.sync_archive(reader)
+        return history
+
+    def sync_archive(self, reader: Any) -> int:
+        """只读入归档中尚未读过的段（段写入后不再改变），返回新增的会话数。"""
+        new_segments = [seg_dir for seg_dir, _ in reader.segments() if seg_dir not in self._archive_segments]
+        if not new_segments:
+            return 0
+        columns = ["patient_id", "therapist_id", "session_date"] + [f"raw.{m}" for m in self.metric_names]
+        table = reader.read_metrics(columns=columns, segments=new_segments)
+        self._archive_segments.update(new_segments)
+        if len(table["patient_id"]) == 0:
+            return 0
+        values = np.column_stack([np.asarray(table[f"raw.{m}"], dtype=np.float64) for m in self.metric_names])
+        self.extend_arrays(table["patient_id"], table["therapist_id"], table["session_date"], values)
+        return len(values)
+
+    def append(self, patient_id: str, therapist_id: str, session_date: str, metrics: Dict[str, float]) -> None:
+        """追加单次会话（例如 analyze_session 之后），在下次读取时批量合并。"""
+        row = [float(metrics[m]) if metrics.get(m) is not None else np.nan for m in self.metric_names]
+        self._pending.append((self._code(patient_id, True), self._code(therapist_id, False), session_date, row))
+        self.version += 1
+
+    def extend_arrays(
+        self,
+        patient_ids: Iterable[str],
+        therapist_ids: Iterable[str],
+        session_dates: Iterable[str],
+        values: np.ndarray,
+    ) -> None:
+        self._flush()
+        p_codes = self._encode(np.asarray(patient_ids, dtype=str), True)
+        t_codes = self._encode(np.asarray(therapist_ids, dtype=str), False)
+        self._patient_codes = np.concatenate([self._patient_codes, p_codes])
+        self._therapist_codes = np.concatenate([self._therapist_codes, t_codes])
+        self._order_keys = np.concatenate([self._order_keys, np.asarray(session_dates, dtype=str)])
+        self._values = np.vstack([self._values, np.asarray(values, dtype=np.float64)])
+        self.version += 1
+
+    # ----- 读取 -----
+
+    @property
+    def patient_ids(self) -> np.ndarray:
+        return np.asarray(self._patients, dtype=str)
+
+    @property
+    def therapist_ids(self) -> np.ndarray:
+        return np.asarray(self._therapists, dtype=str)
+
+    def therapist_code(self, therapist_id: str) -> int:
+        """治疗师 ID → 编码；历史中未出现的治疗师返回 -1。"""
+        return self._therapist_index.get(therapist_id, -1)
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        self._flush()
+        return self._patient_codes, self._therapist_codes, self._order_keys, self._values
+
+    def __len__(self) -> int:
+        return len(self._patient_codes) + len(self._pending)
+
+    # ----- 内部 -----
+
+    def _code(self, key: str, patient: bool) -> int:
+        index = self._patient_index if patient else self._therapist_index
+        vocab = self._patients if patient else self._therapists
+        code = index.get(key)
+        if code is None:
+            code = index[key] = len(vocab)
+            vocab.append(key)
+        return code
+
+    def _encode(self, keys: np.ndarray, patient: bool) -> np.ndarray:
+        uniques, inverse = np.unique(keys, return_inverse=True)
+        mapping = np.array([self._code(str(k), patient) for k in uniques], dtype=np.int64)
+        return mapping[inverse]
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        p, t, d, v = zip(*self._pending)
+        self._pending = []
+        self._patient_codes = np.concatenate([self._patient_codes, np.asarray(p, dtype=np.int64)])
+        self._therapist_codes = np.concatenate([self._therapist_codes, np.asarray(t, dtype=np.int64)])
+        self._order_keys = np.concatenate([self._order_keys, np.asarray(d, dtype=str)])
+        self._values = np.vstack([self._values, np.asarray(v, dtype=np.float64)])
+
+
+# =============================
+# 趋势统计
+# =============================
+
+
+@dataclass
+class AlertRule:
+    """数组化告警规则：对 stats[metric][field] 做 op 比较。"""
+
+    name: str
+    metric: str
+    field: str
+    op: str
+    value: Any
+    severity: str = "medium"
+
+
+DEFAULT_ALERT_RULES: Tuple[AlertRule, ...] = (
+    AlertRule("semantic_alignment_low", "semantic_alignment", "current", "<", 0.4, "medium"),
+    AlertRule("emotion_synchrony_drop", "emotion_synchrony", "change_rate", "<=", -30.0, "medium"),
+    AlertRule("talk_ratio_imbalanced", "talk_ratio", "current", "outside", (0.2, 0.7), "low"),
+)
+
+
+class CohortAnalytics:
+    """对 CohortHistory 做全体患者的向量化趋势计算。
+
+    每位患者（按其最近一次会话的治疗师归属）得到以下字段，均为长度 n_patients 的数组：
+    - current / previous: 最近一次与上一次的值
+    - change_rate: (current - previous) / previous * 100，previous 为 0 或不存在时为 NaN
+    - rolling_mean: 最近 window 次的均值
+    - ewma: 指数加权均值（alpha 越大越偏重近期）
+    - slope: 按会话序号做最小二乘的斜率
+    - historical_avg: 不含本次的历史均值
+    """
+
+    def __init__(
+        self,
+        history: CohortHistory,
+        window: int = 3,
+        ewma_alpha: float = 0.5,
+        rules: Sequence[AlertRule] = DEFAULT_ALERT_RULES,
+    ) -> None:
+        self.history = history
+        self.window = window
+        self.ewma_alpha = ewma_alpha
+        self.rules = list(rules)
+        self._cache_version = -1
+        self._stats: Dict[str, Dict[str, np.ndarray]] = {}
+        self._patient_codes = np.zeros(0, dtype=np.int64)
+        self._therapist_of_patient = np.zeros(0, dtype=np.int64)
+        self._n_sessions = np.zeros(0, dtype=np.int64)
+
+    # ----- 计算 -----
+
+    def compute(self) -> Dict[str, Dict[str, np.ndarray]]:
+        """（按需）重算全体统计；历史未变化时直接返回缓存。"""
+        if self._cache_version == self.history.version:
+            return self._stats
+        p_codes, t_codes, order_keys, values = self.history.arrays()
+        self._cache_version = self.history.version
+        if len(p_codes) == 0:
+            self._stats = {m: {} for m in self.history.metric_names}
+            return self._stats
+
+        # 按 (patient, 日期) 排序，得到连续分组
+        order = np.lexsort((order_keys, p_codes))
+        p_sorted = p_codes[order]
+        vals = values[order]
+        t_sorted = t_codes[order]
+        n = len(p_sorted)
+
+        starts = np.flatnonzero(np.r_[True, p_sorted[1:] != p_sorted[:-1]])
+        ends = np.r_[starts[1:], n]
+        counts = ends - starts
+        group_id = np.repeat(np.arange(len(starts)), counts)
+        pos = np.arange(n) - np.repeat(starts, counts)  # 组内序号 0..k-1
+        pos_from_end = np.repeat(counts, counts) - 1 - pos
+        last_idx = ends - 1
+        prev_idx = np.where(counts >= 2, ends - 2, -1)
+        n_groups = len(starts)
+
+        self._patient_codes = p_sorted[starts]
+        self._therapist_of_patient = t_sorted[last_idx]
+        self._n_sessions = counts
+
+        alpha = self.ewma_alpha
+        # EWMA（adjust=False 形式）：最后值 = Σ w_j x_j，w_j = α(1-α)^r，组内第一项权重为 (1-α)^(k-1)
+        ewma_w = alpha * (1.0 - alpha) ** pos_from_end
+        ewma_w[pos == 0] = (1.0 - alpha) ** pos_from_end[pos == 0]
+        in_window = pos_from_end < self.window
+        x = pos.astype(np.float64)
+        sum_x = np.bincount(group_id, weights=x, minlength=n_groups)
+        sum_xx = np.bincount(group_id, weights=x * x, minlength=n_groups)
+
+        stats: Dict[str, Dict[str, np.ndarray]] = {}
+        for j, name in enumerate(self.history.metric_names):
+            y = vals[:, j]
+            current = y[last_idx]
+            previous = np.where(prev_idx >= 0, y[np.maximum(prev_idx, 0)], np.nan)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                change_rate = np.where(
+                    np.isfinite(previous) & ~np.isclose(previous, 0.0),
+                    (current - previous) / previous * 100.0,
+                    np.nan,
+                )
+                win_count = np.bincount(group_id, weights=in_window.astype(np.float64), minlength=n_groups)
+                rolling_mean = np.bincount(group_id, weights=np.where(in_window, y, 0.0), minlength=n_groups) / win_count
+                ewma = np.bincount(group_id, weights=ewma_w * y, minlength=n_groups)
+                sum_y = np.bincount(group_id, weights=y, minlength=n_groups)
+                sum_xy = np.bincount(group_id, weights=x * y, minlength=n_groups)
+                denom = counts * sum_xx - sum_x * sum_x
+                slope = np.where(denom > 0, (counts * sum_xy - sum_x * sum_y) / np.where(denom > 0, denom, 1.0), np.nan)
+                historical_avg = np.where(counts >= 2, (sum_y - current) / np.maximum(counts - 1, 1), np.nan)
+            stats[name] = {
+                "current": current,
+                "previous": previous,
+                "change_rate": change_rate,
+                "rolling_mean": rolling_mean,
+                "ewma": ewma,
+                "slope": slope,
+                "historical_avg": historical_avg,
+            }
+        self._stats = stats
+        return stats
+
+    # ----- 查询 -----
+
+    def query(
+        self,
+        metric: str,
+        field: str,
+        op: str,
+        value: Any,
+        therapist_id: Optional[str] = None,
+    ) -> Dict[str, np.ndarray]:
+        """返回满足条件的患者及其该指标统计，例如 change_rate <= -30。"""
+        stats = self.compute()
+        mask = self._predicate(stats, metric, field, op, value) & self._therapist_mask(therapist_id)
+        return self._rows(mask, {metric: stats.get(metric, {})})
+
+    def evaluate_alerts(self, therapist_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """对全部规则求掩码，返回与 _check_alerts 相同结构的告警列表。"""
+        stats = self.compute()
+        scope = self._therapist_mask(therapist_id)
+        alerts: List[Dict[str, Any]] = []
+        patient_ids = self.history.patient_ids
+        therapist_ids = self.history.therapist_ids
+        for rule in self.rules:
+            mask = self._predicate(stats, rule.metric, rule.field, rule.op, rule.value) & scope
+            # 历史为空时各指标没有统计字段，掩码全为 False
+            values = stats.get(rule.metric, {}).get(rule.field)
+            for i in np.flatnonzero(mask):
+                alerts.append({
+                    "type": rule.name,
+                    "severity": rule.severity,
+                    "metric": rule.metric,
+                    "field": rule.field,
+                    "value": float(values[i]),
+                    "patient_id": str(patient_ids[self._patient_codes[i]]),
+                    "therapist_id": str(therapist_ids[self._therapist_of_patient[i]]),
+                })
+        return alerts
+
+    def caseload(self, therapist_id: str) -> Dict[str, Any]:
+        """治疗师个案看板：名下每位患者的全部指标统计 + 各规则命中标记。"""
+        stats = self.compute()
+        mask = self._therapist_mask(therapist_id)
+        result = self._rows(mask, stats)
+        result["alerts"] = {
+            rule.name: self._predicate(stats, rule.metric, rule.field, rule.op, rule.value)[mask]
+            for rule in self.rules
+        }
+        return result
+
+    # ----- 内部 -----
+
+    def _predicate(
+        self, stats: Dict[str, Dict[str, np.ndarray]], metric: str, field: str, op: str, value: Any
+    ) -> np.ndarray:
+        if op not in _OPS:
+            raise ValueError(f"不支持的比较运算: {op}")
+        arr = stats.get(metric, {}).get(field)
+        if arr is None:
+            return np.zeros(len(self._patient_codes), dtype=bool)
+        with np.errstate(invalid="ignore"):
+            return np.asarray(_OPS[op](arr, value), dtype=bool) & ~np.isnan(arr)
+
+    def _therapist_mask(self, therapist_id: Optional[str]) -> np.ndarray:
+        if therapist_id is None:
+            return np.ones(len(self._patient_codes), dtype=bool)
+        code = self.history.therapist_code(therapist_id)
+        if code < 0:
+            return np.zeros(len(self._patient_codes), dtype=bool)
+        return self._therapist_of_patient == code
+
+    def _rows(self, mask: np.ndarray, stats: Dict[str, Dict[str, np.ndarray]]) -> Dict[str, Any]:
+        return {
+            "patient_id": self.history.patient_ids[self._patient_codes[mask]] if mask.any() else np.array([], dtype=str),
+            "n_sessions": self._n_sessions[mask],
+            "metrics": {
+                name: {field: arr[mask] for field, arr in fields.items()}
+                for name, fields in stats.items()
+            },
+        }
@@ -1,16 +1,28 @@
+import asyncio
 import math
 import os
 import statistics
 from dataclasses import dataclass, field, asdict
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
-from openai import OpenAI
-from dotenv import load_dotenv
+import numpy as np
 
 from metrics.emotion_sync_advanced import AdvancedEmotionSynchronyCalculator
 from metrics.semantic_alignment_advanced import AdvancedSemanticAlignmentCalculator
+from metrics.archive_data import ArchiveData
+from metrics.binning import bin_means_by_speaker
 from metrics.empathy_composite import EmpathyCompositeCalculator
+from metrics.llm_routing import routing_log
+from metrics.metric_graph import MetricGraph, content_hash
+from metrics.multi_party_sync import MultiPartySynchronyCalculator
+from metrics.prompt_budget import get_usage_ledger
+from metrics.session_frame import PATIENT, THERAPIST, SessionFrame
+from metrics.turn_intervals import analyze_frame_intervals
+from metrics.tracing import get_tracer
+
+if TYPE_CHECKING:  # openai 只在注入语义客户端时才需要，不在导入本模块时加载
+    from openai import OpenAI
 
 # =============================
 # 数据模型
@@ -64,6 +76,8 @@ class MetricWithTrend:
     label: str
     historical_avg: Optional[float]
     historical_values: List[float]
+    # 与 change_rate 对应的数值（百分比），供告警/统计直接使用，避免再解析字符串
+    change_rate_value: Optional[float] = None
 
 
 @dataclass
@@ -81,16 +95,6 @@ class PatientFamilyReport:
     progress: str
 
 
-@dataclass
-class ArchiveData:
-    session_id: str
-    patient_id: str
-    therapist_id: str
-    session_date: str
-    raw_metrics: Dict[str, float]
-    computed_fields: Dict[str, Any]
-
-
 @dataclass
 class CompatibilityOutput:
     therapist_report: TherapistReport
@@ -120,6 +124,18 @@ def _safe_pearson(xs: List[float], ys: List[float]) -> Optional[float]:
     return num / (den_x * den_y)
 
 
+def _array_pearson(xs: np.ndarray, ys: np.ndarray) -> Optional[float]:
+    """_safe_pearson 的向量化版本（同样在任一序列为常数时返回 None）。"""
+    if len(xs) != len(ys) or len(xs) < 2:
+        return None
+    dx = xs - xs.mean()
+    dy = ys - ys.mean()
+    den = math.sqrt(float(dx @ dx)) * math.sqrt(float(dy @ dy))
+    if den == 0:
+        return None
+    return float(dx @ dy) / den
+
+
 def _jaccard_similarity(a: List[str], b: List[str]) -> float:
     sa = set(w for w in a if w)
     sb = set(w for w in b if w)
@@ -146,15 +162,22 @@ class CompatibilityMetricsAgent:
       - 治疗师专业报告
       - 患者/家属易懂报告
       - 归档 JSON 数据
+
+    multi_speaker=True 时用于伴侣/家庭会谈：额外计算所有参与者两两之间的同步矩阵，
+    谈话比例按全部参与者（而不只是治疗师+患者）计算治疗师占比。
     """
 
-    def __init__(self) -> None:
+    def __init__(self, multi_speaker: bool = False) -> None:
+        self.multi_speaker = multi_speaker
+
         # 极简“历史数据库”：仅存在内存里，按 patient_id 记录历史指标
         self._history: Dict[str, List[Dict[str, float]]] = {}
+        # 与 _history 一一对应的 session_id，用于转写更正后替换而不是重复追加
+        self._history_sessions: Dict[str, List[str]] = {}
 
         # 高级分析器（情绪同步、语义契合、共情综合）
         self._emotion_advanced = AdvancedEmotionSynchronyCalculator()
-        self._semantic_client: Optional[OpenAI] = None
+        self._semantic_client: Optional["OpenAI"] = None
         self._semantic_advanced: Optional[AdvancedSemanticAlignmentCalculator] = None
         self._empathy_composite = EmpathyCompositeCalculator()
 
@@ -162,49 +185,139 @@ class CompatibilityMetricsAgent:
         self._last_emotion_detail: Optional[Dict[str, Any]] = None
         self._last_semantic_detail: Optional[Dict[str, Any]] = None
         self._last_empathy_composite: Optional[Dict[str, Any]] = None
-
-    def set_semantic_client(self, client: OpenAI) -> None:
+        self._last_multi_party_detail: Optional[Dict[str, Any]] = None
+
+        # 指标依赖图：转写→词汇类指标 / 语义 LLM 步骤，情绪→情绪同步，三者→共情综合
+        # 转写更正后重新分析时，只重算内容发生变化的节点
+        self._graph = MetricGraph()
+        self._graph.add_node("lexical", ("transcript",), self._node_lexical)
+        self._graph.add_node("semantic", ("transcript", "semantic_config"), self._node_semantic)
+        self._graph.add_node("emotion_sync", ("emotion",), self._node_emotion_sync)
+        self._graph.add_node("empathy", ("emotion_sync", "semantic", "lexical"), self._node_empathy)
+        if multi_speaker:
+            self._multi_party = MultiPartySynchronyCalculator()
+            self._graph.add_node("multi_party", ("transcript", "emotion"), self._node_multi_party)
+
+    def set_semantic_client(self, client: "OpenAI") -> None:
         """由外部注入 OpenRouter/OpenAI 客户端，用于高级语义契合分析。"""
         self._semantic_client = client
         self._semantic_advanced = AdvancedSemanticAlignmentCalculator(client)
 
+    def clear_metric_cache(self) -> None:
+        """清空依赖图与语义分析器的缓存（下一次分析将全部重算）。"""
+        self._graph.clear()
+        if self._semantic_advanced is not None:
+            self._semantic_advanced.clear_cache()
+
     # ======= 对外主入口 =======
 
     def analyze_session(self, session_data: Dict[str, Any]) -> CompatibilityOutput:
+        return self.analyze_frame(SessionInput(**session_data))
+
+    def analyze_frame(self, session: SessionInput, frame: Optional[SessionFrame] = None) -> CompatibilityOutput:
+        """已解析为 SessionFrame 的会话（如 session_ingest 的流式导入）：跳过 dict → 列的转换。
+
+        给出 frame 时 session 只提供 id / 日期等元数据，转写与情绪以 frame 为准。
+        """
+        tracer = get_tracer()
+        with tracer.trace(
+            "analyze_session",
+            session_id=session.session_id,
+            patient_id=session.patient_id,
+            therapist_id=session.therapist_id,
+        ), routing_log() as llm_usage:
+            output = self._analyze(session, frame)
+        self._record_llm_usage(session, llm_usage.decisions)
+        return output
+
+    async def analyze_session_async(self, session_data: Dict[str, Any], executor: Any) -> CompatibilityOutput:
+        """异步入口（HTTP 服务使用），结果与 analyze_session 相同。
+
+        依赖图中需要重算的 CPU 密集节点（情绪同步、多方同步）交给 executor（metrics_executor.MetricsExecutor）
+        在进程池中计算，LLM 语义分析在线程中并发等待；事件循环只做解析、词汇类指标与报告组装。
+        等待期间其他请求可能把依赖图缓存中的节点挤出（LRU），因此每轮等待后都重新检查失效节点，
+        直到求值时不会在事件循环里计算任何重节点。
+        """
         session = SessionInput(**session_data)
+        tracer = get_tracer()
+        with tracer.trace(
+            "analyze_session",
+            session_id=session.session_id,
+            patient_id=session.patient_id,
+            therapist_id=session.therapist_id,
+        ), routing_log() as llm_usage:
+            with tracer.span("metrics.parse_input"):
+                frame = SessionFrame.from_session(session)
+            sources = self._graph_sources(frame)
+            precomputed: Dict[str, Any] = {}
+            with tracer.span("metrics.offload") as span:
+                while True:
+                    jobs = self._offload_jobs(frame, executor, self._graph.stale(sources), precomputed)
+                    if not jobs:
+                        break
+                    span.add("jobs", len(jobs))
+                    results = await asyncio.gather(*jobs.values())
+                    precomputed.update(zip(jobs, results))
+            # 上面最后一次检查与 _analyze 之间没有 await，依赖图求值只会采用缓存或 precomputed
+            output = self._analyze(session, frame, precomputed)
+        self._record_llm_usage(session, llm_usage.decisions)
+        return output
+
+    def _offload_jobs(
+        self, frame: SessionFrame, executor: Any, stale: List[str], done: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """失效且尚未算好的重节点 → 等待对象：情绪同步 / 多方同步走进程池，LLM 语义在线程中等待。"""
+        jobs: Dict[str, Any] = {}
+        for name in stale:
+            if name in done:
+                continue
+            if name == "emotion_sync" and frame.n_emotions:
+                jobs[name] = executor.emotion_sync(frame)
+            elif name == "multi_party":
+                jobs[name] = executor.multi_party(frame)
+            elif name == "semantic":
+                jobs[name] = asyncio.to_thread(self._node_semantic, frame, None)
+        return jobs
+
+    def _record_llm_usage(self, session: SessionInput, decisions: List[Dict[str, Any]]) -> None:
+        """本次分析实际发出的 LLM 调用记入用量台账（命中缓存的步骤没有调用，不会重复计费）。"""
+        if decisions:
+            get_usage_ledger().record(decisions, session_id=session.session_id, therapist_id=session.therapist_id)
+
+    def _analyze(
+        self,
+        session: SessionInput,
+        frame: Optional[SessionFrame] = None,
+        precomputed: Optional[Dict[str, Any]] = None,
+    ) -> CompatibilityOutput:
+        tracer = get_tracer()
 
-        # 1. 计算 5 个指标（当前值）
-        metrics = self._compute_current_metrics(session)
+        # 1. 计算 5 个指标（当前值）及情绪+语义的共情综合评分
+        metrics = self._compute_current_metrics(session, frame, precomputed)
 
-        # 1.5 计算情绪+语义的共情综合评分（如果有高级结果）
-        self._last_empathy_composite = None
-        if self._last_emotion_detail is not None and self._last_semantic_detail is not None:
-            try:
-                self._last_empathy_composite = self._empathy_composite.calculate(
-                    emotion_sync_data=self._last_emotion_detail,
-                    semantic_alignment_data=self._last_semantic_detail,
-                    linguistic_mirroring_data={"overall_score": metrics.get("linguistic_mirroring", 0.0)},
-                )
-            except Exception:
-                self._last_empathy_composite = None
+        # 同一会话再次分析（如转写更正）时，替换它上次写入的历史而不是和自己比较趋势
+        self._discard_history_of(session.patient_id, session.session_id)
 
         # 2. 加载历史并做趋势分析
-        trends = self._analyze_trends(session.patient_id, metrics)
+        with tracer.span("trends"):
+            trends = self._analyze_trends(session.patient_id, metrics)
 
         # 3. 告警检查
-        alerts = self._check_alerts(session.patient_id, session.therapist_id, trends)
+        with tracer.span("alerts"):
+            alerts = self._check_alerts(session.patient_id, session.therapist_id, trends)
 
         # 4. 组装报告
-        therapist_report = self._build_therapist_report(
-            session, trends, alerts, self._last_empathy_composite
-        )
-        patient_report = self._build_patient_report(session, trends)
-        archive_data = self._build_archive_data(
-            session, metrics, trends, self._last_empathy_composite
-        )
+        with tracer.span("report.build"):
+            therapist_report = self._build_therapist_report(
+                session, trends, alerts, self._last_empathy_composite, self._last_multi_party_detail
+            )
+            patient_report = self._build_patient_report(session, trends)
+            archive_data = self._build_archive_data(
+                session, metrics, trends, self._last_empathy_composite, self._last_multi_party_detail
+            )
 
         # 5. 写入“历史”（内存版）
-        self._append_history(session.patient_id, metrics)
+        self._append_history(session.patient_id, metrics, session.session_id)
 
         return CompatibilityOutput(
             therapist_report=therapist_report,
@@ -215,74 +328,150 @@ class CompatibilityMetricsAgent:
 
     # ======= 指标计算 =======
 
-    def _compute_current_metrics(self, session: SessionInput) -> Dict[str, float]:
-        transcript = [TranscriptTurn(**t) for t in session.transcript]
-        emotions = [EmotionPoint(**e) for e in session.emotion_timeline]
-
-        emotion_sync = self._metric_emotion_synchrony(emotions)
-        linguistic_mirroring = self._metric_linguistic_mirroring(transcript)
-        semantic_alignment = self._metric_semantic_alignment(transcript)
-        talk_ratio = self._metric_talk_ratio(transcript)
-        response_latency = self._metric_response_latency(transcript)
+    def _compute_current_metrics(
+        self,
+        session: SessionInput,
+        frame: Optional[SessionFrame] = None,
+        precomputed: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, float]:
+        tracer = get_tracer()
+        # 会话只解析一次为列式 SessionFrame，所有指标与高级分析器共享
+        with tracer.span("metrics.parse_input"):
+            if frame is None:
+                frame = SessionFrame.from_session(session)
+            sources = self._graph_sources(frame)
+
+        values = self._graph.run(sources, precomputed)
+        lexical = values["lexical"]
+        emotion_sync, self._last_emotion_detail = values["emotion_sync"]
+        semantic_alignment, self._last_semantic_detail = values["semantic"]
+        self._last_empathy_composite = values["empathy"]
+        self._last_multi_party_detail = values.get("multi_party")
 
         return {
             "emotion_synchrony": emotion_sync,
-            "linguistic_mirroring": linguistic_mirroring,
+            "linguistic_mirroring": lexical["linguistic_mirroring"],
             "semantic_alignment": semantic_alignment,
+            "talk_ratio": lexical["talk_ratio"],
+            "response_latency": lexical["response_latency"],
+        }
+
+    def _graph_sources(self, frame: SessionFrame) -> Dict[str, Tuple[str, Any]]:
+        return {
+            "transcript": (frame.transcript_digest(), frame),
+            "emotion": (frame.emotion_digest(), frame),
+            # 是否启用 LLM 语义分析、以及启用时的模型 / 路由 / 提示词版本都会影响语义节点的结果
+            "semantic_config": (self._semantic_config_digest(), None),
+        }
+
+    def _semantic_config_digest(self) -> str:
+        if self._semantic_advanced is None:
+            return content_hash("heuristic")
+        return content_hash("llm", self._semantic_advanced.config_digest())
+
+    # ======= 依赖图节点（返回值会按输入内容缓存，不要修改） =======
+
+    def _node_lexical(self, frame: SessionFrame) -> Dict[str, float]:
+        tracer = get_tracer()
+        with tracer.span("metrics.linguistic_mirroring"):
+            linguistic_mirroring = self._metric_linguistic_mirroring(frame)
+        with tracer.span("metrics.talk_ratio"):
+            talk_ratio = self._metric_talk_ratio(frame)
+        with tracer.span("metrics.response_latency"):
+            response_latency = self._metric_response_latency(frame)
+        return {
+            "linguistic_mirroring": linguistic_mirroring,
             "talk_ratio": talk_ratio,
             "response_latency": response_latency,
         }
 
-    def _metric_emotion_synchrony(self, emotions: List[EmotionPoint]) -> float:
+    def _node_semantic(self, frame: SessionFrame, _config: Any) -> Tuple[float, Optional[Dict[str, Any]]]:
+        # 不经过 self._last_semantic_detail 传递明细：异步入口会在线程里并发执行本节点
+        with get_tracer().span("metrics.semantic_alignment"):
+            return self._semantic_alignment_with_detail(frame)
+
+    def _node_emotion_sync(self, frame: SessionFrame) -> Tuple[float, Optional[Dict[str, Any]]]:
+        self._last_emotion_detail = None
+        with get_tracer().span("metrics.emotion_synchrony"):
+            value = self._metric_emotion_synchrony(frame)
+        return value, self._last_emotion_detail
+
+    def _node_multi_party(self, frame: SessionFrame, _emotion_frame: SessionFrame) -> Dict[str, Any]:
+        with get_tracer().span("metrics.multi_party"):
+            return self._multi_party.calculate(frame)
+
+    def _node_empathy(
+        self,
+        emotion_sync: Tuple[float, Optional[Dict[str, Any]]],
+        semantic: Tuple[float, Optional[Dict[str, Any]]],
+        lexical: Dict[str, float],
+    ) -> Optional[Dict[str, Any]]:
+        """情绪+语义的共情综合评分（两者都有高级结果时才计算）。"""
+        emotion_detail, semantic_detail = emotion_sync[1], semantic[1]
+        if emotion_detail is None or semantic_detail is None:
+            return None
+        try:
+            with get_tracer().span("empathy_composite"):
+                return self._empathy_composite.calculate(
+                    emotion_sync_data=emotion_detail,
+                    semantic_alignment_data=semantic_detail,
+                    linguistic_mirroring_data={"overall_score": lexical.get("linguistic_mirroring", 0.0)},
+                )
+        except Exception:
+            return None
+
+    def _metric_emotion_synchrony(self, frame: SessionFrame) -> float:
         """情绪同步指数：优先使用高级分析器，失败时回退到简化版。"""
-        if not emotions:
+        if frame.n_emotions == 0:
             self._last_emotion_detail = None
             return 0.0
 
         # 使用高级分析器
         try:
-            timeline = [
-                {
-                    "speaker": e.speaker,
-                    "timestamp": e.timestamp,
-                    "valence": e.valence,
-                    "arousal": e.arousal,
-                }
-                for e in emotions
-            ]
-            detail = self._emotion_advanced.calculate(timeline)
+            detail = self._emotion_advanced.calculate(frame)
             self._last_emotion_detail = detail
             corr = float(detail.get("instant_sync", {}).get("correlation", 0.0))
             # 把 [-1,1] 映射到 [0,1]
             return round((corr + 1.0) / 2.0, 3)
         except Exception:  # noqa: BLE001
-            # 回退到原来的简化 Pearson 版本
-            emotions_sorted = sorted(emotions, key=lambda e: e.timestamp)
-            max_ts = max(e.timestamp for e in emotions_sorted)
-            if max_ts <= 0:
-                return 0.0
-            bins = list(range(int(math.floor(max_ts)) + 1))
-            therapist_vals: List[float] = []
-            patient_vals: List[float] = []
-            for i in bins:
-                t_in_bin = [e.valence for e in emotions_sorted if e.speaker == "therapist" and i <= e.timestamp < i + 1]
-                p_in_bin = [e.valence for e in emotions_sorted if e.speaker == "patient" and i <= e.timestamp < i + 1]
-                therapist_vals.append(statistics.mean(t_in_bin) if t_in_bin else 0.0)
-                patient_vals.append(statistics.mean(p_in_bin) if p_in_bin else 0.0)
-            r = _safe_pearson(therapist_vals, patient_vals)
-            if r is None:
-                return 0.0
-            return round((r + 1.0) / 2.0, 3)
-
-    def _metric_linguistic_mirroring(self, transcript: List[TranscriptTurn]) -> float:
+            # 回退到简化 Pearson 版本（1 秒窗，与主分析器共用分箱内核）
+            return self._fallback_emotion_synchrony(frame)
+
+    def _fallback_emotion_synchrony(self, frame: SessionFrame, use_numpy: Optional[bool] = None) -> float:
+        """简化版情绪同步：1 秒窗内均值曲线的 Pearson 相关，映射到 [0,1]。
+
+        分箱 O(n + bins)；use_numpy=False 时全程纯 Python（无 NumPy 环境下的路径）。
+        """
+        max_ts = float(frame.emo_timestamp.max())
+        if max_ts <= 0:
+            return 0.0
+        n_bins = int(math.floor(max_ts)) + 1
+        curves = bin_means_by_speaker(
+            frame.emo_timestamp,
+            frame.emo_speaker,
+            frame.emo_valence,
+            codes=(THERAPIST, PATIENT),
+            width=1.0,
+            n_bins=n_bins,
+            use_numpy=use_numpy,
+        )
+        if isinstance(curves, np.ndarray):
+            r = _array_pearson(curves[0], curves[1])
+        else:
+            r = _safe_pearson(curves[0], curves[1])
+        if r is None:
+            return 0.0
+        return round((r + 1.0) / 2.0, 3)
+
+    def _metric_linguistic_mirroring(self, frame: SessionFrame) -> float:
         """语言镜像率（简化版：词汇 Jaccard + 语义近似缺省）。"""
         patient_words: List[str] = []
         therapist_words: List[str] = []
-        for t in transcript:
-            words = t.text.replace("\n", " ").split()
-            if t.speaker == "patient":
+        for code, text in zip(frame.turn_speaker.tolist(), frame.texts):
+            words = text.replace("\n", " ").split()
+            if code == PATIENT:
                 patient_words.extend(words)
-            elif t.speaker == "therapist":
+            elif code == THERAPIST:
                 therapist_words.extend(words)
         lexical = _jaccard_similarity(patient_words, therapist_words)
         # 暂无 embedding，语义镜像近似为词汇镜像
@@ -290,81 +479,76 @@ class CompatibilityMetricsAgent:
         overall = 0.3 * lexical + 0.7 * semantic
         return round(overall, 3)
 
-    def _metric_semantic_alignment(self, transcript: List[TranscriptTurn]) -> float:
+    def _metric_semantic_alignment(self, frame: SessionFrame) -> float:
         """语义契合度：优先使用高级语义模块，失败时回退到简化版。"""
+        value, self._last_semantic_detail = self._semantic_alignment_with_detail(frame)
+        return value
+
+    def _semantic_alignment_with_detail(self, frame: SessionFrame) -> Tuple[float, Optional[Dict[str, Any]]]:
         # 如已配置高级语义分析器，则调用 LLM 模块
         if self._semantic_advanced is not None:
             try:
-                transcript_dicts = [
-                    {
-                        "speaker": t.speaker,
-                        "text": t.text,
-                        "start": t.start,
-                        "end": t.end,
-                    }
-                    for t in transcript
-                ]
-                detail = self._semantic_advanced.calculate(transcript_dicts)
-                self._last_semantic_detail = detail
+                detail = self._semantic_advanced.calculate(frame)
                 overall = float(detail.get("overall_alignment", 0.0))
-                return round(overall, 3)
+                return round(overall, 3), detail
             except Exception:  # noqa: BLE001
                 # 如果高级分析失败，继续走简化逻辑
-                self._last_semantic_detail = None
+                pass
 
         # 简化启发式版本：patient→therapist 邻接轮次 Jaccard
-        pairs: List[Tuple[str, str]] = []
-        for i in range(len(transcript) - 1):
-            a, b = transcript[i], transcript[i + 1]
-            if a.speaker == "patient" and b.speaker == "therapist":
-                pairs.append((a.text, b.text))
+        sp = frame.turn_speaker
+        pair_idx = np.flatnonzero((sp[:-1] == PATIENT) & (sp[1:] == THERAPIST))
+        pairs: List[Tuple[str, str]] = [(frame.texts[i], frame.texts[i + 1]) for i in pair_idx]
         if not pairs:
-            return 0.0
+            return 0.0, None
         scores: List[float] = []
         for p_text, t_text in pairs:
             p_words = p_text.replace("\n", " ").split()
             t_words = t_text.replace("\n", " ").split()
             s = _jaccard_similarity(p_words, t_words)
             scores.append(s)
-        return round(statistics.mean(scores), 3) if scores else 0.0
+        return (round(statistics.mean(scores), 3) if scores else 0.0), None
 
-    def _metric_talk_ratio(self, transcript: List[TranscriptTurn]) -> float:
-        """谈话比例：返回治疗师说话占比（0~1）。"""
-        if not transcript:
+    def _metric_talk_ratio(self, frame: SessionFrame) -> float:
+        """谈话比例：返回治疗师说话占比（0~1）。
+
+        每人的说话时长取其自身分段的并集（区间扫描），同一人重叠的分段不会重复计时。
+        """
+        if frame.n_turns == 0:
             return 0.0
-        therapist_secs = 0.0
-        patient_secs = 0.0
-        for t in transcript:
-            dur = max(0.0, t.end - t.start)
-            if t.speaker == "therapist":
-                therapist_secs += dur
-            elif t.speaker == "patient":
-                patient_secs += dur
-        total = therapist_secs + patient_secs
+        talk = analyze_frame_intervals(frame).talk_seconds
+        therapist_secs = float(talk[THERAPIST])
+        if self.multi_speaker:
+            total = float(talk.sum())
+        else:
+            total = therapist_secs + float(talk[PATIENT])
         if total <= 0:
             return 0.0
         return round(therapist_secs / total, 3)
 
-    def _metric_response_latency(self, transcript: List[TranscriptTurn]) -> float:
+    def _metric_response_latency(self, frame: SessionFrame) -> float:
         """响应潜伏时间：平均轮换时的间隔（秒）。"""
-        if len(transcript) < 2:
+        if frame.n_turns < 2:
             return 0.0
-        gaps: List[float] = []
-        for i in range(len(transcript) - 1):
-            cur = transcript[i]
-            nxt = transcript[i + 1]
-            if cur.speaker != nxt.speaker:
-                gap = nxt.start - cur.end
-                if gap >= 0:
-                    gaps.append(gap)
-        if not gaps:
+        sp = frame.turn_speaker
+        gaps = (frame.turn_start[1:] - frame.turn_end[:-1])[sp[1:] != sp[:-1]]
+        gaps = gaps[gaps >= 0]
+        if len(gaps) == 0:
             return 0.0
-        return round(statistics.mean(gaps), 3)
+        return round(float(gaps.mean()), 3)
 
     # ======= 历史与趋势 =======
 
-    def _append_history(self, patient_id: str, metrics: Dict[str, float]) -> None:
+    def _append_history(self, patient_id: str, metrics: Dict[str, float], session_id: str = "") -> None:
         self._history.setdefault(patient_id, []).append(metrics)
+        self._history_sessions.setdefault(patient_id, []).append(session_id)
+
+    def _discard_history_of(self, patient_id: str, session_id: str) -> None:
+        """若该患者最近一条历史来自同一会话，则移除它（之后由本次结果替换）。"""
+        sessions = self._history_sessions.get(patient_id)
+        if sessions and sessions[-1] == session_id:
+            sessions.pop()
+            self._history[patient_id].pop()
 
     def _analyze_trends(self, patient_id: str, metrics: Dict[str, float]) -> Dict[str, MetricWithTrend]:
         history = self._history.get(patient_id, [])
@@ -384,6 +568,7 @@ class CompatibilityMetricsAgent:
             last = hist_values[-1]
             if math.isclose(last, 0.0):
                 change_rate = None
+                change_rate_val = None
             else:
                 change_rate_val = (current - last) / last * 100
                 change_rate = f"{change_rate_val:+.1f}%"
@@ -402,6 +587,7 @@ class CompatibilityMetricsAgent:
                 label=label,
                 historical_avg=avg,
                 historical_values=hist_values + [current],
+                change_rate_value=change_rate_val,
             )
         return trends
 
@@ -453,19 +639,16 @@ class CompatibilityMetricsAgent:
             })
         # 规则示例 2：情绪同步急剧下降
         emo = trends.get("emotion_synchrony")
-        if emo and emo.change_rate is not None and emo.trend == "下降":
-            try:
-                rate = float(emo.change_rate.replace("%", ""))
-                if rate <= -30.0:
-                    alerts.append({
-                        "type": "emotion_synchrony_drop",
-                        "severity": "medium",
-                        "message": f"情绪同步指数较上次下降 {rate:.1f}%，可能存在共情断裂。",
-                        "patient_id": patient_id,
-                        "therapist_id": therapist_id,
-                    })
-            except Exception:
-                pass
+        if emo and emo.change_rate_value is not None and emo.trend == "下降":
+            rate = emo.change_rate_value
+            if rate <= -30.0:
+                alerts.append({
+                    "type": "emotion_synchrony_drop",
+                    "severity": "medium",
+                    "message": f"情绪同步指数较上次下降 {rate:.1f}%，可能存在共情断裂。",
+                    "patient_id": patient_id,
+                    "therapist_id": therapist_id,
+                })
         # 规则示例 3：谈话比例失衡
         talk = trends.get("talk_ratio")
         if talk and (talk.current < 0.2 or talk.current > 0.7):
@@ -486,6 +669,7 @@ class CompatibilityMetricsAgent:
         trends: Dict[str, MetricWithTrend],
         alerts: List[Dict[str, Any]],
         empathy_composite: Optional[Dict[str, Any]],
+        multi_party: Optional[Dict[str, Any]] = None,
     ) -> TherapistReport:
         # 非 LLM 版本的非常简洁“临床解读”
         overall_comment = "总体沟通质量："  # 占位简单规则
@@ -514,6 +698,19 @@ class CompatibilityMetricsAgent:
                 key_findings.append(
                     f"共情综合评分为 {score:.1f}（等级：{grade}）。"
                 )
+        # 多方会谈：指出与治疗师情绪同步最弱的参与者
+        if multi_party is not None:
+            therapist_pairs = [
+                p for p in multi_party["emotion"]["pairs"]
+                if "therapist" in (p["a"], p["b"]) and p["correlation"] is not None
+            ]
+            if therapist_pairs:
+                weakest = min(therapist_pairs, key=lambda p: p["correlation"])
+                other = weakest["b"] if weakest["a"] == "therapist" else weakest["a"]
+                key_findings.append(
+                    f"多方会谈共 {multi_party['participant_count']} 位参与者，"
+                    f"与治疗师情绪同步最弱的是 {other}（r={weakest['correlation']:.2f}）。"
+                )
         clinical_interpretation = {
             "overall_rating": overall_comment,
             "key_findings": key_findings,
@@ -564,6 +761,7 @@ class CompatibilityMetricsAgent:
         metrics: Dict[str, float],
         trends: Dict[str, MetricWithTrend],
         empathy_composite: Optional[Dict[str, Any]],
+        multi_party: Optional[Dict[str, Any]] = None,
     ) -> ArchiveData:
         """构建结构化归档数据。"""
         overall_score = statistics.mean(metrics.values()) if metrics else 0.0
@@ -576,6 +774,11 @@ class CompatibilityMetricsAgent:
                 "empathy_composite_score"
             )
             computed_fields["empathy_grade"] = empathy_composite.get("grade")
+            # 子维度一并归档，供 EmpathyCompositeCalculator.calculate_batch 回算 / 校准权重
+            for name, value in empathy_composite.get("components", {}).items():
+                computed_fields[f"empathy_{name}"] = value
+        if multi_party is not None:
+            computed_fields["participant_count"] = multi_party["participant_count"]
         return ArchiveData(
             session_id=session.session_id,
             patient_id=session.patient_id,
@@ -588,6 +791,9 @@ class CompatibilityMetricsAgent:
 
 # 便于直接本地简单测试
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from openai import OpenAI
+
     # 尝试从 .env 加载 OPENROUTER_API_KEY，用于高级语义分析
     load_dotenv()
     api_key = os.getenv("OPENROUTER_API_KEY")
@@ -597,7 +803,7 @@ if __name__ == "__main__":
     if api_key:
         try:
             semantic_client = OpenAI(
-                base_url="https://openrouter.ai/api/v1",
+                base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
                 api_key=api_key,
             )
             agent.set_semantic_client(semantic_client)
@@ -0,0 +1,159 @@
+"""近似重复作业检测（MinHash + LSH）。
+
+患者经常重复提交几乎相同的思维记录，或直接照抄 HomeworkEditor 里的示例文本。
+MinHashIndex 为已评估过的作业建立 MinHash 签名与 LSH 分桶索引，新作业先在索引中
+查找相似度超过阈值的旧作业，命中时沿用旧的评估结果（见 agent_homework_evaluator）。
+
+- 文本先去掉空白与标点、转小写，再取字符 3-gram（中文没有空格分词，字符级更稳）
+- 签名 64 个哈希，分 16 个 band × 4 行；Jaccard 0.8 的两份作业至少落入同一个桶的
+  概率约 99.98%，候选再用签名估算相似度过滤（字符 3-gram 下改动两三个字即降到 0.9 左右）
+- 每个 band 的桶哈希保存为排序后的 NumPy 数组，查询是 16 次二分查找，与库大小基本无关；
+  新增的作业先放在未排序的尾部（线性比较），积累到 merge_every 条后整体重排
+
+内存：每份作业约 0.4 KB（签名 + 桶哈希 + 排序索引），不含 payload。
+"""
+
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+import numpy as np
+
+# 空白、标点与下划线（\W 在 Unicode 模式下不包含汉字）
+_NOISE = re.compile(r"[\W_]+")
+
+
+def normalize_text(text: str) -> str:
+    return _NOISE.sub("", text).lower()
+
+
+@dataclass
+class DuplicateMatch:
+    key: str
+    similarity: float
+    payload: Any
+
+
+class MinHashIndex:
+    """线程安全的 MinHash/LSH 近似重复索引（只增不删）。"""
+
+    def __init__(
+        self,
+        num_perm: int = 64,
+        bands: int = 16,
+        shingle_size: int = 3,
+        merge_every: int = 1024,
+        seed: int = 1211,
+    ) -> None:
+        if num_perm % bands != 0:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.merge_every = merge_every
+
+        rng = np.random.default_rng(seed)
+        # 乘移位哈希 h(x) = (a·x + b) >> 32（a 为奇数，uint64 自然溢出）
+        self._a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+        self._band_mix = rng.integers(1, 2**63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+
+        self._lock = threading.Lock()
+        self._count = 0
+        self._sigs = np.empty((1024, num_perm), dtype=np.uint32)
+        self._band_hashes = np.empty((1024, bands), dtype=np.uint64)
+        self._keys: List[str] = []
+        self._payloads: List[Any] = []
+        # 已排序部分：每个 band 一行（band 哈希升序）与对应的作业下标
+        self._merged = 0
+        self._sorted_hashes = np.empty((bands, 0), dtype=np.uint64)
+        self._sorted_ids = np.empty((bands, 0), dtype=np.int32)
+
+    def __len__(self) -> int:
+        return self._count
+
+    # ===== 签名 =====
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """文本的 MinHash 签名；规范化后短于 shingle_size 个字符时返回 None（不参与去重）。"""
+        norm = normalize_text(text)
+        k = self.shingle_size
+        if len(norm) < k:
+            return None
+        codes = np.frombuffer(norm.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        # k-gram 的多项式滚动哈希（向量化，uint64 溢出即取模 2^64）
+        shingles = np.zeros(len(codes) - k + 1, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            for j in range(k):
+                shingles = shingles * np.uint64(1_000_003) + codes[j : len(codes) - k + 1 + j]
+            shingles = np.unique(shingles)
+            hashed = self._a[:, None] * shingles[None, :] + self._b[:, None]
+        return (hashed >> np.uint64(32)).min(axis=1).astype(np.uint32)
+
+    def _band_hash(self, sigs: np.ndarray) -> np.ndarray:
+        rows = sigs.reshape(*sigs.shape[:-1], self.bands, self.rows).astype(np.uint64)
+        with np.errstate(over="ignore"):
+            return (rows * self._band_mix).sum(axis=-1, dtype=np.uint64)
+
+    # ===== 写入 / 查询 =====
+
+    def add(self, key: str, text: str, payload: Any = None) -> bool:
+        """加入一份作业；文本过短无法建立签名时返回 False。"""
+        sig = self.signature(text)
+        if sig is None:
+            return False
+        band_hash = self._band_hash(sig)
+        with self._lock:
+            if self._count == len(self._sigs):
+                self._sigs = np.concatenate([self._sigs, np.empty_like(self._sigs)])
+                self._band_hashes = np.concatenate([self._band_hashes, np.empty_like(self._band_hashes)])
+            self._sigs[self._count] = sig
+            self._band_hashes[self._count] = band_hash
+            self._keys.append(key)
+            self._payloads.append(payload)
+            self._count += 1
+            if self._count - self._merged >= self.merge_every:
+                self._merge_locked()
+        return True
+
+    def query(self, text: str, threshold: float = 0.8, limit: int = 5) -> List[DuplicateMatch]:
+        """相似度（签名估算的 Jaccard）≥ threshold 的已存作业，按相似度降序。"""
+        sig = self.signature(text)
+        if sig is None:
+            return []
+        band_hash = self._band_hash(sig)
+        with self._lock:
+            found = []
+            for b in range(self.bands):
+                row = self._sorted_hashes[b]
+                lo = np.searchsorted(row, band_hash[b], side="left")
+                hi = np.searchsorted(row, band_hash[b], side="right")
+                if hi > lo:
+                    found.append(self._sorted_ids[b, lo:hi])
+            tail = self._band_hashes[self._merged : self._count]
+            if len(tail):
+                found.append(self._merged + np.flatnonzero((tail == band_hash).any(axis=1)))
+            if not found:
+                return []
+            candidates = np.unique(np.concatenate(found))
+            similarity = (self._sigs[candidates] == sig).mean(axis=1)
+            keep = similarity >= threshold
+            candidates, similarity = candidates[keep], similarity[keep]
+            order = np.argsort(-similarity, kind="stable")[:limit]
+            return [
+                DuplicateMatch(self._keys[i], round(float(s), 4), self._payloads[i])
+                for i, s in zip(candidates[order], similarity[order])
+            ]
+
+    def best_match(self, text: str, threshold: float = 0.8) -> Optional[DuplicateMatch]:
+        matches = self.query(text, threshold, limit=1)
+        return matches[0] if matches else None
+
+    def _merge_locked(self) -> None:
+        hashes = self._band_hashes[: self._count]
+        order = np.argsort(hashes, axis=0, kind="stable")
+        self._sorted_hashes = np.ascontiguousarray(np.take_along_axis(hashes, order, axis=0).T)
+        self._sorted_ids = np.ascontiguousarray(order.T.astype(np.int32))
+        self._merged = self._count
@@ -0,0 +1,323 @@
+"""患者作业评分历史与趋势（按量表维度）。
+
+EvaluationReport 返回后即被丢弃，作业流程没有类似 CompatibilityMetricsAgent._history 的记录。
+HomeworkHistory 以列式数组保存每次评估的各维度分数，并为每位患者维护增量统计量：
+- 追加一次评估只更新该患者的累加和（最小二乘斜率）、EWMA 与最近 window 次的环形缓冲，O(维度数)
+- 移动平均、近期斜率与平台期判断在查询时对一批患者整列计算
+- 只有 TREND_SOURCES 中的来源（LLM 评估与沿用的评估）进入统计量；本地预评分的暂定低分与
+  评估失败的 0 分占位只保留在原始行里，不会被当成真实的下降趋势
+- caseload(therapist_id) 用一次掩码 + 稳定排序取出治疗师名下所有患者的轨迹，不需要重跑 LLM
+
+评估按追加顺序编号（x = 0, 1, 2, ...），与 cohort_analytics 按会话序号计算斜率的口径一致。
+"""
+
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+DIMENSIONS = (
+    "score_context",
+    "score_emotion",
+    "score_thought",
+    "score_restructuring",
+    "score_action_plan",
+    "total_score",
+)
+# 评分来源：LLM 评估 / 本地预评分短路 / 沿用近似重复作业的评估 / 评估失败（分数为占位）
+SOURCES = ("llm", "prescore", "duplicate", "error")
+# 计入斜率、EWMA、平台期等统计量的来源
+TREND_SOURCES = ("llm", "duplicate")
+
+
+class HomeworkHistory:
+    """按患者索引的作业评分历史。
+
+    - window：移动平均与近期斜率使用最近几次评估
+    - ewma_alpha：指数加权均值的平滑系数（越大越偏重近期）
+    - plateau_slope：近期斜率的绝对值不超过 满分 × plateau_slope 时视为平台期
+      （默认 0.025：单项每次变化 ≤ 0.5 分、总分 ≤ 2.5 分），至少需要 window 次评估
+    """
+
+    def __init__(
+        self,
+        window: int = 4,
+        ewma_alpha: float = 0.5,
+        plateau_slope: float = 0.025,
+        dimensions: Sequence[str] = DIMENSIONS,
+    ) -> None:
+        self.window = window
+        self.ewma_alpha = ewma_alpha
+        self.plateau_slope = plateau_slope
+        self.dimensions = list(dimensions)
+        # 各维度满分，用于把平台期的斜率阈值换算成分数
+        self._max_scores = np.array([100.0 if dim == "total_score" else 20.0 for dim in self.dimensions])
+        self._lock = threading.Lock()
+
+        d = len(self.dimensions)
+        # 行（每次评估）
+        self._n = 0
+        self._row_patient = np.zeros(1024, dtype=np.int32)
+        self._row_therapist = np.zeros(1024, dtype=np.int32)
+        self._row_source = np.zeros(1024, dtype=np.int8)
+        self._row_scores = np.zeros((1024, d), dtype=np.float32)
+        self._row_time: List[str] = []
+
+        # 词表
+        self._patients: List[str] = []
+        self._therapists: List[str] = []
+        self._patient_index: Dict[str, int] = {}
+        self._therapist_index: Dict[str, int] = {}
+
+        # 每位患者的增量统计量
+        self._count = np.zeros(256, dtype=np.int64)
+        self._last_therapist = np.zeros(256, dtype=np.int32)
+        self._sum_x = np.zeros(256)
+        self._sum_xx = np.zeros(256)
+        self._sum_y = np.zeros((256, d))
+        self._sum_xy = np.zeros((256, d))
+        self._ewma = np.zeros((256, d))
+        self._ring = np.zeros((256, window, d))
+
+    def __len__(self) -> int:
+        return self._n
+
+    # ===== 写入 =====
+
+    def append(
+        self,
+        patient_id: str,
+        therapist_id: str,
+        scores: Dict[str, float],
+        submitted_at: Optional[str] = None,
+        source: str = "llm",
+    ) -> None:
+        """追加一次评估（scores 以维度名为键，缺失的维度记 0）。"""
+        row = np.array([float(scores.get(dim, 0.0)) for dim in self.dimensions])
+        when = submitted_at or datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            p = self._code(patient_id, True)
+            t = self._code(therapist_id or "", False)
+            self._ingest(p, t, row, when, SOURCES.index(source))
+
+    def append_report(
+        self,
+        patient_id: str,
+        therapist_id: str,
+        report: Any,
+        submitted_at: Optional[str] = None,
+    ) -> None:
+        """追加一份 EvaluationReport；来源按 error / duplicate_of / prescore 判断。"""
+        if getattr(report, "error", None):
+            source = "error"
+        elif getattr(report, "duplicate_of", None):
+            source = "duplicate"
+        elif (getattr(report, "prescore", None) or {}).get("substantive") is False:
+            source = "prescore"
+        else:
+            source = "llm"
+        scores = {dim: getattr(report, dim) for dim in self.dimensions}
+        self.append(patient_id, therapist_id, scores, submitted_at, source)
+
+    def _ingest(self, p: int, t: int, row: np.ndarray, when: str, source: int) -> None:
+        self._append_row(p, t, row, when, source)
+        self._last_therapist[p] = t
+        if SOURCES[source] in TREND_SOURCES:
+            self._update(p, row)
+
+    def _append_row(self, p: int, t: int, row: np.ndarray, when: str, source: int) -> None:
+        if self._n == len(self._row_patient):
+            grow = len(self._row_patient)
+            self._row_patient = np.concatenate([self._row_patient, np.zeros(grow, dtype=np.int32)])
+            self._row_therapist = np.concatenate([self._row_therapist, np.zeros(grow, dtype=np.int32)])
+            self._row_source = np.concatenate([self._row_source, np.zeros(grow, dtype=np.int8)])
+            self._row_scores = np.concatenate([self._row_scores, np.zeros_like(self._row_scores)])
+        self._row_patient[self._n] = p
+        self._row_therapist[self._n] = t
+        self._row_source[self._n] = source
+        self._row_scores[self._n] = row
+        self._row_time.append(when)
+        self._n += 1
+
+    def _update(self, p: int, y: np.ndarray) -> None:
+        x = float(self._count[p])
+        self._sum_x[p] += x
+        self._sum_xx[p] += x * x
+        self._sum_y[p] += y
+        self._sum_xy[p] += x * y
+        a = self.ewma_alpha
+        self._ewma[p] = y if self._count[p] == 0 else a * y + (1.0 - a) * self._ewma[p]
+        self._ring[p, self._count[p] % self.window] = y
+        self._count[p] += 1
+
+    def _code(self, key: str, patient: bool) -> int:
+        index = self._patient_index if patient else self._therapist_index
+        vocab = self._patients if patient else self._therapists
+        code = index.get(key)
+        if code is None:
+            code = index[key] = len(vocab)
+            vocab.append(key)
+            if patient and code == len(self._count):
+                self._grow_patients()
+        return code
+
+    def _grow_patients(self) -> None:
+        for name in ("_count", "_last_therapist", "_sum_x", "_sum_xx", "_sum_y", "_sum_xy", "_ewma", "_ring"):
+            arr = getattr(self, name)
+            setattr(self, name, np.concatenate([arr, np.zeros_like(arr)]))
+
+    # ===== 趋势 =====
+
+    def trends(self, patient_codes: np.ndarray) -> Dict[str, Dict[str, np.ndarray]]:
+        """一批患者的趋势统计（各字段为长度 len(patient_codes) 的数组，NaN 表示样本不足）。
+
+        current / moving_avg / ewma / slope（全部评估）/ recent_slope（最近 window 次）/
+        plateau（布尔）/ trend（"基线" / "上升" / "下降" / "持平" / "平台期"）
+        """
+        p = np.asarray(patient_codes, dtype=np.int64)
+        w = self.window
+        n = self._count[p]
+        k = np.minimum(n, w)
+        # 环形缓冲按时间先后排列：已写满时最旧的一项在 n % w，否则从 0 开始
+        start = np.where(n >= w, n % w, 0)
+        slots = (start[:, None] + np.arange(w)[None, :]) % w
+        recent = np.take_along_axis(self._ring[p], slots[:, :, None], axis=1)  # (m, w, d)
+        valid = np.arange(w)[None, :] < k[:, None]  # (m, w)
+
+        x = np.arange(w, dtype=np.float64)[None, :] * valid
+        kx = k.astype(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sx = x.sum(axis=1)
+            sxx = (x * x).sum(axis=1)
+            sy = (recent * valid[:, :, None]).sum(axis=1)
+            sxy = (recent * x[:, :, None]).sum(axis=1)
+            recent_denom = kx * sxx - sx * sx
+            recent_slope = np.where(
+                (recent_denom > 0)[:, None], (kx[:, None] * sxy - sx[:, None] * sy) / recent_denom[:, None], np.nan
+            )
+            moving_avg = sy / kx[:, None]
+
+            nf = n.astype(np.float64)
+            denom = nf * self._sum_xx[p] - self._sum_x[p] ** 2
+            slope = np.where(
+                (denom > 0)[:, None],
+                (nf[:, None] * self._sum_xy[p] - self._sum_x[p][:, None] * self._sum_y[p]) / denom[:, None],
+                np.nan,
+            )
+        # 只有预评分 / 失败记录的患者没有可用评分：current 与 ewma 记 NaN
+        current = np.where((k > 0)[:, None], recent[np.arange(len(p)), np.maximum(k - 1, 0)], np.nan)
+        ewma = np.where((n > 0)[:, None], self._ewma[p], np.nan)
+        threshold = self._max_scores * self.plateau_slope
+        plateau = (n >= w)[:, None] & (np.abs(recent_slope) <= threshold)
+        trend = np.full(slope.shape, "持平", dtype=object)
+        trend[recent_slope > threshold] = "上升"
+        trend[recent_slope < -threshold] = "下降"
+        trend[plateau] = "平台期"
+        trend[n <= 1] = "基线"
+
+        return {
+            dim: {
+                "current": current[:, j],
+                "moving_avg": moving_avg[:, j],
+                "ewma": ewma[:, j],
+                "slope": slope[:, j],
+                "recent_slope": recent_slope[:, j],
+                "plateau": plateau[:, j],
+                "trend": trend[:, j],
+            }
+            for j, dim in enumerate(self.dimensions)
+        }
+
+    # ===== 查询 =====
+
+    def patient(self, patient_id: str) -> Optional[Dict[str, Any]]:
+        """单个患者的评分轨迹与趋势；没有记录时返回 None。"""
+        with self._lock:
+            code = self._patient_index.get(patient_id)
+            if code is None:
+                return None
+            return self._trajectories(np.array([code]))[0]
+
+    def caseload(self, therapist_id: str) -> List[Dict[str, Any]]:
+        """治疗师名下（按患者最近一次评估的治疗师归属）所有患者的轨迹与趋势。"""
+        with self._lock:
+            t = self._therapist_index.get(therapist_id)
+            if t is None:
+                return []
+            n_patients = len(self._patients)
+            codes = np.flatnonzero(self._last_therapist[:n_patients] == t)
+            return self._trajectories(codes)
+
+    def _trajectories(self, codes: np.ndarray) -> List[Dict[str, Any]]:
+        if len(codes) == 0:
+            return []
+        # 一次取出这些患者的全部行：稳定排序保持追加顺序
+        rows = np.flatnonzero(np.isin(self._row_patient[: self._n], codes))
+        rows = rows[np.argsort(self._row_patient[rows], kind="stable")]
+        owners = self._row_patient[rows]
+        bounds = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1], True])
+        scores = self._row_scores[rows]
+        sources = self._row_source[rows]
+
+        codes = owners[bounds[:-1]]
+        stats = self.trends(codes)
+        out: List[Dict[str, Any]] = []
+        for i, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+            out.append(
+                {
+                    "patient_id": self._patients[codes[i]],
+                    "therapist_id": self._therapists[self._last_therapist[codes[i]]],
+                    "n_evaluations": int(hi - lo),
+                    "n_scored": int(self._count[codes[i]]),
+                    "submitted_at": [self._row_time[r] for r in rows[lo:hi]],
+                    "source": [SOURCES[s] for s in sources[lo:hi]],
+                    "scores": {dim: scores[lo:hi, j].tolist() for j, dim in enumerate(self.dimensions)},
+                    "trends": {
+                        dim: {field: _plain(values[i]) for field, values in fields.items()}
+                        for dim, fields in stats.items()
+                    },
+                }
+            )
+        return out
+
+    # ===== 持久化 =====
+
+    def save(self, path: str) -> None:
+        """保存原始行（.npz）；增量统计量在 load 时重放得到。
+
+        写入已打开的文件句柄：np.savez 收到路径时会自动补 .npz 后缀，load(path) 便找不到文件。
+        """
+        with self._lock, open(path, "wb") as f:
+            np.savez(
+                f,
+                dimensions=np.asarray(self.dimensions, dtype=str),
+                patients=np.asarray(self._patients, dtype=str),
+                therapists=np.asarray(self._therapists, dtype=str),
+                patient=self._row_patient[: self._n],
+                therapist=self._row_therapist[: self._n],
+                source=self._row_source[: self._n],
+                scores=self._row_scores[: self._n],
+                time=np.asarray(self._row_time, dtype=str),
+            )
+
+    @classmethod
+    def load(cls, path: str, **kwargs: Any) -> "HomeworkHistory":
+        data = np.load(path)
+        history = cls(dimensions=[str(d) for d in data["dimensions"]], **kwargs)
+        patients, therapists = data["patients"], data["therapists"]
+        for p, t, s, row, when in zip(data["patient"], data["therapist"], data["source"], data["scores"], data["time"]):
+            pc = history._code(str(patients[p]), True)
+            tc = history._code(str(therapists[t]), False)
+            history._ingest(pc, tc, row.astype(np.float64), str(when), int(s))
+        return history
+
+
+def _plain(value: Any) -> Any:
+    """NumPy 标量 → JSON 可序列化的 Python 值（NaN → None）。"""
+    if isinstance(value, (np.bool_, bool)):
+        return bool(value)
+    if isinstance(value, str):
+        return value
+    value = float(value)
+    return None if np.isnan(value) else round(value, 4)
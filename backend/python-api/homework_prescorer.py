@@ -0,0 +1,216 @@
+"""CBT 作业本地预评分与分流（不调用 LLM）。
+
+evaluate_cbt_homework 的两次 GPT-4o 调用对空模板、一句话作业同样照单全收。
+PreScorer 在调用 LLM 之前用规则快速检查作业（单份耗时为微秒级）：
+- 识别五个量表维度（情境、情绪、自动思维、认知重构、行动计划）是否出现并填写了内容
+- 提取长度与具体性特征（时间地点、情绪强度百分比、情绪词、可执行的时间安排）
+- 给出各维度的暂定分（0-20，与 LLM 评分同一量表）
+
+明显未完成的作业（内容过短，或篇幅不长且填写的维度太少）直接返回模板化反馈；
+达到 min_unstructured_chars 的作业无论标签识别结果如何都交给 LLM 评估——自由叙述里
+偶然出现“想法”之类的标签词时，按标签切分得到的维度并不可靠。
+stats() 记录分流节省的 LLM 调用数与估算 token。
+"""
+
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+# 维度 → 标签（繁简体与英文，按出现位置切分作业）
+SECTION_LABELS: Dict[str, Tuple[str, ...]] = {
+    "context": ("情境", "情景", "事件", "发生了什么", "發生了什麼", "situation"),
+    "emotion": ("情绪", "情緒", "感受", "心情", "emotion", "feeling"),
+    "thought": ("自动思维", "自動思維", "自动想法", "自動想法", "想法", "念头", "念頭", "思维", "思維", "thought"),
+    "restructuring": (
+        "认知重构", "認知重構", "替代想法", "平衡想法", "合理想法", "支持的证据", "支持的證據",
+        "反对的证据", "反對的證據", "证据", "證據", "反证", "反證", "重构", "重構", "alternative",
+    ),
+    "action_plan": ("行动计划", "行動計畫", "行動計劃", "下一步", "计划", "計畫", "計劃", "action plan"),
+}
+
+SECTION_NAMES = {
+    "context": "情境描述",
+    "emotion": "情绪识别",
+    "thought": "自动思维",
+    "restructuring": "认知重构",
+    "action_plan": "行动计划",
+}
+
+# 各维度缺失 / 过短时给患者的提示
+SECTION_HINTS = {
+    "context": "写下当时发生了什么：时间、地点、和谁在一起",
+    "emotion": "写下当时的情绪，并给强度打个分（例如 焦虑 80%）",
+    "thought": "写下当时脑海里闪过的想法，尽量用原话",
+    "restructuring": "找找支持和反对这个想法的证据，再写一个更平衡的想法",
+    "action_plan": "写一件接下来可以做的具体小事，以及打算什么时候做",
+}
+
+_LABEL_SECTION = {label.lower(): name for name, labels in SECTION_LABELS.items() for label in labels}
+# 单一分组的纯文字交替（较长的标签在前），在小写文本上匹配
+_LABEL_RE = re.compile("|".join(re.escape(label) for label in sorted(_LABEL_SECTION, key=len, reverse=True)))
+# 未填写的占位内容
+_PLACEHOLDER_RE = re.compile(r"^[\s\W_]*(无|無|没有|沒有|暂无|暫無|待填|请填写|請填寫|略|n/?a|none)?[\s\W_]*$", re.IGNORECASE)
+_NOISE_RE = re.compile(r"[\s\W_]+")
+
+_TIME_PLACE_RE = re.compile(r"\d+\s*[点點时時:：]|今天|昨天|前天|早上|上午|中午|下午|晚上|周[一二三四五六日末]|週[一二三四五六日末]|在.{1,8}(里|裡|上|时|時)")
+_INTENSITY_RE = re.compile(r"\d{1,3}\s*(%|％|分)")
+_EMOTION_WORDS_RE = re.compile(
+    r"焦虑|焦慮|紧张|緊張|难过|難過|伤心|傷心|生气|生氣|愤怒|憤怒|害怕|恐惧|恐懼|沮丧|沮喪|羞愧|内疚|內疚|"
+    r"委屈|失望|孤独|孤單|担心|擔心|烦躁|煩躁|无助|無助|anxious|sad|angry|afraid"
+)
+_EVIDENCE_RE = re.compile(r"证据|證據|反证|反證|事实|事實|但是|不过|不過|其实|其實|也许|也許|可能")
+_SCHEDULE_RE = re.compile(r"明天|今晚|本周|本週|这周|這週|下周|下週|每天|\d+\s*(点|點|分钟|分鐘|次)|之前|以后|以後")
+
+_SPECIFICITY = {
+    "context": (_TIME_PLACE_RE,),
+    "emotion": (_INTENSITY_RE, _EMOTION_WORDS_RE),
+    "thought": (re.compile(r"我"),),
+    "restructuring": (_EVIDENCE_RE,),
+    "action_plan": (_SCHEDULE_RE,),
+}
+
+
+@dataclass
+class PreScore:
+    """预评分结果。sections：各维度填写的字数（未出现为 0）；scores：暂定分 0-20。"""
+
+    sections: Dict[str, int]
+    scores: Dict[str, int]
+    total_chars: int
+    specificity: Dict[str, bool]
+    missing: List[str]
+    substantive: bool
+    reason: str = ""
+
+    @property
+    def total_score(self) -> int:
+        return sum(self.scores.values())
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "sections": self.sections,
+            "scores": self.scores,
+            "total_score": self.total_score,
+            "total_chars": self.total_chars,
+            "specificity": self.specificity,
+            "missing": self.missing,
+            "substantive": self.substantive,
+            "reason": self.reason,
+        }
+
+
+@dataclass
+class TriageStats:
+    submissions: int = 0
+    short_circuited: int = 0
+    sent_to_llm: int = 0
+    llm_calls_saved: int = 0
+    prompt_tokens_saved: int = 0
+    reasons: Dict[str, int] = field(default_factory=dict)
+
+
+class PreScorer:
+    """规则预评分器。
+
+    min_sections：至少填写了几个维度才送 LLM；min_chars：去掉空白标点后的最少字数；
+    min_section_chars：某维度内容少于该字数视为未填写（只有标签或占位符）；
+    min_unstructured_chars：达到该字数的作业一律交给 LLM 判断（不论识别出几个维度），
+    维度不足的短路只用于篇幅较短的作业。
+    """
+
+    def __init__(
+        self,
+        min_sections: int = 3,
+        min_chars: int = 40,
+        min_section_chars: int = 4,
+        min_unstructured_chars: int = 120,
+    ) -> None:
+        self.min_sections = min_sections
+        self.min_chars = min_chars
+        self.min_section_chars = min_section_chars
+        self.min_unstructured_chars = min_unstructured_chars
+        self._stats = TriageStats()
+        self._lock = threading.Lock()
+
+    def score(self, text: str) -> PreScore:
+        contents = _split_sections(text)
+        sections = {name: 0 for name in SECTION_LABELS}
+        specificity = {name: False for name in SECTION_LABELS}
+        for name, content in contents.items():
+            if _PLACEHOLDER_RE.match(content):
+                continue
+            sections[name] = len(_NOISE_RE.sub("", content))
+            specificity[name] = all(p.search(content) for p in _SPECIFICITY[name])
+
+        scores = {name: _section_score(sections[name], specificity[name], self.min_section_chars) for name in sections}
+        filled = [name for name, n in sections.items() if n >= self.min_section_chars]
+        missing = [name for name in sections if name not in filled]
+        total_chars = len(_NOISE_RE.sub("", text))
+
+        reason = ""
+        if total_chars < self.min_chars:
+            reason = "too_short"
+        elif total_chars >= self.min_unstructured_chars:
+            reason = ""
+        elif len(filled) < self.min_sections:
+            reason = "missing_sections"
+        return PreScore(sections, scores, total_chars, specificity, missing, substantive=not reason, reason=reason)
+
+    def record(self, prescore: PreScore, prompt_tokens: int = 0, llm_calls: int = 2) -> None:
+        """记录一次分流结果；短路时 prompt_tokens 为本可发出的提示词 token 估算。"""
+        with self._lock:
+            self._stats.submissions += 1
+            if prescore.substantive:
+                self._stats.sent_to_llm += 1
+                return
+            self._stats.short_circuited += 1
+            self._stats.llm_calls_saved += llm_calls
+            self._stats.prompt_tokens_saved += prompt_tokens
+            self._stats.reasons[prescore.reason] = self._stats.reasons.get(prescore.reason, 0) + 1
+
+    def stats(self) -> Dict[str, float]:
+        """供 MetricsRegistry.register_gauges 使用。"""
+        with self._lock:
+            s = self._stats
+            out: Dict[str, float] = {
+                "submissions": s.submissions,
+                "short_circuited": s.short_circuited,
+                "sent_to_llm": s.sent_to_llm,
+                "llm_calls_saved": s.llm_calls_saved,
+                "prompt_tokens_saved": s.prompt_tokens_saved,
+                "saved_ratio": round(s.short_circuited / s.submissions, 4) if s.submissions else 0.0,
+            }
+            out.update({f"reason_{k}": v for k, v in s.reasons.items()})
+        return out
+
+
+def feedback_for(prescore: PreScore) -> Tuple[str, str]:
+    """短路时的模板化反馈：(医生版评语, 患者版反馈)。"""
+    filled = [SECTION_NAMES[n] for n in SECTION_LABELS if n not in prescore.missing]
+    missing = [SECTION_NAMES[n] for n in prescore.missing]
+    doctor = (
+        f"【本地预评分，未调用 LLM】作业未完成（{'内容过短' if prescore.reason == 'too_short' else '填写的维度不足'}）："
+        f"有效字数 {prescore.total_chars}，已填写 {('、'.join(filled) or '无')}，"
+        f"缺少 {('、'.join(missing) or '无')}。分数为规则估算的暂定分。"
+    )
+    hints = "\n".join(f"- {SECTION_NAMES[n]}：{SECTION_HINTS[n]}" for n in prescore.missing)
+    patient = "谢谢你开始记录，这已经是很好的一步。这份记录还有几个部分没有写完，补充之后我们能更好地一起看看：\n" + hints
+    return doctor, patient
+
+
+def _split_sections(text: str) -> Dict[str, str]:
+    """按标签出现的位置切分：每个标签之后到下一个标签之前的文字属于该维度（同一维度多次出现时拼接）。"""
+    marks = [(m.start(), m.end(), _LABEL_SECTION[m.group()]) for m in _LABEL_RE.finditer(text.lower())]
+    out: Dict[str, str] = {}
+    for i, (_, end, name) in enumerate(marks):
+        stop = marks[i + 1][0] if i + 1 < len(marks) else len(text)
+        out[name] = out.get(name, "") + text[end:stop]
+    return out
+
+
+def _section_score(chars: int, specific: bool, min_chars: int) -> int:
+    """暂定分：填写即 6 分，按字数最多再加 10 分（40 字封顶），有具体细节再加 4 分。"""
+    if chars < min_chars:
+        return 0
+    return min(20, 6 + min(10, chars * 10 // 40) + (4 if specific else 0))
@@ -0,0 +1,228 @@
+"""实时会话指标（配合 ASR 流式转写 / 情绪识别使用）。
+
+每个事件 O(1) 更新以下指标，语义与会后批量计算保持一致：
+- talk_ratio：治疗师说话时长占比（同 _metric_talk_ratio，同一人重叠的分段不重复计时）
+- response_latency：换人时的平均间隔，只计非负间隔（同 _metric_response_latency）
+- interruption_count：在他人尚未说完时开口的次数（同 metrics.turn_intervals 的定义）
+- emotion_synchrony：按 time_window 分箱后治疗师/患者 valence 均值曲线的 Pearson 相关，
+  映射到 [0,1]（同 _metric_emotion_synchrony）；空窗记 0，和主分析器一致
+
+相关系数用增量累加量 n、Σx、Σy、Σx²、Σy²、Σxy 维护，窗口关闭时更新一次。
+"""
+
+import math
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+THERAPIST = "therapist"
+PATIENT = "patient"
+
+
+class _RunningPearson:
+    """可增量更新的 Pearson 相关（O(1) 加入一个点）。"""
+
+    __slots__ = ("n", "sx", "sy", "sxx", "syy", "sxy")
+
+    def __init__(self) -> None:
+        self.n = 0
+        self.sx = self.sy = self.sxx = self.syy = self.sxy = 0.0
+
+    def add(self, x: float, y: float, count: int = 1) -> None:
+        self.n += count
+        self.sx += x * count
+        self.sy += y * count
+        self.sxx += x * x * count
+        self.syy += y * y * count
+        self.sxy += x * y * count
+
+    def correlation(self, extra: Optional[Tuple[float, float]] = None) -> Optional[float]:
+        n, sx, sy, sxx, syy, sxy = self.n, self.sx, self.sy, self.sxx, self.syy, self.sxy
+        if extra is not None:
+            x, y = extra
+            n += 1
+            sx += x
+            sy += y
+            sxx += x * x
+            syy += y * y
+            sxy += x * y
+        if n < 2:
+            return None
+        cov = n * sxy - sx * sy
+        var_x = n * sxx - sx * sx
+        var_y = n * syy - sy * sy
+        if var_x <= 1e-12 or var_y <= 1e-12:
+            return None
+        return max(-1.0, min(1.0, cov / math.sqrt(var_x * var_y)))
+
+
+class LiveSessionState:
+    """单个实时会话的滚动指标。
+
+    事件格式：
+        {"type": "turn", "speaker": "patient", "start": 12.0, "end": 15.5, "text": "..."}
+        {"type": "emotion", "speaker": "therapist", "timestamp": 13.0, "valence": -0.2, "arousal": 0.5}
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        time_window: float = 10.0,
+        talk_ratio_range: Tuple[float, float] = (0.2, 0.7),
+        min_talk_seconds: float = 60.0,
+        emotion_sync_floor: float = 0.4,
+        min_emotion_bins: int = 6,
+        interruption_limit: int = 5,
+    ) -> None:
+        self.session_id = session_id
+        self.time_window = time_window
+        self.talk_ratio_range = talk_ratio_range
+        self.min_talk_seconds = min_talk_seconds
+        self.emotion_sync_floor = emotion_sync_floor
+        self.min_emotion_bins = min_emotion_bins
+        self.interruption_limit = interruption_limit
+
+        # 转写
+        self.turn_count = 0
+        self.talk_seconds: Dict[str, float] = {}
+        self._last_speaker: Optional[str] = None
+        self._last_end = 0.0
+        # 每位说话人已说到的最晚时刻：用于同一人重叠分段去重计时、判断他人是否仍在说话
+        self._speaker_end: Dict[str, float] = {}
+        self._latency_sum = 0.0
+        self._latency_count = 0
+        self.interruption_count = 0
+
+        # 情绪（按时间窗在线分箱）
+        self._pearson = _RunningPearson()
+        self._bin: Optional[int] = None
+        self._bin_sums = {THERAPIST: 0.0, PATIENT: 0.0}
+        self._bin_counts = {THERAPIST: 0, PATIENT: 0}
+        self.emotion_samples = 0
+        self.late_samples = 0
+
+        # 告警只在状态由正常变为异常时推送一次
+        self._active_alerts: Dict[str, bool] = {}
+
+    # ===== 事件入口 =====
+
+    def handle_event(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """处理一个事件并返回推送给前端的负载（含新触发的告警）。"""
+        started = time.perf_counter()
+        etype = event.get("type")
+        if etype == "turn":
+            self.add_turn(str(event["speaker"]), float(event["start"]), float(event["end"]))
+        elif etype == "emotion":
+            self.add_emotion(str(event["speaker"]), float(event["timestamp"]), float(event["valence"]))
+        else:
+            raise ValueError(f"未知事件类型: {etype}")
+        return {
+            "type": "indicators",
+            "session_id": self.session_id,
+            "indicators": self.indicators(),
+            "alerts": self._check_alerts(),
+            "processing_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    def add_turn(self, speaker: str, start: float, end: float) -> None:
+        self.turn_count += 1
+        covered = self._speaker_end.get(speaker, float("-inf"))
+        self.talk_seconds[speaker] = self.talk_seconds.get(speaker, 0.0) + max(0.0, end - max(start, covered))
+        if end > start and start > covered:
+            # 该说话人新开口：此刻若有他人仍在说话即为打断
+            if any(s != speaker and e > start for s, e in self._speaker_end.items()):
+                self.interruption_count += 1
+        self._speaker_end[speaker] = max(covered, end)
+        if self._last_speaker is not None and speaker != self._last_speaker:
+            gap = start - self._last_end
+            if gap >= 0:
+                self._latency_sum += gap
+                self._latency_count += 1
+        self._last_speaker = speaker
+        self._last_end = end
+
+    def add_emotion(self, speaker: str, timestamp: float, valence: float) -> None:
+        if speaker not in self._bin_sums or timestamp < 0:
+            return
+        k = int(math.floor(timestamp / self.time_window))
+        if self._bin is None:
+            # 与批量分析一致：曲线从 0 时刻开始，前面的空窗都记为 (0, 0)
+            self._pearson.add(0.0, 0.0, count=k)
+            self._bin = k
+        elif k < self._bin:
+            # 已关闭的窗口不再回写（乱序到达的迟到样本）
+            self.late_samples += 1
+            return
+        elif k > self._bin:
+            self._close_bin()
+            self._pearson.add(0.0, 0.0, count=k - self._bin - 1)
+            self._bin = k
+        self._bin_sums[speaker] += valence
+        self._bin_counts[speaker] += 1
+        self.emotion_samples += 1
+
+    # ===== 指标 =====
+
+    def indicators(self) -> Dict[str, Any]:
+        therapist = self.talk_seconds.get(THERAPIST, 0.0)
+        patient = self.talk_seconds.get(PATIENT, 0.0)
+        total = therapist + patient
+        r = self._pearson.correlation(self._current_bin_point())
+        return {
+            "turns": self.turn_count,
+            "talk_ratio": round(therapist / total, 3) if total > 0 else 0.0,
+            "talk_seconds": {k: round(v, 2) for k, v in self.talk_seconds.items()},
+            "response_latency": round(self._latency_sum / self._latency_count, 3) if self._latency_count else 0.0,
+            "interruption_count": self.interruption_count,
+            "emotion_synchrony": round((r + 1.0) / 2.0, 3) if r is not None else None,
+            "emotion_bins": self._pearson.n + (1 if self._bin is not None else 0),
+            "emotion_samples": self.emotion_samples,
+        }
+
+    def _current_bin_point(self) -> Optional[Tuple[float, float]]:
+        if self._bin is None:
+            return None
+        return self._bin_mean(THERAPIST), self._bin_mean(PATIENT)
+
+    def _bin_mean(self, speaker: str) -> float:
+        c = self._bin_counts[speaker]
+        return self._bin_sums[speaker] / c if c else 0.0
+
+    def _close_bin(self) -> None:
+        self._pearson.add(self._bin_mean(THERAPIST), self._bin_mean(PATIENT))
+        for key in self._bin_sums:
+            self._bin_sums[key] = 0.0
+            self._bin_counts[key] = 0
+
+    # ===== 告警 =====
+
+    def _check_alerts(self) -> List[Dict[str, Any]]:
+        ind = self.indicators()
+        total_talk = self.talk_seconds.get(THERAPIST, 0.0) + self.talk_seconds.get(PATIENT, 0.0)
+        lo, hi = self.talk_ratio_range
+        sync = ind["emotion_synchrony"]
+        conditions = {
+            "talk_ratio_imbalanced": (
+                total_talk >= self.min_talk_seconds and not (lo <= ind["talk_ratio"] <= hi),
+                "low",
+                f"治疗师说话占比为 {ind['talk_ratio']:.2f}，建议关注患者表达空间。",
+            ),
+            "frequent_interruptions": (
+                self.interruption_count > self.interruption_limit,
+                "low",
+                f"已出现 {self.interruption_count} 次抢话/打断，可能影响患者表达。",
+            ),
+            "emotion_synchrony_low": (
+                sync is not None
+                and ind["emotion_bins"] >= self.min_emotion_bins
+                and sync < self.emotion_sync_floor,
+                "medium",
+                f"当前情绪同步指数偏低（{sync if sync is not None else 0.0:.2f}），可留意患者情绪变化。",
+            ),
+        }
+        fired: List[Dict[str, Any]] = []
+        for name, (active, severity, message) in conditions.items():
+            was_active = self._active_alerts.get(name, False)
+            self._active_alerts[name] = active
+            if active and not was_active:
+                fired.append({"type": name, "severity": severity, "message": message, "session_id": self.session_id})
+        return fired
@@ -0,0 +1,390 @@
+"""本地 OpenAI 兼容的 LLM 桩服务（离线压测 / 基准测试用）。
+
+说明：
+- 实现 `POST /v1/chat/completions`（含 stream=True 的 SSE 流式返回）与 `GET /v1/models`。
+- 按提示词内容识别 5 类调用（核心议题、回应契合度、反映性语言、作业评分、临床转化），
+  返回与真实链路 schema 一致的 JSON / 文本；同一提示词永远得到同一结果。
+- 延迟分布、错误率、随机种子均可配置，便于可复现地测量并发与缓存收益。
+- 真实代码只需把 base_url 指向本服务即可切换，例如：
+  `export OPENROUTER_BASE_URL=http://127.0.0.1:8010/v1`
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# =============================
+# 配置
+# =============================
+
+
+@dataclass
+class StubConfig:
+    """桩服务行为配置。
+
+    latency_dist:
+    - "fixed": 固定 latency_ms
+    - "uniform": latency_ms ± latency_jitter_ms 均匀分布
+    - "lognormal": 以 latency_ms 为中位数、latency_sigma 为形状参数的对数正态分布（长尾）
+    """
+
+    latency_dist: str = "fixed"
+    latency_ms: float = 0.0
+    latency_jitter_ms: float = 0.0
+    latency_sigma: float = 0.5
+    error_rate: float = 0.0
+    error_status: int = 500
+    stream_chunk_chars: int = 16
+    seed: int = 0
+
+    @classmethod
+    def from_env(cls) -> "StubConfig":
+        """从 LLM_STUB_* 环境变量读取配置。"""
+        return cls(
+            latency_dist=os.getenv("LLM_STUB_LATENCY_DIST", "fixed"),
+            latency_ms=float(os.getenv("LLM_STUB_LATENCY_MS", "0")),
+            latency_jitter_ms=float(os.getenv("LLM_STUB_LATENCY_JITTER_MS", "0")),
+            latency_sigma=float(os.getenv("LLM_STUB_LATENCY_SIGMA", "0.5")),
+            error_rate=float(os.getenv("LLM_STUB_ERROR_RATE", "0")),
+            error_status=int(os.getenv("LLM_STUB_ERROR_STATUS", "500")),
+            stream_chunk_chars=int(os.getenv("LLM_STUB_STREAM_CHUNK_CHARS", "16")),
+            seed=int(os.getenv("LLM_STUB_SEED", "0")),
+        )
+
+
+# =============================
+# 提示词识别与确定性响应
+# =============================
+
+PROMPT_TYPES = (
+    "core_issues",
+    "turn_alignment",
+    "reflective_language",
+    "homework_scoring",
+    "clinical_translation",
+)
+
+_ISSUE_POOL = [
+    "工作压力与自我价值感",
+    "完美主义与失败恐惧",
+    "人际关系中的被否定感",
+    "睡眠与情绪低落",
+    "对未来的灾难化预期",
+]
+_TECHNIQUES = ["苏格拉底提问", "情绪标注", "认知重构", "行为实验", "共情回应"]
+_REFLECTIVE_TYPES = ["emotion_labeling", "content_reflection", "validation", "open_ended_question"]
+
+
+def classify_prompt(messages: List[Dict[str, Any]]) -> str:
+    """根据提示词关键字判断调用类型（与各调用点的提示词模板一一对应）。"""
+    text = _user_text(messages)
+    if "核心关注议题" in text:
+        return "core_issues"
+    if "治疗师回应 #" in text and "契合度" in text:
+        return "turn_alignment"
+    if "反映性语言" in text:
+        return "reflective_language"
+    # 临床转化提示词内嵌了评分 JSON，需先于作业评分判断
+    if "富有同理心" in text:
+        return "clinical_translation"
+    if "score_context" in text:
+        return "homework_scoring"
+    return "generic"
+
+
+def _user_text(messages: List[Dict[str, Any]]) -> str:
+    parts: List[str] = []
+    for m in messages:
+        content = m.get("content", "")
+        if isinstance(content, list):
+            content = "".join(
+                seg.get("text", "") if isinstance(seg, dict) else str(seg) for seg in content
+            )
+        parts.append(str(content))
+    return "\n".join(parts)
+
+
+def _prompt_rng(text: str, seed: int) -> random.Random:
+    digest = hashlib.sha256(f"{seed}:{text}".encode("utf-8")).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def build_response_content(prompt_type: str, messages: List[Dict[str, Any]], seed: int = 0) -> str:
+    """生成确定性的响应正文（同一提示词 + 种子 → 同一结果）。"""
+    text = _user_text(messages)
+    rng = _prompt_rng(text, seed)
+
+    if prompt_type == "core_issues":
+        n = rng.randint(1, 3)
+        issues = [
+            {
+                "issue": issue,
+                "evidence": "患者多次提到相关困扰",
+                "priority": rng.choice(["high", "medium", "low"]),
+                "cbt_relevance": "可作为认知重构的切入点",
+            }
+            for issue in rng.sample(_ISSUE_POOL, n)
+        ]
+        return json.dumps({"core_issues": issues}, ensure_ascii=False)
+
+    if prompt_type == "turn_alignment":
+        issues = re.findall(r"^- (.+?) \(优先级", text, flags=re.MULTILINE)
+        score = round(rng.choice([0.3, 0.5, 0.7, 0.8, 1.0]), 2)
+        return json.dumps(
+            {
+                "alignment_score": score,
+                "addressed_issue": rng.choice(issues) if issues else None,
+                "technique_used": rng.choice(_TECHNIQUES),
+                "reasoning": "回应与患者关切相关",
+                "empathy_present": score >= 0.5,
+            },
+            ensure_ascii=False,
+        )
+
+    if prompt_type == "reflective_language":
+        indices = [int(i) for i in re.findall(r"^(\d+)\. ", text, flags=re.MULTILINE)]
+        total = len(indices)
+        picked = sorted(rng.sample(indices, rng.randint(0, total))) if total else []
+        utterances = [
+            {"index": i, "type": rng.choice(_REFLECTIVE_TYPES), "content": "示例"}
+            for i in picked
+        ]
+        return json.dumps(
+            {
+                "reflective_utterances": utterances,
+                "reflective_count": len(picked),
+                "total_count": total,
+                "reflective_rate": round(len(picked) / total, 2) if total else 0.0,
+            },
+            ensure_ascii=False,
+        )
+
+    if prompt_type == "homework_scoring":
+        fields = [
+            "score_context",
+            "score_emotion",
+            "score_thought",
+            "score_restructuring",
+            "score_action_plan",
+        ]
+        scores = {f: rng.randint(8, 18) for f in fields}
+        return json.dumps(
+            {
+                **scores,
+                "doctor_comments": "作业完成度较好，情境与情绪记录具体，认知重构部分可进一步展开。",
+                "total_score": sum(scores.values()),
+            },
+            ensure_ascii=False,
+        )
+
+    if prompt_type == "clinical_translation":
+        return (
+            "谢谢你认真完成这次作业，能把当时的情境和情绪写下来本身就很不容易。"
+            "你对情绪的描述很具体，这能帮助我们更好地理解那一刻发生了什么。"
+            "接下来可以试着多写一写当时脑海里闪过的想法，并找找支持和反对它的证据；"
+            "行动计划也可以再具体一点，比如写明时间和第一步要做什么。"
+            "给我的感觉是，你愿意停下来反思自己的反应，这是非常好的开始。"
+        )
+
+    return json.dumps({"result": "ok"}, ensure_ascii=False)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略 token 估计：中文按字、其余按 4 字符一个 token。"""
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿")
+    return cjk + max(0, len(text) - cjk) // 4
+
+
+# =============================
+# 服务实现
+# =============================
+
+
+class StubBehavior:
+    """延迟与错误注入（全局 RNG 由种子初始化，保证整轮压测可复现）。"""
+
+    def __init__(self, config: StubConfig) -> None:
+        self.config = config
+        self._rng = random.Random(config.seed)
+        self._lock = threading.Lock()
+        self.request_count = 0
+        self.error_count = 0
+        self.type_counts: Dict[str, int] = {}
+
+    def draw(self, prompt_type: str) -> Tuple[float, bool]:
+        """返回 (延迟秒数, 是否注入错误)。"""
+        cfg = self.config
+        with self._lock:
+            self.request_count += 1
+            self.type_counts[prompt_type] = self.type_counts.get(prompt_type, 0) + 1
+            if cfg.latency_dist == "uniform":
+                ms = self._rng.uniform(
+                    cfg.latency_ms - cfg.latency_jitter_ms, cfg.latency_ms + cfg.latency_jitter_ms
+                )
+            elif cfg.latency_dist == "lognormal" and cfg.latency_ms > 0:
+                ms = cfg.latency_ms * self._rng.lognormvariate(0.0, cfg.latency_sigma)
+            else:
+                ms = cfg.latency_ms
+            failed = self._rng.random() < cfg.error_rate
+            if failed:
+                self.error_count += 1
+        return max(0.0, ms) / 1000.0, failed
+
+
+def build_stub_app(config: Optional[StubConfig] = None) -> FastAPI:
+    config = config or StubConfig.from_env()
+    behavior = StubBehavior(config)
+    app = FastAPI(title="CBT LLM Stub Server")
+    app.state.behavior = behavior
+
+    @app.get("/v1/models")
+    async def list_models() -> Dict[str, Any]:
+        return {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]}
+
+    @app.get("/v1/stub/stats")
+    async def stats() -> Dict[str, Any]:
+        return {
+            "requests": behavior.request_count,
+            "errors": behavior.error_count,
+            "by_prompt_type": dict(behavior.type_counts),
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        model = body.get("model", "stub")
+        prompt_type = classify_prompt(messages)
+        delay, failed = behavior.draw(prompt_type)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if failed:
+            return JSONResponse(
+                status_code=config.error_status,
+                content={"error": {"message": "stub injected error", "type": "server_error"}},
+            )
+
+        content = build_response_content(prompt_type, messages, seed=config.seed)
+        prompt_tokens = estimate_tokens(_user_text(messages))
+        completion_tokens = estimate_tokens(content)
+        completion_id = f"chatcmpl-stub-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        if body.get("stream"):
+            return StreamingResponse(
+                _stream_chunks(completion_id, created, model, content, config.stream_chunk_chars),
+                media_type="text/event-stream",
+            )
+
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    return app
+
+
+def _stream_chunks(
+    completion_id: str, created: int, model: str, content: str, chunk_chars: int
+) -> Iterator[str]:
+    step = max(1, chunk_chars)
+    pieces = [content[i : i + step] for i in range(0, len(content), step)] or [""]
+    for idx, piece in enumerate(pieces):
+        delta: Dict[str, Any] = {"content": piece}
+        if idx == 0:
+            delta["role"] = "assistant"
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+    final = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+    }
+    yield f"data: {json.dumps(final)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def start_stub_server_in_thread(
+    config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 8010
+) -> Tuple[Any, threading.Thread, str]:
+    """在后台线程启动桩服务，返回 (server, thread, base_url)，供基准测试使用。
+
+    调用方结束时设置 `server.should_exit = True` 并 join 线程即可。
+    """
+    import uvicorn
+
+    server = uvicorn.Server(
+        uvicorn.Config(build_stub_app(config), host=host, port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 10.0
+    while not server.started:
+        if time.time() > deadline or not thread.is_alive():
+            raise RuntimeError("LLM 桩服务启动失败")
+        time.sleep(0.01)
+    return server, thread, f"http://{host}:{port}/v1"
+
+
+# 方便直接用 `python llm_stub_server.py` 本地跑
+if __name__ == "__main__":
+    import uvicorn
+
+    env_cfg = StubConfig.from_env()
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的离线 LLM 桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--latency-dist", default=env_cfg.latency_dist, choices=["fixed", "uniform", "lognormal"])
+    parser.add_argument("--latency-ms", type=float, default=env_cfg.latency_ms)
+    parser.add_argument("--latency-jitter-ms", type=float, default=env_cfg.latency_jitter_ms)
+    parser.add_argument("--latency-sigma", type=float, default=env_cfg.latency_sigma)
+    parser.add_argument("--error-rate", type=float, default=env_cfg.error_rate)
+    parser.add_argument("--error-status", type=int, default=env_cfg.error_status)
+    parser.add_argument("--seed", type=int, default=env_cfg.seed)
+    args = parser.parse_args()
+
+    cfg = StubConfig(
+        latency_dist=args.latency_dist,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        stream_chunk_chars=env_cfg.stream_chunk_chars,
+        seed=args.seed,
+    )
+    uvicorn.run(build_stub_app(cfg), host=args.host, port=args.port)
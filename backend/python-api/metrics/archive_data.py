@@ -0,0 +1,17 @@
+from dataclasses import dataclass
+from typing import Any, Dict
+
+
+@dataclass
+class ArchiveData:
+    """单次会话的归档行（原始指标 + 派生字段）。
+
+    放在独立的小模块里，归档存储层（archive_store）不必为了这个数据类导入整个 Agent。
+    """
+
+    session_id: str
+    patient_id: str
+    therapist_id: str
+    session_date: str
+    raw_metrics: Dict[str, float]
+    computed_fields: Dict[str, Any]
@@ -0,0 +1,154 @@
+import math
+from typing import List, Optional, Sequence, Tuple, Union
+
+try:  # NumPy 不可用时退回纯 Python 实现（同样是 O(n + bins)）
+    import numpy as np
+except ImportError:  # pragma: no cover - 取决于部署环境
+    np = None
+
+
+def bin_means_by_speaker(
+    timestamps: Sequence[float],
+    speaker_codes: Sequence[int],
+    values: Sequence[float],
+    codes: Sequence[int],
+    width: float,
+    n_bins: int,
+    use_numpy: Optional[bool] = None,
+) -> Union["np.ndarray", List[List[float]]]:
+    """把采样点按时间窗分箱并求每位说话人的窗内均值（空窗为 0）。
+
+    情绪同步主分析器与 Agent 的回退路径共用这一内核。
+
+    Args:
+        timestamps / speaker_codes / values: 等长序列，一行一个采样点
+        codes: 需要输出的说话人编码，输出第 i 行对应 codes[i]
+        width: 时间窗宽度（秒），第 k 个窗为 [k*width, (k+1)*width)
+        n_bins: 窗口数，超出范围（含负时间戳）的点被忽略
+        use_numpy: 强制选择实现；默认有 NumPy 就用
+
+    Returns:
+        NumPy 路径返回 (len(codes), n_bins) 数组；纯 Python 路径返回同形状的嵌套列表。
+    """
+    if use_numpy is None:
+        use_numpy = np is not None
+    if use_numpy:
+        return _bin_means_numpy(timestamps, speaker_codes, values, codes, width, n_bins)
+    return _bin_means_python(timestamps, speaker_codes, values, codes, width, n_bins)
+
+
+def _bin_means_numpy(timestamps, speaker_codes, values, codes, width, n_bins):
+    ts = np.asarray(timestamps, dtype=np.float64)
+    sp = np.asarray(speaker_codes, dtype=np.int64)
+    vals = np.asarray(values, dtype=np.float64)
+    n_rows = len(codes)
+    if n_bins <= 0 or n_rows == 0:
+        return np.zeros((n_rows, max(n_bins, 0)), dtype=float)
+
+    # 说话人编码 → 输出行号，不需要的说话人映射为 -1
+    max_code = int(max(int(sp.max()) if len(sp) else 0, max(codes)))
+    lookup = np.full(max_code + 1, -1, dtype=np.int64)
+    code_arr = np.asarray(codes, dtype=np.int64)
+    present = code_arr >= 0
+    lookup[code_arr[present]] = np.arange(n_rows)[present]
+    rows = np.where(sp >= 0, lookup[np.clip(sp, 0, max_code)], -1)
+
+    bin_idx = np.floor(ts / width).astype(np.int64)
+    keep = (rows >= 0) & (bin_idx >= 0) & (bin_idx < n_bins)
+    key = rows[keep] * n_bins + bin_idx[keep]
+
+    # 所有说话人一次 bincount 完成
+    size = n_rows * n_bins
+    sums = np.bincount(key, weights=vals[keep], minlength=size).reshape(n_rows, n_bins)
+    counts = np.bincount(key, minlength=size).reshape(n_rows, n_bins)
+    return np.divide(sums, counts, out=np.zeros((n_rows, n_bins), dtype=float), where=counts > 0)
+
+
+def _bin_means_python(timestamps, speaker_codes, values, codes, width, n_bins):
+    n_rows = len(codes)
+    n_bins = max(n_bins, 0)
+    row_of = {int(c): i for i, c in enumerate(codes)}
+    sums = [[0.0] * n_bins for _ in range(n_rows)]
+    counts = [[0] * n_bins for _ in range(n_rows)]
+    for ts, sp, v in zip(timestamps, speaker_codes, values):
+        row = row_of.get(int(sp))
+        if row is None:
+            continue
+        k = math.floor(ts / width)
+        if 0 <= k < n_bins:
+            sums[row][k] += v
+            counts[row][k] += 1
+    return [
+        [s / c if c else 0.0 for s, c in zip(sums[r], counts[r])]
+        for r in range(n_rows)
+    ]
+
+
+class StreamingBinMeans:
+    """分块输入版的分箱均值，用于超长会话：只保存每个窗的和与计数。
+
+    内存为 O(说话人数 × 窗口数)，与采样点数无关；会话时长事先未知（可以是生成器输入），
+    窗口数组按需倍增扩容。result() 的窗口数与 bin_means_by_speaker 在同一批数据上
+    按 max(timestamp) 推出的窗口数一致（仅 NumPy 实现）。
+    """
+
+    def __init__(self, codes: Sequence[int], width: float) -> None:
+        self.codes = [int(c) for c in codes]
+        self.width = width
+        self.n_samples = 0
+        self.max_time = -math.inf
+        self._lookup = np.full(max(max(self.codes, default=0), 0) + 1, -1, dtype=np.int64)
+        for row, c in enumerate(self.codes):
+            if c >= 0:
+                self._lookup[c] = row
+        self._sums = np.zeros((len(self.codes), 0), dtype=np.float64)
+        self._counts = np.zeros((len(self.codes), 0), dtype=np.int64)
+
+    def add(self, timestamps: Sequence[float], speaker_codes: Sequence[int], values: Sequence[float]) -> None:
+        """累加一块采样点；块内只产生与块大小成正比的临时数组。"""
+        ts = np.asarray(timestamps, dtype=np.float64)
+        if not len(ts):
+            return
+        self.n_samples += len(ts)
+        self.max_time = max(self.max_time, float(ts.max()))
+
+        sp = np.asarray(speaker_codes)
+        known = (sp >= 0) & (sp < len(self._lookup))
+        rows = np.where(known, self._lookup[np.where(known, sp, 0)], -1)
+        bin_idx = np.floor(ts / self.width).astype(np.int64)
+        keep = (rows >= 0) & (bin_idx >= 0)
+        if not keep.any():
+            return
+        rows, bin_idx = rows[keep], bin_idx[keep]
+        vals = np.asarray(values, dtype=np.float64)[keep]
+
+        # 只在本块覆盖的窗口区间内做 bincount（按时间顺序到达时区间很短）
+        lo, hi = int(bin_idx.min()), int(bin_idx.max()) + 1
+        self._reserve(hi)
+        n_rows, span = len(self.codes), hi - lo
+        key = rows * span + (bin_idx - lo)
+        self._sums[:, lo:hi] += np.bincount(key, weights=vals, minlength=n_rows * span).reshape(n_rows, span)
+        self._counts[:, lo:hi] += np.bincount(key, minlength=n_rows * span).reshape(n_rows, span)
+
+    def result(self, dtype=np.float64) -> Tuple["np.ndarray", "np.ndarray"]:
+        """返回 (means, time_bins)：means 形状为 (len(codes), 窗口数)，空窗为 0。"""
+        if not self.n_samples:
+            return np.zeros((len(self.codes), 0), dtype=dtype), np.zeros(0)
+        time_bins = np.arange(0, self.max_time + self.width, self.width)
+        n_bins = len(time_bins)
+        self._reserve(n_bins)
+        sums, counts = self._sums[:, :n_bins], self._counts[:, :n_bins]
+        means = np.zeros((len(self.codes), n_bins), dtype=dtype)
+        np.divide(sums, counts, out=means, where=counts > 0)
+        return means, time_bins
+
+    def _reserve(self, n_bins: int) -> None:
+        capacity = self._sums.shape[1]
+        if n_bins <= capacity:
+            return
+        capacity = max(n_bins, capacity * 2, 64)
+        sums = np.zeros((len(self.codes), capacity), dtype=np.float64)
+        counts = np.zeros((len(self.codes), capacity), dtype=np.int64)
+        sums[:, : self._sums.shape[1]] = self._sums
+        counts[:, : self._counts.shape[1]] = self._counts
+        self._sums, self._counts = sums, counts
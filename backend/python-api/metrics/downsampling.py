@@ -0,0 +1,154 @@
+import math
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets：选出 n_out 个最能保持曲线形状的点（返回下标，升序）。
+
+    首尾点固定保留，中间点均分为 n_out-2 个桶，每桶保留与「上一个选中点、下一桶均值」
+    构成三角形面积最大的点。复杂度 O(n)。
+    """
+    n = len(y)
+    if n_out >= n or n <= 2:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1])[:max(n_out, 0)]
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.floor(np.linspace(1, n - 1, n_out - 1)).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nlo, nhi = edges[i + 1], edges[i + 2]
+            avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        else:
+            avg_x, avg_y = x[n - 1], y[n - 1]
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - avg_x) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (avg_y - ay))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def minmax_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """Min/Max 抽取：均分为 n_out/2 个桶，每桶保留最小值和最大值点（保留峰谷，返回升序下标）。"""
+    n = len(y)
+    n_buckets = n_out // 2
+    if n_out >= n or n_buckets < 1:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    edges = np.floor(np.linspace(0, n, n_buckets + 1)).astype(np.int64)
+    bucket = np.searchsorted(edges, np.arange(n), side="right") - 1
+    # 先按桶、再按值排序：每个桶在排序结果中连续，首个即最小值、末个即最大值
+    order = np.lexsort((y, bucket))
+    picks = np.concatenate((order[edges[:-1]], order[edges[1:] - 1]))
+    return np.unique(picks)
+
+
+_METHODS = {
+    "lttb": lambda x, y, n_out: lttb_indices(x, y, n_out),
+    "minmax": lambda x, y, n_out: minmax_indices(y, n_out),
+}
+
+
+class CurvePyramid:
+    """共享时间轴的多条曲线的多分辨率金字塔。
+
+    第 0 层是原始分辨率，之后每层点数缩小 factor 倍，直到不超过 min_points。
+    每层只存所选点的下标（每条曲线各自选点），取值时再回查原始数组。
+
+    query(max_points, start, end) 返回时间范围内、点数不超过 max_points 的最细一层，
+    前端放大时只需带上新的时间范围即可拿到更高分辨率的数据。
+    """
+
+    def __init__(
+        self,
+        time_bins: Sequence[float],
+        curves: Dict[str, Sequence[float]],
+        method: str = "lttb",
+        factor: int = 4,
+        min_points: int = 64,
+    ) -> None:
+        if method not in _METHODS:
+            raise ValueError(f"未知的降采样方法: {method}")
+        self.method = method
+        self.time_bins = np.asarray(time_bins, dtype=float)
+        self.curves = {name: np.asarray(v, dtype=float) for name, v in curves.items()}
+        n = len(self.time_bins)
+        for name, v in self.curves.items():
+            if len(v) != n:
+                raise ValueError(f"曲线 {name} 长度 {len(v)} 与时间轴长度 {n} 不一致")
+
+        select = _METHODS[method]
+        # levels[k][name] = 第 k 层该曲线保留的下标
+        self.levels: List[Dict[str, np.ndarray]] = [
+            {name: np.arange(n) for name in self.curves}
+        ]
+        size = n
+        while size > min_points and factor > 1:
+            size = max(min_points, int(math.ceil(size / factor)))
+            self.levels.append(
+                {name: select(self.time_bins, v, size) for name, v in self.curves.items()}
+            )
+        # 每层所选点的时间，按时间范围切片时只需二分查找
+        self._level_times: List[Dict[str, np.ndarray]] = [
+            {name: self.time_bins[idx] for name, idx in level.items()} for level in self.levels
+        ]
+
+    def query(
+        self,
+        max_points: int = 200,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        curves: Optional[Sequence[str]] = None,
+    ) -> Dict[str, Any]:
+        """取 [start, end] 范围内、每条曲线不超过 max_points 个点的最细分辨率数据。"""
+        names = [c for c in (curves or self.curves) if c in self.curves]
+        lo_t = -np.inf if start is None else float(start)
+        hi_t = np.inf if end is None else float(end)
+        max_points = max(int(max_points), 3)
+
+        chosen_level = len(self.levels) - 1
+        for k in range(len(self.levels)):
+            if all(self._count_in_range(k, name, lo_t, hi_t) <= max_points for name in names):
+                chosen_level = k
+                break
+
+        out_curves: Dict[str, Dict[str, List[float]]] = {}
+        for name in names:
+            idx = self._slice(chosen_level, name, lo_t, hi_t)
+            if len(idx) > max_points:
+                # 最粗一层仍超出上限（max_points 很小时），对切片再抽一次
+                keep = _METHODS[self.method](self.time_bins[idx], self.curves[name][idx], max_points)
+                idx = idx[keep]
+            out_curves[name] = {
+                "time": np.round(self.time_bins[idx], 3).tolist(),
+                "values": np.round(self.curves[name][idx], 4).tolist(),
+            }
+        return {
+            "method": self.method,
+            "level": chosen_level,
+            "levels": len(self.levels),
+            "start": None if start is None else lo_t,
+            "end": None if end is None else hi_t,
+            "full_resolution_points": self._count_in_range(0, names[0], lo_t, hi_t) if names else 0,
+            "curves": out_curves,
+        }
+
+    def _bounds(self, level: int, name: str, lo_t: float, hi_t: float):
+        t = self._level_times[level][name]
+        return int(np.searchsorted(t, lo_t, side="left")), int(np.searchsorted(t, hi_t, side="right"))
+
+    def _slice(self, level: int, name: str, lo_t: float, hi_t: float) -> np.ndarray:
+        i, j = self._bounds(level, name, lo_t, hi_t)
+        return self.levels[level][name][i:j]
+
+    def _count_in_range(self, level: int, name: str, lo_t: float, hi_t: float) -> int:
+        i, j = self._bounds(level, name, lo_t, hi_t)
+        return j - i
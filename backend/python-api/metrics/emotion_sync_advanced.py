@@ -1,7 +1,14 @@
+import os
+
 import numpy as np
-from scipy.stats import pearsonr
-from dtaidistance import dtw
-from typing import List, Dict, Tuple
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple, Union
+
+from metrics.binning import StreamingBinMeans, bin_means_by_speaker
+from metrics.correlation import pearson_r, pearsonr, permutation_correlations
+from metrics.downsampling import CurvePyramid
+from metrics.lazy_deps import dtw
+from metrics.session_frame import DEFAULT_SPEAKERS, PATIENT, THERAPIST, SessionFrame, as_session_frame
+from metrics.tracing import get_tracer
 
 
 class AdvancedEmotionSynchronyCalculator:
@@ -15,36 +22,85 @@ class AdvancedEmotionSynchronyCalculator:
     - 治疗师情绪稳定性
     - 过度同化风险
     - Permutation test 显著性
+    - 滑动窗口同步曲线（定位会谈中同步断裂的位置）
+
+    rolling_window / rolling_stride 以时间窗（bin）为单位，默认 6 个窗（60 秒）、步长 1。
+    visualization_data["overview"] 是保形降采样后的曲线（每条不超过 overview_points 个点），
+    用作前端首屏；放大时按时间范围向 /sessions/{session_id}/emotion_curves 取更细的数据。
+
+    memory_bounded=True 用于数小时的长会话（默认取环境变量 CBT_EMOTION_MEMORY_BOUNDED=1）：
+    - 情绪时间线按 chunk_size 个采样点分块读取，可以直接传入生成器，不需要先物化成 dict 列表
+      或完整的 SessionFrame；传入 SessionFrame 时按块切片（视图），不再生成整列的临时数组
+    - 只保留每个时间窗的和与计数（StreamingBinMeans），峰值内存与窗口数成正比、与采样点数无关
+    - 曲线以 float32 计算；visualization_data 与默认模式一样返回 Python 列表（长度为窗口数，
+      与采样点数无关），输出类型不随部署开关变化
+    各项指标与默认模式一致（差别仅为 float32 舍入，保留三位小数后基本相同）。
     """
 
-    def __init__(self, time_window: int = 10, max_lag: int = 3) -> None:
+    def __init__(
+        self,
+        time_window: int = 10,
+        max_lag: int = 3,
+        rolling_window: int = 6,
+        rolling_stride: int = 1,
+        overview_points: int = 200,
+        memory_bounded: Optional[bool] = None,
+        chunk_size: int = 65536,
+    ) -> None:
+        if memory_bounded is None:
+            memory_bounded = os.getenv("CBT_EMOTION_MEMORY_BOUNDED", "0") == "1"
         self.time_window = time_window
         self.max_lag = max_lag
+        self.rolling_window = rolling_window
+        self.rolling_stride = rolling_stride
+        self.overview_points = overview_points
+        self.memory_bounded = memory_bounded
+        self.chunk_size = max(1, chunk_size)
 
     # ===== 对外主入口 =====
 
-    def calculate(self, emotion_timeline: List[Dict]) -> Dict:
-        """完整的情绪同步分析入口。"""
-        if not emotion_timeline:
-            return self._empty_result()
-
-        therapist_curve, patient_curve, time_bins = self._build_emotion_curves(
-            emotion_timeline
-        )
-
-        instant_sync = self._calculate_instant_sync(therapist_curve, patient_curve)
-        lagged_sync = self._calculate_lagged_sync(therapist_curve, patient_curve)
-        dtw_similarity = self._calculate_dtw_similarity(therapist_curve, patient_curve)
-        therapist_stability = self._analyze_therapist_stability(
-            therapist_curve, patient_curve
-        )
-        over_sync_risk = self._detect_over_synchronization(
-            therapist_curve, patient_curve, emotion_timeline
-        )
+    def calculate(self, emotion_timeline: Union[Iterable[Dict], SessionFrame]) -> Dict:
+        """完整的情绪同步分析入口（接受 dict 列表或 SessionFrame；memory_bounded 时也接受生成器）。"""
+        tracer = get_tracer()
+        if self.memory_bounded:
+            with tracer.span("emotion_sync.build_curves", chunk_size=self.chunk_size):
+                therapist_curve, patient_curve, time_bins = self._stream_emotion_curves(emotion_timeline)
+            if len(time_bins) == 0:
+                return self._empty_result()
+            timeline = emotion_timeline
+        else:
+            timeline = as_session_frame(emotion_timeline=emotion_timeline)
+            if timeline.n_emotions == 0:
+                return self._empty_result()
+            with tracer.span("emotion_sync.build_curves", points=timeline.n_emotions):
+                therapist_curve, patient_curve, time_bins = self._build_emotion_curves(timeline)
+
+        with tracer.span("emotion_sync.instant_sync"):
+            instant_sync = self._calculate_instant_sync(therapist_curve, patient_curve)
+        with tracer.span("emotion_sync.lagged_sync"):
+            lagged_sync = self._calculate_lagged_sync(therapist_curve, patient_curve)
+        with tracer.span("emotion_sync.dtw", bins=len(therapist_curve)):
+            dtw_similarity = self._calculate_dtw_similarity(therapist_curve, patient_curve)
+        with tracer.span("emotion_sync.stability"):
+            therapist_stability = self._analyze_therapist_stability(
+                therapist_curve, patient_curve
+            )
+        with tracer.span("emotion_sync.over_sync"):
+            over_sync_risk = self._detect_over_synchronization(
+                therapist_curve, patient_curve, timeline
+            )
         empathy_indicators = self._synthesize_empathy_indicators(
             instant_sync, lagged_sync, therapist_stability, over_sync_risk
         )
-        significance_test = self._permutation_test(therapist_curve, patient_curve)
+        with tracer.span("emotion_sync.permutation_test"):
+            significance_test = self._permutation_test(therapist_curve, patient_curve)
+        with tracer.span("emotion_sync.rolling_sync"):
+            rolling_sync = self._calculate_rolling_sync(therapist_curve, patient_curve, time_bins)
+        with tracer.span("emotion_sync.overview"):
+            overview = CurvePyramid(
+                time_bins,
+                {"therapist_curve": therapist_curve, "patient_curve": patient_curve},
+            ).query(max_points=self.overview_points)
 
         return {
             "instant_sync": instant_sync,
@@ -58,40 +114,42 @@ class AdvancedEmotionSynchronyCalculator:
                 "time_bins": time_bins.tolist(),
                 "therapist_curve": therapist_curve.tolist(),
                 "patient_curve": patient_curve.tolist(),
+                "rolling_sync": rolling_sync,
+                "overview": overview,
             },
         }
 
     # ===== 内部步骤 =====
 
     def _build_emotion_curves(
-        self, emotion_timeline: List[Dict]
+        self, emotion_timeline: Union[List[Dict], SessionFrame]
     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-        """构建治疗师/患者的情绪时间曲线。"""
-        max_time = max(e["timestamp"] for e in emotion_timeline)
-        time_bins = np.arange(0, max_time + self.time_window, self.time_window)
+        """构建治疗师/患者的情绪时间曲线（每个时间窗内 valence 的均值，空窗为 0）。
 
-        therapist_vals: List[float] = []
-        patient_vals: List[float] = []
-
-        for t in time_bins:
-            t_vs = [
-                e["valence"]
-                for e in emotion_timeline
-                if e["speaker"] == "therapist" and t <= e["timestamp"] < t + self.time_window
-            ]
-            p_vs = [
-                e["valence"]
-                for e in emotion_timeline
-                if e["speaker"] == "patient" and t <= e["timestamp"] < t + self.time_window
-            ]
-            therapist_vals.append(float(np.mean(t_vs)) if t_vs else 0.0)
-            patient_vals.append(float(np.mean(p_vs)) if p_vs else 0.0)
-
-        return (
-            np.array(therapist_vals, dtype=float),
-            np.array(patient_vals, dtype=float),
-            time_bins,
+        分箱走共享内核 bin_means_by_speaker，复杂度 O(采样点数 + 窗口数)。
+        """
+        frame = as_session_frame(emotion_timeline=emotion_timeline)
+        max_time = float(frame.emo_timestamp.max())
+        time_bins = np.arange(0, max_time + self.time_window, self.time_window)
+        curves = bin_means_by_speaker(
+            frame.emo_timestamp,
+            frame.emo_speaker,
+            frame.emo_valence,
+            codes=(THERAPIST, PATIENT),
+            width=self.time_window,
+            n_bins=len(time_bins),
         )
+        return curves[0], curves[1], time_bins
+
+    def _stream_emotion_curves(
+        self, emotion_timeline: Union[Iterable[Dict], SessionFrame]
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """分块构建 float32 情绪曲线；没有采样点时 time_bins 为空数组。"""
+        acc = StreamingBinMeans((THERAPIST, PATIENT), self.time_window)
+        for timestamps, speakers, valences in _iter_emotion_chunks(emotion_timeline, self.chunk_size):
+            acc.add(timestamps, speakers, valences)
+        curves, time_bins = acc.result(dtype=np.float32)
+        return curves[0], curves[1], time_bins
 
     def _calculate_instant_sync(
         self, therapist_curve: np.ndarray, patient_curve: np.ndarray
@@ -121,19 +179,19 @@ class AdvancedEmotionSynchronyCalculator:
 
         for lag in lag_range:
             if lag == 0:
-                r, _ = pearsonr(therapist_curve, patient_curve)
+                r = pearson_r(therapist_curve, patient_curve)
             elif lag > 0:
                 t_shifted = therapist_curve[lag:]
                 p_base = patient_curve[:-lag]
                 if len(t_shifted) > 2:
-                    r, _ = pearsonr(t_shifted, p_base)
+                    r = pearson_r(t_shifted, p_base)
                 else:
                     r = 0.0
             else:
                 p_shifted = patient_curve[-lag:]
                 t_base = therapist_curve[:lag]
                 if len(p_shifted) > 2:
-                    r, _ = pearsonr(t_base, p_shifted)
+                    r = pearson_r(t_base, p_shifted)
                 else:
                     r = 0.0
             correlations.append(
@@ -152,7 +210,15 @@ class AdvancedEmotionSynchronyCalculator:
         self, therapist_curve: np.ndarray, patient_curve: np.ndarray
     ) -> Dict:
         try:
-            distance = float(dtw.distance(therapist_curve, patient_curve))
+            # C 内核与纯 Python 版结果相同（C 库不可用时 dtaidistance 自动回退），
+            # 纯 Python 版逐格创建浮点对象，长会话上耗时成倍增长；C 内核只接受 float64
+            distance = float(
+                dtw.distance(
+                    np.asarray(therapist_curve, dtype=np.float64),
+                    np.asarray(patient_curve, dtype=np.float64),
+                    use_c=True,
+                )
+            )
             max_possible = float(np.sqrt(len(therapist_curve)) * 2.0) or 1.0
             similarity = max(0.0, 1.0 - distance / max_possible)
             return {
@@ -195,16 +261,14 @@ class AdvancedEmotionSynchronyCalculator:
         self,
         therapist_curve: np.ndarray,
         patient_curve: np.ndarray,
-        emotion_timeline: List[Dict],
+        emotion_timeline: Union[Iterable[Dict], SessionFrame],
     ) -> Dict:
-        negative_idx = [
-            i for i, p_val in enumerate(patient_curve) if p_val < -0.3
-        ]
-        if negative_idx:
-            t_neg = therapist_curve[negative_idx]
-            p_neg = patient_curve[negative_idx]
+        negative = patient_curve < -0.3
+        if negative.any():
+            t_neg = therapist_curve[negative]
+            p_neg = patient_curve[negative]
             if len(t_neg) > 1 and len(p_neg) > 1:
-                r_neg, _ = pearsonr(t_neg, p_neg)
+                r_neg = pearson_r(t_neg, p_neg)
             else:
                 r_neg = 0.0
             t_neg_vol = float(np.std(t_neg))
@@ -248,6 +312,93 @@ class AdvancedEmotionSynchronyCalculator:
             "recommendation": rec,
         }
 
+    def _calculate_rolling_sync(
+        self,
+        therapist_curve: np.ndarray,
+        patient_curve: np.ndarray,
+        time_bins: np.ndarray,
+    ) -> Dict:
+        """滑动窗口下的相关系数、波动比与过度同化风险（与整场指标口径一致）。
+
+        对 x、y、x²、y²、xy 及负性区域的同类量做前缀和，每个窗口的统计量由两次相减得到，
+        总复杂度 O(窗口数)，与窗口长度无关。无法定义的相关系数输出 None。
+        """
+        w = int(self.rolling_window)
+        stride = max(int(self.rolling_stride), 1)
+        n = len(therapist_curve)
+        result: Dict = {
+            "window_bins": w,
+            "stride_bins": stride,
+            "window_seconds": w * self.time_window,
+            "window_start": [],
+            "window_end": [],
+            "correlation": [],
+            "volatility_ratio": [],
+            "over_sync_risk": [],
+            "lowest_sync_window": None,
+        }
+        if w < 2 or n < w:
+            return result
+
+        x = np.asarray(therapist_curve, dtype=float)
+        y = np.asarray(patient_curve, dtype=float)
+        neg = (y < -0.3).astype(float)
+        starts = np.arange(0, n - w + 1, stride)
+        ends = starts + w
+
+        def window_sum(a: np.ndarray) -> np.ndarray:
+            c = np.concatenate(([0.0], np.cumsum(a)))
+            return c[ends] - c[starts]
+
+        # 整体窗口统计
+        sx, sy = window_sum(x), window_sum(y)
+        sxx, syy, sxy = window_sum(x * x), window_sum(y * y), window_sum(x * y)
+        var_x = np.maximum(sxx / w - (sx / w) ** 2, 0.0)
+        var_y = np.maximum(syy / w - (sy / w) ** 2, 0.0)
+        cov = sxy / w - (sx / w) * (sy / w)
+        denom = np.sqrt(var_x * var_y)
+        valid = denom > 1e-12
+        corr = np.full(len(starts), np.nan)
+        corr[valid] = np.clip(cov[valid] / denom[valid], -1.0, 1.0)
+
+        t_vol, p_vol = np.sqrt(var_x), np.sqrt(var_y)
+        ratio = np.divide(t_vol, p_vol, out=np.zeros_like(t_vol), where=p_vol > 0)
+
+        # 负性区域（患者 valence < -0.3 的窗）内的统计，用于过度同化风险
+        nn = window_sum(neg)
+        nsx, nsy = window_sum(x * neg), window_sum(y * neg)
+        nsxx, nsyy, nsxy = window_sum(x * x * neg), window_sum(y * y * neg), window_sum(x * y * neg)
+        safe_nn = np.maximum(nn, 1.0)
+        n_var_x = np.maximum(nsxx / safe_nn - (nsx / safe_nn) ** 2, 0.0)
+        n_var_y = np.maximum(nsyy / safe_nn - (nsy / safe_nn) ** 2, 0.0)
+        n_cov = nsxy / safe_nn - (nsx / safe_nn) * (nsy / safe_nn)
+        n_denom = np.sqrt(n_var_x * n_var_y)
+        n_valid = (nn > 1) & (n_denom > 1e-12)
+        r_neg = np.zeros(len(starts))
+        r_neg[n_valid] = n_cov[n_valid] / n_denom[n_valid]
+        t_neg_vol = np.where(nn > 0, np.sqrt(n_var_x), 0.0)
+
+        risk = (
+            0.4 * (r_neg > 0.7)
+            + 0.3 * ((p_vol > 0) & (t_vol > p_vol * 0.8))
+            + 0.3 * ((t_vol > 0) & (t_neg_vol > t_vol * 1.2))
+        )
+
+        window_start = np.asarray(time_bins, dtype=float)[starts]
+        result["window_start"] = np.round(window_start, 3).tolist()
+        result["window_end"] = np.round(window_start + w * self.time_window, 3).tolist()
+        result["correlation"] = [None if np.isnan(r) else round(float(r), 3) for r in corr]
+        result["volatility_ratio"] = np.round(ratio, 2).tolist()
+        result["over_sync_risk"] = np.round(risk, 2).tolist()
+        if valid.any():
+            i = int(np.nanargmin(corr))
+            result["lowest_sync_window"] = {
+                "start": result["window_start"][i],
+                "end": result["window_end"][i],
+                "correlation": result["correlation"][i],
+            }
+        return result
+
     def _synthesize_empathy_indicators(
         self,
         instant_sync: Dict,
@@ -288,16 +439,8 @@ class AdvancedEmotionSynchronyCalculator:
                 "interpretation": "数据不足",
             }
 
-        obs_r, _ = pearsonr(therapist_curve, patient_curve)
-        obs_r = float(obs_r)
-
-        perms: List[float] = []
-        for _ in range(n_permutations):
-            shuffled = np.random.permutation(therapist_curve)
-            r_perm, _ = pearsonr(shuffled, patient_curve)
-            perms.append(float(r_perm))
-
-        arr = np.array(perms, dtype=float)
+        obs_r = pearson_r(therapist_curve, patient_curve)
+        arr = permutation_correlations(therapist_curve, patient_curve, n_permutations)
         p_val = float(np.mean(np.abs(arr) >= abs(obs_r)))
         mean = float(np.mean(arr))
         std = float(np.std(arr))
@@ -364,5 +507,43 @@ class AdvancedEmotionSynchronyCalculator:
             "over_synchronization_risk": {},
             "empathy_indicators": {"empathy_emotion_score": 0.0},
             "significance_test": {},
-            "visualization_data": {"time_bins": [], "therapist_curve": [], "patient_curve": []},
+            "visualization_data": {
+                "time_bins": [],
+                "therapist_curve": [],
+                "patient_curve": [],
+                "rolling_sync": {},
+                "overview": {},
+            },
         }
+
+
+def _iter_emotion_chunks(
+    source: Union[Iterable[Dict], SessionFrame], chunk_size: int
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """按块产出 (timestamp, 说话人编码, valence)。
+
+    SessionFrame 直接切片（视图，不复制）；dict 序列逐行写入复用的定长缓冲区，
+    产出的数组在下一块读取前有效。字段缺失时抛出 KeyError（与 SessionFrame.from_records 一致），
+    治疗师/患者以外的说话人编码为 -1。
+    """
+    if isinstance(source, SessionFrame):
+        for start in range(0, source.n_emotions, chunk_size):
+            stop = start + chunk_size
+            yield source.emo_timestamp[start:stop], source.emo_speaker[start:stop], source.emo_valence[start:stop]
+        return
+
+    codes = {label: i for i, label in enumerate(DEFAULT_SPEAKERS)}
+    ts = np.empty(chunk_size, dtype=np.float64)
+    sp = np.empty(chunk_size, dtype=np.int16)
+    val = np.empty(chunk_size, dtype=np.float32)
+    n = 0
+    for e in source:
+        sp[n] = codes.get(e["speaker"], -1)
+        ts[n] = e["timestamp"]
+        val[n] = e["valence"]
+        n += 1
+        if n == chunk_size:
+            yield ts, sp, val
+            n = 0
+    if n:
+        yield ts[:n], sp[:n], val[:n]
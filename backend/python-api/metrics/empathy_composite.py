@@ -1,4 +1,86 @@
-from typing import Dict, List, Any
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# 子维度（顺序即批量接口中分量矩阵的列顺序），取值均为 0-1
+COMPONENTS = ("reflective", "semantic", "cognitive", "sync", "stability", "over_sync_penalty")
+
+# calculate() 输出与归档 computed 字段（empathy_<名>，0-100）中对应的子维度名
+COMPONENT_FIELDS = {
+    "reflective": "reflective_language",
+    "semantic": "semantic_alignment",
+    "cognitive": "cognitive_empathy",
+    "sync": "healthy_synchrony",
+    "stability": "emotional_stability",
+    "over_sync_penalty": "over_sync_risk",
+}
+
+DEFAULT_WEIGHTS: Dict[str, float] = {
+    "reflective": 0.25,
+    "semantic": 0.25,
+    "cognitive": 0.15,
+    "sync": 0.15,
+    "stability": 0.15,
+    "over_sync_penalty": 0.05,
+}
+
+# 等级下限（降序）与标签；最后一档为低于所有下限
+GRADE_THRESHOLDS = (85.0, 70.0, 60.0, 50.0)
+GRADES = ("A（优秀）", "B（良好）", "C（合格）", "D（需改进）", "F（需督导介入）")
+
+# 建议规则：批量接口的 flags 矩阵按此顺序一列一条
+RECOMMENDATION_FLAGS = ("low_reflective", "over_sync", "low_semantic", "low_score")
+RECOMMENDATIONS = {
+    "low_reflective": "增加反映性语言的使用（情绪标注、内容复述）",
+    "over_sync": "注意情绪边界管理，避免被患者情绪过度影响",
+    "low_semantic": "加强对患者核心议题的理解和回应",
+    "low_score": "建议在下次督导中重点讨论共情技术的运用",
+}
+DEFAULT_RECOMMENDATION = "继续保持当前良好的共情实践"
+
+ComponentInput = Union[np.ndarray, Mapping[str, Sequence[float]]]
+
+
+@dataclass
+class BatchScores:
+    """calculate_batch 的结果（N 次会话）。
+
+    scores：0-100（未四舍五入）；grade_codes：0-4 对应 GRADES；
+    flags：(N, 4) 布尔矩阵，列顺序见 RECOMMENDATION_FLAGS。
+    """
+
+    scores: np.ndarray
+    grade_codes: np.ndarray
+    flags: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def grades(self) -> np.ndarray:
+        return np.asarray(GRADES)[self.grade_codes]
+
+    def grade_counts(self) -> Dict[str, int]:
+        counts = np.bincount(self.grade_codes, minlength=len(GRADES))
+        return {grade: int(n) for grade, n in zip(GRADES, counts)}
+
+    def flag_counts(self) -> Dict[str, int]:
+        return {name: int(n) for name, n in zip(RECOMMENDATION_FLAGS, self.flags.sum(axis=0))}
+
+    def recommendations(self, i: int) -> List[str]:
+        """第 i 次会话的建议列表（与 calculate() 的 clinical_recommendations 一致）。"""
+        recs = [RECOMMENDATIONS[name] for name, on in zip(RECOMMENDATION_FLAGS, self.flags[i]) if on]
+        return recs if recs else [DEFAULT_RECOMMENDATION]
+
+
+@dataclass
+class WeightFit:
+    """fit_weights 的结果；rmse 以 0-100 分计。"""
+
+    weights: Dict[str, float]
+    rmse: float
+    r2: float
+    n: int
 
 
 class EmpathyCompositeCalculator:
@@ -15,8 +97,15 @@ class EmpathyCompositeCalculator:
     - components: 各子维度得分（0-100）
     - interpretation: 文本解释
     - clinical_recommendations: 建议列表
+
+    批量接口（归档回算 / 权重校准，不调用 LLM）：calculate_batch 对 N 次会话的分量矩阵
+    一次算出分数、等级与建议标记；fit_weights 按督导评分拟合权重；compare_weights
+    对比两组权重下的等级变化（what-if）。
     """
 
+    def __init__(self, weights: Optional[Mapping[str, float]] = None) -> None:
+        self.weights = _check_weights(weights if weights is not None else DEFAULT_WEIGHTS)
+
     def calculate(
         self,
         emotion_sync_data: Dict[str, Any],
@@ -40,14 +129,7 @@ class EmpathyCompositeCalculator:
             emotion_sync_data.get("over_synchronization_risk", {}).get("risk_score", 0.0)
         )
 
-        weights = {
-            "reflective": 0.25,
-            "semantic": 0.25,
-            "cognitive": 0.15,
-            "sync": 0.15,
-            "stability": 0.15,
-            "over_sync_penalty": 0.05,
-        }
+        weights = self.weights
 
         empathy_score_0_1 = (
             weights["reflective"] * reflective_rate
@@ -86,18 +168,106 @@ class EmpathyCompositeCalculator:
             "clinical_recommendations": recommendations,
         }
 
+    # ===== 批量 / 权重校准 =====
+
+    def calculate_batch(
+        self, components: ComponentInput, weights: Optional[Mapping[str, float]] = None
+    ) -> BatchScores:
+        """N 次会话一次评分。components 为 (N, 6) 矩阵（列顺序见 COMPONENTS）或 {子维度: 数组}；
+        weights 缺省用本实例的权重。逐会话结果与 calculate() 完全一致；
+        含缺失值（NaN）的行需先按 components_from_archive 返回的掩码过滤。"""
+        x = component_matrix(components)
+        w = _check_weights(weights) if weights is not None else self.weights
+        # 与 calculate() 相同的累加顺序，保证等级边界上的分数逐位相同
+        score = w["reflective"] * x[:, 0]
+        score += w["semantic"] * x[:, 1]
+        score += w["cognitive"] * x[:, 2]
+        score += w["sync"] * x[:, 3]
+        score += w["stability"] * x[:, 4]
+        score -= w["over_sync_penalty"] * x[:, 5]
+        np.clip(score, 0.0, 1.0, out=score)
+        score *= 100.0
+
+        flags = np.empty((len(x), len(RECOMMENDATION_FLAGS)), dtype=bool)
+        np.less(x[:, 0], 0.3, out=flags[:, 0])
+        np.greater(x[:, 5], 0.5, out=flags[:, 1])
+        np.less(x[:, 1], 0.5, out=flags[:, 2])
+        np.less(score, 60, out=flags[:, 3])
+        return BatchScores(score, _grade_codes(score), flags)
+
+    def fit_weights(
+        self,
+        components: ComponentInput,
+        target_scores: Sequence[float],
+        non_negative: bool = True,
+    ) -> WeightFit:
+        """按督导评分（0-100）拟合各子维度权重（无截距最小二乘）。
+
+        over_sync_penalty 以扣分项参与拟合，non_negative=True 时所有权重（含扣分权重）均不为负。
+        拟合忽略 0-100 截断；rmse / r2 按截断后的分数计算。
+        """
+        x = component_matrix(components)
+        y = np.asarray(target_scores, dtype=np.float64) / 100.0
+        if y.shape != (len(x),):
+            raise ValueError(f"target_scores 长度应为 {len(x)}，实际为 {y.shape}")
+        valid = np.isfinite(x).all(axis=1) & np.isfinite(y)
+        if not valid.any():
+            raise ValueError("没有可用于拟合的会话（分量或评分全部缺失）")
+        design = x[valid] * _SIGNS
+        if non_negative:
+            from scipy.optimize import nnls
+
+            coef, _ = nnls(design, y[valid])
+        else:
+            coef = np.linalg.lstsq(design, y[valid], rcond=None)[0]
+        weights = {name: round(float(c), 6) for name, c in zip(COMPONENTS, coef)}
+
+        fitted = self.calculate_batch(x[valid], weights).scores
+        target = y[valid] * 100.0
+        resid = fitted - target
+        ss_tot = float(((target - target.mean()) ** 2).sum())
+        r2 = 1.0 - float((resid**2).sum()) / ss_tot if ss_tot > 0 else 0.0
+        return WeightFit(weights, round(float(np.sqrt((resid**2).mean())), 4), round(r2, 4), int(valid.sum()))
+
+    def compare_weights(
+        self,
+        components: ComponentInput,
+        weights: Mapping[str, float],
+        baseline: Optional[Mapping[str, float]] = None,
+    ) -> Dict[str, Any]:
+        """what-if：同一批会话在 baseline（缺省为本实例权重）与 weights 下的评分对比。
+
+        grade_transitions[i][j]：原等级 i、新等级 j 的会话数（顺序见 GRADES）。
+        """
+        x = component_matrix(components)
+        before = self.calculate_batch(x, baseline)
+        after = self.calculate_batch(x, weights)
+        delta = after.scores - before.scores
+        transitions = np.bincount(
+            before.grade_codes.astype(np.int64) * len(GRADES) + after.grade_codes,
+            minlength=len(GRADES) ** 2,
+        ).reshape(len(GRADES), len(GRADES))
+        n = len(x)
+        return {
+            "n_sessions": n,
+            "mean_score_before": round(float(before.scores.mean()), 2) if n else 0.0,
+            "mean_score_after": round(float(after.scores.mean()), 2) if n else 0.0,
+            "mean_abs_delta": round(float(np.abs(delta).mean()), 2) if n else 0.0,
+            "grade_changed": int((before.grade_codes != after.grade_codes).sum()),
+            "grade_counts_before": before.grade_counts(),
+            "grade_counts_after": after.grade_counts(),
+            "grade_transitions": transitions.tolist(),
+            "needs_supervision_before": int(before.flags[:, 3].sum()),
+            "needs_supervision_after": int(after.flags[:, 3].sum()),
+        }
+
     # ===== 评分解释 =====
 
     def _get_grade(self, score: float) -> str:
-        if score >= 85:
-            return "A（优秀）"
-        if score >= 70:
-            return "B（良好）"
-        if score >= 60:
-            return "C（合格）"
-        if score >= 50:
-            return "D（需改进）"
-        return "F（需督导介入）"
+        for threshold, grade in zip(GRADE_THRESHOLDS, GRADES):
+            if score >= threshold:
+                return grade
+        return GRADES[-1]
 
     def _interpret_score(self, score: float) -> str:
         if score >= 85:
@@ -115,11 +285,58 @@ class EmpathyCompositeCalculator:
     ) -> List[str]:
         recs: List[str] = []
         if components.get("reflective_rate", 0.0) < 0.3:
-            recs.append("增加反映性语言的使用（情绪标注、内容复述）")
+            recs.append(RECOMMENDATIONS["low_reflective"])
         if components.get("over_sync_penalty", 0.0) > 0.5:
-            recs.append("注意情绪边界管理，避免被患者情绪过度影响")
+            recs.append(RECOMMENDATIONS["over_sync"])
         if components.get("semantic_alignment", 0.0) < 0.5:
-            recs.append("加强对患者核心议题的理解和回应")
+            recs.append(RECOMMENDATIONS["low_semantic"])
         if score < 60:
-            recs.append("建议在下次督导中重点讨论共情技术的运用")
-        return recs if recs else ["继续保持当前良好的共情实践"]
+            recs.append(RECOMMENDATIONS["low_score"])
+        return recs if recs else [DEFAULT_RECOMMENDATION]
+
+
+# 扣分项在加权和中取负号
+_SIGNS = np.array([1.0, 1.0, 1.0, 1.0, 1.0, -1.0])
+# 升序的等级下限，供 searchsorted 使用
+_ASCENDING_THRESHOLDS = np.array(GRADE_THRESHOLDS[::-1])
+
+
+def component_matrix(components: ComponentInput) -> np.ndarray:
+    """把 (N, 6) 矩阵或 {子维度: 数组} 统一为 float64 的 (N, 6) 矩阵（0-1）。"""
+    if isinstance(components, Mapping):
+        missing = [name for name in COMPONENTS if name not in components]
+        if missing:
+            raise ValueError(f"缺少子维度: {missing}")
+        return np.column_stack([np.asarray(components[name], dtype=np.float64) for name in COMPONENTS])
+    x = np.asarray(components, dtype=np.float64)
+    if x.ndim != 2 or x.shape[1] != len(COMPONENTS):
+        raise ValueError(f"分量矩阵应为 (N, {len(COMPONENTS)})，实际为 {x.shape}")
+    return x
+
+
+def components_from_archive(columns: Mapping[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """从 ArchiveReader.read_metrics() 的结果取出分量矩阵。
+
+    归档的 computed.empathy_<名> 为 0-100 的分数（保留一位小数），这里换算回 0-1。
+    返回 (分量矩阵, 可用行掩码)；旧归档中没有分量的会话掩码为 False。
+    """
+    n = len(next(iter(columns.values()))) if columns else 0
+    cols = []
+    for name in COMPONENTS:
+        col = columns.get(f"computed.empathy_{COMPONENT_FIELDS[name]}")
+        cols.append(np.full(n, np.nan) if col is None else np.asarray(col, dtype=np.float64) / 100.0)
+    x = np.column_stack(cols) if cols and n else np.empty((0, len(COMPONENTS)))
+    return x, np.isfinite(x).all(axis=1)
+
+
+def _grade_codes(scores: np.ndarray) -> np.ndarray:
+    # score >= 85 → 0（A），... ，< 50 → 4（F）
+    return (len(GRADE_THRESHOLDS) - np.searchsorted(_ASCENDING_THRESHOLDS, scores, side="right")).astype(np.int8)
+
+
+def _check_weights(weights: Mapping[str, float]) -> Dict[str, float]:
+    unknown = set(weights) - set(COMPONENTS)
+    if unknown:
+        raise ValueError(f"未知的子维度权重: {sorted(unknown)}")
+    # 未给出的子维度沿用默认权重，便于 what-if 只改一两项
+    return {name: float(weights.get(name, DEFAULT_WEIGHTS[name])) for name in COMPONENTS}
@@ -0,0 +1,53 @@
+"""重型可选依赖的延迟导入。
+
+dtaidistance（以及经由它加载的 SciPy）导入耗时占 worker 冷启动的大头，而只用到启发式
+指标的调用根本用不到它们。这里的模块代理在第一次访问属性时才真正导入，调用方的写法
+（dtw.distance(...)）不变；依赖缺失时在使用处抛 ImportError，由调用方已有的降级逻辑处理。
+"""
+
+import importlib
+import threading
+from types import ModuleType
+from typing import Any, Optional
+
+
+class LazyModule:
+    """首次属性访问时才 import 的模块代理（线程安全）。"""
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._module: Optional[ModuleType] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def load(self) -> ModuleType:
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.load(), attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+dtw = LazyModule("dtaidistance.dtw")
+
+# 进程池 worker 启动时预先加载（见 metrics_executor._init_worker）
+HEAVY_MODULES = (dtw,)
+
+
+def preload() -> None:
+    """立即导入所有延迟依赖；缺失的依赖跳过（使用处会降级）。"""
+    for module in HEAVY_MODULES:
+        try:
+            module.load()
+        except ImportError:
+            pass
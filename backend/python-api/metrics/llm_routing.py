@@ -0,0 +1,343 @@
+import contextvars
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field, fields, replace
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar, Union
+
+from metrics.llm_scheduler import LLMScheduler, current_priority, get_scheduler
+from metrics.prompt_budget import estimate_cost, fill_template
+from metrics.tracing import get_tracer
+
+T = TypeVar("T")
+
+# 提示词类型
+CORE_ISSUES = "core_issues"
+TURN_ALIGNMENT = "turn_alignment"
+REFLECTIVE_LANGUAGE = "reflective_language"
+HOMEWORK_SCORING = "homework_scoring"
+CLINICAL_TRANSLATION = "clinical_translation"
+
+
+@dataclass
+class Route:
+    """一种提示词的路由：按顺序尝试 models，前一个失败 / 超时 / 输出无法解析时换下一个。
+
+    - latency_slo_ms：延迟目标，只用于记录是否达标（不会因超出 SLO 而中断调用）
+    - timeout_s：单次尝试的硬超时
+    - max_tokens：输出 token 上限
+    - max_prompt_tokens：提示词 token 预算，超出时由 metrics.prompt_budget 截短可变内容
+    """
+
+    models: List[str]
+    latency_slo_ms: float
+    max_tokens: int
+    timeout_s: float
+    max_prompt_tokens: int = 4000
+
+
+# 逐轮调用的热路径（回应契合度、反映性语言标注）用小模型，核心议题和作业评估等对质量敏感的步骤用大模型
+DEFAULT_ROUTES: Dict[str, Route] = {
+    CORE_ISSUES: Route(
+        ["openai/gpt-4o", "openai/gpt-4o-mini"],
+        latency_slo_ms=8000, max_tokens=800, timeout_s=20, max_prompt_tokens=3000,
+    ),
+    TURN_ALIGNMENT: Route(
+        ["openai/gpt-4o-mini", "openai/gpt-4o"],
+        latency_slo_ms=2500, max_tokens=300, timeout_s=8, max_prompt_tokens=1200,
+    ),
+    REFLECTIVE_LANGUAGE: Route(
+        ["openai/gpt-4o-mini", "openai/gpt-4o"],
+        latency_slo_ms=4000, max_tokens=800, timeout_s=12, max_prompt_tokens=2500,
+    ),
+    HOMEWORK_SCORING: Route(
+        ["openai/gpt-4o", "openai/gpt-4o-mini"],
+        latency_slo_ms=15000, max_tokens=1500, timeout_s=30, max_prompt_tokens=4000,
+    ),
+    CLINICAL_TRANSLATION: Route(
+        ["openai/gpt-4o", "openai/gpt-4o-mini"],
+        latency_slo_ms=20000, max_tokens=1200, timeout_s=30, max_prompt_tokens=4000,
+    ),
+}
+
+
+class RoutingTable:
+    """默认路由 + 按租户（机构）覆盖。覆盖项只需写出要改的字段。
+
+    JSON 配置格式（CBT_LLM_ROUTES 指向的文件）：
+        {
+          "default": {"turn_alignment": {"models": ["openai/gpt-4o-mini"], "latency_slo_ms": 2000}},
+          "tenants": {"clinic_a": {"homework_scoring": {"models": ["openai/gpt-4o-2024-08-06", "openai/gpt-4o"]}}}
+        }
+    """
+
+    def __init__(
+        self,
+        routes: Optional[Dict[str, Route]] = None,
+        tenants: Optional[Dict[str, Dict[str, Route]]] = None,
+    ) -> None:
+        self.routes = dict(DEFAULT_ROUTES if routes is None else routes)
+        self.tenants = tenants or {}
+
+    @classmethod
+    def from_dict(cls, config: Dict[str, Any]) -> "RoutingTable":
+        routes = {name: _merge(DEFAULT_ROUTES.get(name), spec) for name, spec in config.get("default", {}).items()}
+        base = {**DEFAULT_ROUTES, **routes}
+        tenants = {
+            tenant: {name: _merge(base.get(name), spec) for name, spec in overrides.items()}
+            for tenant, overrides in config.get("tenants", {}).items()
+        }
+        return cls(base, tenants)
+
+    @classmethod
+    def from_env(cls) -> "RoutingTable":
+        path = os.getenv("CBT_LLM_ROUTES")
+        if not path:
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def fingerprint(self) -> str:
+        """路由配置（默认 + 租户覆盖）的稳定 JSON 表示，模型或参数变化时随之改变。"""
+        return json.dumps(
+            {
+                "routes": {name: asdict(r) for name, r in self.routes.items()},
+                "tenants": {t: {name: asdict(r) for name, r in o.items()} for t, o in self.tenants.items()},
+            },
+            sort_keys=True,
+        )
+
+    def route(self, prompt_type: str, tenant: Optional[str] = None) -> Route:
+        if tenant is not None and prompt_type in self.tenants.get(tenant, {}):
+            return self.tenants[tenant][prompt_type]
+        if prompt_type not in self.routes:
+            raise KeyError(f"未配置路由的提示词类型: {prompt_type}")
+        return self.routes[prompt_type]
+
+
+def _merge(base: Optional[Route], spec: Dict[str, Any]) -> Route:
+    known = {f.name for f in fields(Route)}
+    unknown = set(spec) - known
+    if unknown:
+        raise ValueError(f"未知的路由字段: {sorted(unknown)}")
+    if base is None:
+        return Route(**spec)
+    return replace(base, **spec)
+
+
+# =============================
+# 路由记录
+# =============================
+
+
+@dataclass
+class RoutingLog:
+    """一次分析 / 评估中所有 LLM 调用的路由决策与 token 用量。"""
+
+    decisions: List[Dict[str, Any]] = field(default_factory=list)
+    # 提示词类型 → 被截短的次数
+    truncations: Dict[str, int] = field(default_factory=dict)
+
+    def summary(self) -> Dict[str, Any]:
+        """按提示词类型汇总：调用数、实际使用的模型、回退次数、SLO 未达标次数、延迟、token 与费用。"""
+        out: Dict[str, Any] = {}
+        for d in self.decisions:
+            s = out.setdefault(
+                d["prompt_type"],
+                {"calls": 0, "models": {}, "fallbacks": 0, "failures": 0, "slo_misses": 0,
+                 "max_latency_ms": 0.0, "latency_slo_ms": d["latency_slo_ms"],
+                 "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0, "truncated_prompts": 0},
+            )
+            s["calls"] += 1
+            if d["model"] is None:
+                s["failures"] += 1
+            else:
+                s["models"][d["model"]] = s["models"].get(d["model"], 0) + 1
+            s["fallbacks"] += max(0, len(d["attempts"]) - 1)
+            s["slo_misses"] += 0 if d["within_slo"] else 1
+            s["max_latency_ms"] = max(s["max_latency_ms"], d["latency_ms"])
+            s["prompt_tokens"] += d["prompt_tokens"]
+            s["completion_tokens"] += d["completion_tokens"]
+            s["cost_usd"] = round(s["cost_usd"] + (d["cost_usd"] or 0.0), 6)
+        for prompt_type, count in self.truncations.items():
+            if prompt_type in out:
+                out[prompt_type]["truncated_prompts"] = count
+        return out
+
+    def totals(self) -> Dict[str, Any]:
+        """整次分析的 token、费用与 LLM 累计耗时（费用按 metrics.prompt_budget 的价格表估算）。"""
+        return {
+            "llm_calls": len(self.decisions),
+            "prompt_tokens": sum(d["prompt_tokens"] for d in self.decisions),
+            "completion_tokens": sum(d["completion_tokens"] for d in self.decisions),
+            "estimated_calls": sum(1 for d in self.decisions if d["usage_estimated"]),
+            "cost_usd": round(sum(d["cost_usd"] or 0.0 for d in self.decisions), 6),
+            "latency_ms": round(sum(d["latency_ms"] for d in self.decisions), 2),
+            "queue_wait_ms": round(sum(d["queue_wait_ms"] for d in self.decisions), 2),
+            "truncated_prompts": sum(self.truncations.values()),
+        }
+
+
+_current_log: contextvars.ContextVar[Optional[RoutingLog]] = contextvars.ContextVar("cbt_routing_log", default=None)
+
+
+class _LogScope:
+    __slots__ = ("log", "_parent", "_token")
+
+    def __init__(self) -> None:
+        self.log = RoutingLog()
+        self._parent: Optional[RoutingLog] = None
+        self._token = None
+
+    def __enter__(self) -> RoutingLog:
+        self._parent = _current_log.get()
+        self._token = _current_log.set(self.log)
+        return self.log
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        _current_log.reset(self._token)
+        if self._parent is not None:
+            # 嵌套时把决策并入外层（例如 Agent 整次分析的用量包含语义分析器内部的调用）
+            self._parent.decisions.extend(self.log.decisions)
+            for prompt_type, count in self.log.truncations.items():
+                self._parent.truncations[prompt_type] = self._parent.truncations.get(prompt_type, 0) + count
+        return False
+
+
+def routing_log() -> _LogScope:
+    """在 with 块内收集路由决策（按上下文隔离，线程 / 协程间互不干扰；可嵌套）。"""
+    return _LogScope()
+
+
+def note_truncation(prompt_type: str) -> None:
+    """记录一次因超出提示词预算而截短的提示词。"""
+    get_tracer().current_span().add("prompt_truncations", 1)
+    log = _current_log.get()
+    if log is not None:
+        log.truncations[prompt_type] = log.truncations.get(prompt_type, 0) + 1
+
+
+# =============================
+# 路由器
+# =============================
+
+
+class LLMRouter:
+    """按提示词类型（及租户）选择模型并执行回退链；每次调用先向调度器排队取得名额。"""
+
+    def __init__(self, table: Optional[RoutingTable] = None, scheduler: Optional[LLMScheduler] = None) -> None:
+        self.table = table if table is not None else RoutingTable.from_env()
+        self.scheduler = scheduler if scheduler is not None else get_scheduler()
+
+    def route(self, prompt_type: str, tenant: Optional[str] = None) -> Route:
+        return self.table.route(prompt_type, tenant)
+
+    def build_prompt(
+        self,
+        prompt_type: str,
+        template: str,
+        tenant: Optional[str] = None,
+        **slots: Union[str, Sequence[str]],
+    ) -> str:
+        """按该提示词类型的 max_prompt_tokens 填充模板（见 metrics.prompt_budget.fill_template）。"""
+        budget = self.table.route(prompt_type, tenant).max_prompt_tokens
+        prompt, truncated = fill_template(template, budget, **slots)
+        if truncated:
+            note_truncation(prompt_type)
+        return prompt
+
+    def call(
+        self,
+        prompt_type: str,
+        attempt: Callable[[str, int, float], Tuple[T, Optional[Tuple[int, int]]]],
+        tenant: Optional[str] = None,
+        prompt_tokens: int = 0,
+    ) -> T:
+        """依次用路由中的模型调用 attempt(model, max_tokens, timeout_s)，返回第一个成功的结果。
+
+        attempt 返回 (结果, (prompt_tokens, completion_tokens) 或 None)，并应包含输出解析：
+        解析失败同样视为该模型失败、换下一个模型。响应不带用量时，提示词 token 取本地估算值
+        prompt_tokens。全部失败时抛出最后一个异常。
+
+        整条回退链占用调度器的一个名额（metrics.llm_scheduler），优先级取自当前的
+        llm_priority 上下文；排队超过截止时间时抛 LLMDeadlineExceeded。
+        """
+        route = self.table.route(prompt_type, tenant)
+        span = get_tracer().current_span()
+        with self.scheduler.slot(tenant, cost=prompt_tokens) as queue_wait_ms:
+            span.add("llm_queue_wait_ms", queue_wait_ms)
+            return self._call_models(prompt_type, route, attempt, tenant, prompt_tokens, queue_wait_ms)
+
+    def _call_models(
+        self,
+        prompt_type: str,
+        route: Route,
+        attempt: Callable[[str, int, float], Tuple[T, Optional[Tuple[int, int]]]],
+        tenant: Optional[str],
+        prompt_tokens: int,
+        queue_wait_ms: float,
+    ) -> T:
+        span = get_tracer().current_span()
+        attempts: List[Dict[str, Any]] = []
+        started = time.perf_counter()
+        last_error: Optional[BaseException] = None
+        result: Any = None
+        usage: Optional[Tuple[int, int]] = None
+        model_used: Optional[str] = None
+        for model in route.models:
+            t0 = time.perf_counter()
+            try:
+                result, usage = attempt(model, route.max_tokens, route.timeout_s)
+            except Exception as e:  # noqa: BLE001
+                last_error = e
+                attempts.append({"model": model, "ok": False, "latency_ms": _ms(t0), "error": type(e).__name__})
+                span.add("llm_fallbacks", 1)
+                continue
+            attempts.append({"model": model, "ok": True, "latency_ms": _ms(t0)})
+            model_used = model
+            break
+
+        latency_ms = _ms(started)
+        log = _current_log.get()
+        if log is not None:
+            used_prompt, used_completion = usage if usage is not None else (prompt_tokens, 0)
+            log.decisions.append(
+                {
+                    "prompt_type": prompt_type,
+                    "tenant": tenant,
+                    "priority": current_priority(),
+                    "model": model_used,
+                    "attempts": attempts,
+                    "latency_ms": latency_ms,
+                    "queue_wait_ms": queue_wait_ms,
+                    "latency_slo_ms": route.latency_slo_ms,
+                    "within_slo": model_used is not None and latency_ms <= route.latency_slo_ms,
+                    "max_tokens": route.max_tokens,
+                    "prompt_tokens": used_prompt,
+                    "completion_tokens": used_completion,
+                    "usage_estimated": usage is None,
+                    "cost_usd": estimate_cost(model_used, used_prompt, used_completion) if model_used else 0.0,
+                }
+            )
+        if model_used is None:
+            if last_error is None:
+                raise RuntimeError(f"路由 {prompt_type} 没有可用模型")
+            raise last_error
+        if latency_ms > route.latency_slo_ms:
+            span.add("llm_slo_misses", 1)
+        return result
+
+
+def _ms(since: float) -> float:
+    return round((time.perf_counter() - since) * 1000, 2)
+
+
+_router: Optional[LLMRouter] = None
+
+
+def get_router() -> LLMRouter:
+    """全局路由器（首次调用时从 CBT_LLM_ROUTES 加载配置）。"""
+    global _router
+    if _router is None:
+        _router = LLMRouter()
+    return _router
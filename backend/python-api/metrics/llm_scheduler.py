@@ -0,0 +1,225 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+# 优先级类别：治疗师正在等待的请求 / 批量重算等后台任务
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """请求在截止时间前没有排到 LLM 调用名额。"""
+
+
+@dataclass
+class _Ticket:
+    priority: str
+    tenant: str
+    start_tag: float
+    deadline: Optional[float]
+    seq: int
+    granted: bool = False
+    # 排队期间被后到的交互请求抢先过
+    preempted: bool = False
+
+
+# 当前上下文的 (优先级, 排队截止秒数)；asyncio.to_thread 会把它带进工作线程。
+# 存相对秒数而不是绝对时间：截止只限制单次调用的排队等待，每次入队时才换算成绝对时间，
+# 否则请求里靠后的 LLM 调用会因为前面步骤的耗时而在空闲时也直接超时
+_current_work: contextvars.ContextVar[Tuple[str, Optional[float]]] = contextvars.ContextVar(
+    "cbt_llm_priority", default=(INTERACTIVE, None)
+)
+
+
+@contextmanager
+def llm_priority(priority: str, deadline_s: Optional[float] = None) -> Iterator[None]:
+    """在 with 块内发出的 LLM 调用使用该优先级；deadline_s 为每次调用从入队起的排队截止秒数。"""
+    if priority not in PRIORITIES:
+        raise ValueError(f"未知的优先级: {priority}")
+    token = _current_work.set((priority, deadline_s))
+    try:
+        yield
+    finally:
+        _current_work.reset(token)
+
+
+def current_priority() -> str:
+    return _current_work.get()[0]
+
+
+class LLMScheduler:
+    """所有 LLM 调用共享的并发名额调度器（OpenRouter 的速率限制按账号计）。
+
+    - 优先级：有交互请求排队时不放行批量请求；批量请求只在空闲名额多于
+      reserved_interactive 时才能占用名额，交互负载上升时排队中的批量请求让路，
+      已发出的调用不会被中断
+    - 同一优先级内按租户做加权公平排队（start-time fair queuing，代价为估算的提示词 token），
+      某个机构的大批量任务不会占满其他机构的份额
+    - 截止时间：距截止不到 urgent_window_s 的请求按最早截止优先放行；
+      截止前仍未排到名额则抛 LLMDeadlineExceeded，不再为没人等待的结果消耗额度
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        reserved_interactive: Optional[int] = None,
+        tenant_weights: Optional[Dict[str, float]] = None,
+        urgent_window_s: float = 5.0,
+        wait_window: int = 1024,
+    ) -> None:
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv("CBT_LLM_CONCURRENCY", "8"))
+        if reserved_interactive is None:
+            reserved_interactive = int(os.getenv("CBT_LLM_RESERVED_INTERACTIVE", max(1, max_concurrency // 4)))
+        if tenant_weights is None:
+            tenant_weights = _load_weights()
+        self.max_concurrency = max(1, max_concurrency)
+        self.reserved_interactive = min(max(0, reserved_interactive), self.max_concurrency - 1)
+        self.tenant_weights = tenant_weights
+        self.urgent_window_s = urgent_window_s
+
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._queues: Dict[str, List[_Ticket]] = {p: [] for p in PRIORITIES}
+        self._running: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        self._vtime: Dict[str, float] = {p: 0.0 for p in PRIORITIES}
+        self._last_finish: Dict[Tuple[str, str], float] = {}
+        self._dispatched: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        self._waits: Dict[str, Deque[float]] = {p: deque(maxlen=wait_window) for p in PRIORITIES}
+        self.expired = 0
+        self.preempted = 0
+
+    @contextmanager
+    def slot(self, tenant: Optional[str] = None, cost: float = 1.0) -> Iterator[float]:
+        """排队获取一个调用名额，with 块结束时归还；返回排队等待的毫秒数。"""
+        priority, deadline_s = _current_work.get()
+        wait_ms = self._acquire(priority, tenant or "", max(1.0, cost), deadline_s)
+        try:
+            yield wait_ms
+        finally:
+            self._release(priority)
+
+    # ===== 排队与放行 =====
+
+    def _acquire(self, priority: str, tenant: str, cost: float, deadline_s: Optional[float]) -> float:
+        now = time.monotonic()
+        deadline = None if deadline_s is None else now + deadline_s
+        with self._cond:
+            self._seq += 1
+            start = max(self._vtime[priority], self._last_finish.get((priority, tenant), 0.0))
+            self._last_finish[(priority, tenant)] = start + cost / self.tenant_weights.get(tenant, 1.0)
+            ticket = _Ticket(priority, tenant, start, deadline, self._seq)
+            self._queues[priority].append(ticket)
+            self._dispatch_locked()
+            while not ticket.granted:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._queues[priority].remove(ticket)
+                    self.expired += 1
+                    # 过期票据留在交互队列里时批量请求会被挡住，移除后重新放行
+                    self._dispatch_locked()
+                    raise LLMDeadlineExceeded(f"{priority} 请求排队超过截止时间（租户 {tenant or '-'}）")
+                self._cond.wait(remaining)
+            wait_ms = (time.monotonic() - now) * 1000
+            self._waits[priority].append(wait_ms)
+        return round(wait_ms, 2)
+
+    def _release(self, priority: str) -> None:
+        with self._cond:
+            self._running[priority] -= 1
+            self._dispatch_locked()
+
+    def _dispatch_locked(self) -> None:
+        granted = False
+        while True:
+            ticket = self._next_locked()
+            if ticket is None:
+                break
+            self._queues[ticket.priority].remove(ticket)
+            ticket.granted = True
+            granted = True
+            self._running[ticket.priority] += 1
+            self._dispatched[ticket.priority] += 1
+            self._vtime[ticket.priority] = max(self._vtime[ticket.priority], ticket.start_tag)
+            if ticket.priority == INTERACTIVE:
+                for waiting in self._queues[BATCH]:
+                    if waiting.seq < ticket.seq and not waiting.preempted:
+                        waiting.preempted = True
+                        self.preempted += 1
+        if granted:
+            self._cond.notify_all()
+
+    def _next_locked(self) -> Optional[_Ticket]:
+        free = self.max_concurrency - sum(self._running.values())
+        if free <= 0:
+            return None
+        if self._queues[INTERACTIVE]:
+            return self._pick(self._queues[INTERACTIVE])
+        if self._queues[BATCH] and free > self.reserved_interactive:
+            return self._pick(self._queues[BATCH])
+        return None
+
+    def _pick(self, queue: List[_Ticket]) -> Optional[_Ticket]:
+        now = time.monotonic()
+        # 已过截止的请求留给等待线程自己移除并报错
+        live = [t for t in queue if t.deadline is None or t.deadline > now]
+        if not live:
+            return None
+        urgent = [t for t in live if t.deadline is not None and t.deadline - now <= self.urgent_window_s]
+        if urgent:
+            return min(urgent, key=lambda t: (t.deadline, t.seq))
+        return min(live, key=lambda t: (t.start_tag, t.seq))
+
+    # ===== 指标 =====
+
+    def stats(self) -> Dict[str, float]:
+        """供 MetricsRegistry.register_gauges 使用：各优先级的队列深度、运行数与排队等待分位数。"""
+        with self._cond:
+            out: Dict[str, float] = {
+                "max_concurrency": self.max_concurrency,
+                "expired": self.expired,
+                "preempted": self.preempted,
+            }
+            for p in PRIORITIES:
+                waits = sorted(self._waits[p])
+                out[f"queued_{p}"] = len(self._queues[p])
+                out[f"running_{p}"] = self._running[p]
+                out[f"dispatched_{p}"] = self._dispatched[p]
+                out[f"wait_ms_p50_{p}"] = round(_percentile(waits, 0.50), 2)
+                out[f"wait_ms_p95_{p}"] = round(_percentile(waits, 0.95), 2)
+        return out
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _load_weights() -> Dict[str, float]:
+    """CBT_LLM_TENANT_WEIGHTS 指向的 JSON 文件：{"clinic_a": 2, "clinic_b": 1}，未列出的租户权重为 1。"""
+    path = os.getenv("CBT_LLM_TENANT_WEIGHTS")
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return {tenant: float(w) for tenant, w in json.load(f).items()}
+
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """全局调度器（首次调用时按环境变量创建）。"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
@@ -0,0 +1,103 @@
+import hashlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from metrics.tracing import get_tracer
+
+
+def content_hash(*parts: Any) -> str:
+    """把若干字符串 / bytes / NumPy 数组拼成一个稳定的 sha256 摘要。"""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        elif not isinstance(part, (bytes, bytearray, memoryview)):
+            part = memoryview(part).tobytes()  # NumPy 数组等支持 buffer 协议的对象
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+
+class _Node:
+    __slots__ = ("name", "deps", "fn")
+
+    def __init__(self, name: str, deps: Tuple[str, ...], fn: Callable[..., Any]) -> None:
+        self.name = name
+        self.deps = deps
+        self.fn = fn
+
+
+class MetricGraph:
+    """指标依赖图：每个节点的结果按其输入的内容哈希缓存，只重算失效的节点。
+
+    - 源（source）：调用 run 时传入 (哈希, 值)，例如转写、情绪时间线
+    - 节点（node）：依赖若干源或先前注册的节点，注册顺序即拓扑顺序
+    - 节点的缓存键 = 依赖哈希的组合；未变化则直接复用上次结果
+
+    缓存按 LRU 淘汰，max_entries 限制所有节点合计的条目数。
+    """
+
+    def __init__(self, max_entries: int = 64) -> None:
+        self._nodes: "OrderedDict[str, _Node]" = OrderedDict()
+        self._cache: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self.max_entries = max_entries
+        # 最近一次 run 中实际重算的节点（便于调试 / 基准测试）
+        self.last_recomputed: List[str] = []
+
+    def add_node(self, name: str, deps: Sequence[str], fn: Callable[..., Any]) -> None:
+        if name in self._nodes:
+            raise ValueError(f"节点已存在: {name}")
+        self._nodes[name] = _Node(name, tuple(deps), fn)
+
+    def run(
+        self,
+        sources: Dict[str, Tuple[str, Any]],
+        precomputed: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """按拓扑顺序求值所有节点，返回 {名称: 值}（含源）。
+
+        precomputed 中给出的节点值（例如已在进程池里算好的结果）在缓存未命中时
+        直接采用并写入缓存，不再调用节点函数。
+        """
+        values: Dict[str, Any] = {name: v for name, (_, v) in sources.items()}
+        precomputed = precomputed or {}
+        tracer = get_tracer()
+        span = tracer.current_span()
+        self.last_recomputed = []
+
+        for name, key in self._keys(sources).items():
+            node = self._nodes[name]
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                values[name] = self._cache[key]
+                span.add("cache_hits", 1)
+            else:
+                if name in precomputed:
+                    value = precomputed[name]
+                else:
+                    value = node.fn(*(values[d] for d in node.deps))
+                values[name] = value
+                self._cache[key] = value
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+                self.last_recomputed.append(name)
+        return values
+
+    def stale(self, sources: Dict[str, Tuple[str, Any]]) -> List[str]:
+        """不求值，只根据源哈希列出 run 时需要重算的节点（按拓扑顺序）。"""
+        return [name for name, key in self._keys(sources).items() if key not in self._cache]
+
+    def _keys(self, sources: Dict[str, Tuple[str, Any]]) -> "OrderedDict[str, Tuple[str, str]]":
+        """各节点的缓存键：只依赖源哈希，不需要先求值上游节点。"""
+        hashes: Dict[str, str] = {name: h for name, (h, _) in sources.items()}
+        keys: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        for node in self._nodes.values():
+            missing = [d for d in node.deps if d not in hashes]
+            if missing:
+                raise KeyError(f"节点 {node.name} 缺少依赖: {missing}")
+            keys[node.name] = (node.name, content_hash(node.name, *(hashes[d] for d in node.deps)))
+            hashes[node.name] = keys[node.name][1]
+        return keys
+
+    def clear(self) -> None:
+        self._cache.clear()
@@ -0,0 +1,204 @@
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+from metrics.binning import bin_means_by_speaker
+from metrics.lazy_deps import dtw
+from metrics.session_frame import SessionFrame, as_session_frame
+from metrics.tracing import get_tracer
+from metrics.turn_intervals import analyze_frame_intervals
+
+
+class MultiPartySynchronyCalculator:
+    """多方会谈（伴侣 / 家庭 CBT）的两两同步分析（独立模块）。
+
+    与 AdvancedEmotionSynchronyCalculator 的口径一致（time_window 秒分箱、空窗为 0、
+    滞后以窗为单位、DTW 相似度 = 1 - 距离 / (2·√n)），但不限定两位说话人：
+    - 所有说话人一次分箱为 (说话人 × 窗口) 矩阵
+    - 相关矩阵、各滞后下的相关矩阵都由标准化后的矩阵乘法一次得到，不逐对循环
+    - 说话时长、重叠与打断来自区间扫描（metrics.turn_intervals），换人潜伏时间由相邻轮次一次 bincount 得到
+
+    矩阵的行列顺序与返回的 speakers 一致。
+    """
+
+    def __init__(self, time_window: int = 10, max_lag: int = 3) -> None:
+        self.time_window = time_window
+        self.max_lag = max_lag
+
+    # ===== 对外主入口 =====
+
+    def calculate(self, session: Union[SessionFrame, Any]) -> Dict[str, Any]:
+        """接受 SessionFrame，或带 transcript / emotion_timeline 属性的会话对象。"""
+        if isinstance(session, SessionFrame):
+            frame = session
+        else:
+            frame = as_session_frame(session.transcript, session.emotion_timeline)
+
+        codes = self._present_speakers(frame)
+        speakers = [frame.speakers[c] for c in codes]
+        tracer = get_tracer()
+        with tracer.span("multi_party.talk", speakers=len(codes)):
+            talk = self._analyze_talk(frame, codes)
+        with tracer.span("multi_party.emotion", speakers=len(codes)):
+            emotion = self._analyze_emotion(frame, codes)
+        return {
+            "speakers": speakers,
+            "participant_count": len(speakers),
+            "talk": talk,
+            "emotion": emotion,
+        }
+
+    # ===== 说话与轮换 =====
+
+    def _present_speakers(self, frame: SessionFrame) -> List[int]:
+        seen = np.zeros(len(frame.speakers), dtype=bool)
+        seen[frame.turn_speaker] = True
+        seen[frame.emo_speaker] = True
+        return [int(c) for c in np.flatnonzero(seen)]
+
+    def _analyze_talk(self, frame: SessionFrame, codes: List[int]) -> Dict[str, Any]:
+        n_codes = len(frame.speakers)
+        labels = [frame.speakers[c] for c in codes]
+        sp = frame.turn_speaker.astype(np.int64)
+        intervals = analyze_frame_intervals(frame)
+        seconds = intervals.talk_seconds[codes]
+        turns = np.bincount(sp, minlength=n_codes)[codes]
+        total = float(seconds.sum())
+        share = seconds / total if total > 0 else np.zeros_like(seconds)
+
+        # 相邻轮次换人：(前一位, 后一位) 编码为一个整数后一次 bincount
+        prev, nxt = sp[:-1], sp[1:]
+        switch = prev != nxt
+        gaps = (frame.turn_start[1:] - frame.turn_end[:-1])[switch]
+        pair = prev[switch] * n_codes + nxt[switch]
+        size = n_codes * n_codes
+        switches = np.bincount(pair, minlength=size).reshape(n_codes, n_codes)
+        nonneg = gaps >= 0
+        gap_sum = np.bincount(pair[nonneg], weights=gaps[nonneg], minlength=size).reshape(n_codes, n_codes)
+        gap_cnt = np.bincount(pair[nonneg], minlength=size).reshape(n_codes, n_codes)
+        # 打断矩阵：行 = 打断者，列 = 被打断者（多人同时说话时无法归属，不计入矩阵）
+        single = intervals.interruption_target >= 0
+        int_pair = intervals.interruption_initiator[single] * n_codes + intervals.interruption_target[single]
+        interrupts = np.bincount(int_pair, minlength=size).reshape(n_codes, n_codes)
+
+        sub = np.ix_(codes, codes)
+        latency = np.divide(
+            gap_sum[sub], gap_cnt[sub], out=np.full((len(codes), len(codes)), np.nan), where=gap_cnt[sub] > 0
+        )
+        return {
+            "talk_seconds": {s: round(float(v), 2) for s, v in zip(labels, seconds)},
+            "talk_share": {s: round(float(v), 3) for s, v in zip(labels, share)},
+            "overlap_seconds": round(intervals.overlap_seconds, 2),
+            "interruptions_by_initiator": {
+                s: int(v) for s, v in zip(labels, intervals.interruptions_by_initiator()[codes])
+            },
+            "turns": {s: int(v) for s, v in zip(labels, turns)},
+            # switch_counts / latency：行 = 上一位说话人，列 = 接话的人
+            "switch_counts": switches[sub].tolist(),
+            "latency_matrix_seconds": _matrix_to_list(latency, 3),
+            "interruption_matrix": interrupts[sub].tolist(),
+        }
+
+    # ===== 情绪同步 =====
+
+    def _analyze_emotion(self, frame: SessionFrame, codes: List[int]) -> Dict[str, Any]:
+        labels = [frame.speakers[c] for c in codes]
+        if frame.n_emotions == 0 or len(codes) < 2:
+            return {"correlation_matrix": [], "lag_matrix_seconds": [], "lag_correlation_matrix": [],
+                    "dtw_distance_matrix": [], "dtw_similarity_matrix": [], "pairs": []}
+
+        max_time = float(frame.emo_timestamp.max())
+        n_bins = len(np.arange(0, max_time + self.time_window, self.time_window))
+        curves = bin_means_by_speaker(
+            frame.emo_timestamp,
+            frame.emo_speaker,
+            frame.emo_valence,
+            codes=codes,
+            width=self.time_window,
+            n_bins=n_bins,
+        )
+        corr = _row_correlation(curves, curves)
+        best_r, best_lag = self._lag_matrices(curves, corr)
+        dtw_dist, dtw_sim = self._dtw_matrices(curves)
+
+        pairs: List[Dict[str, Any]] = []
+        iu, ju = np.triu_indices(len(codes), k=1)
+        for i, j in zip(iu.tolist(), ju.tolist()):
+            pairs.append(
+                {
+                    "a": labels[i],
+                    "b": labels[j],
+                    "correlation": _round_or_none(corr[i, j], 3),
+                    # 正值：a 滞后于 b（a 跟随 b 的情绪变化）
+                    "optimal_lag_seconds": int(best_lag[i, j]) * self.time_window,
+                    "lag_correlation": _round_or_none(best_r[i, j], 3),
+                    "dtw_similarity": _round_or_none(dtw_sim[i, j], 3),
+                }
+            )
+        return {
+            "correlation_matrix": _matrix_to_list(corr, 3),
+            "lag_matrix_seconds": (best_lag * self.time_window).tolist(),
+            "lag_correlation_matrix": _matrix_to_list(best_r, 3),
+            "dtw_distance_matrix": _matrix_to_list(dtw_dist, 2),
+            "dtw_similarity_matrix": _matrix_to_list(dtw_sim, 3),
+            "pairs": pairs,
+        }
+
+    def _lag_matrices(self, curves: np.ndarray, corr0: np.ndarray):
+        """每对说话人在 [-max_lag, max_lag] 内 |r| 最大的滞后及对应相关。
+
+        R_k[i, j] = corr(x_i[k:], x_j[:-k])（i 滞后 j 共 k 个窗）；负滞后即 R_k 的转置。
+        """
+        s, n = curves.shape
+        stack = [np.nan_to_num(corr0)]
+        lags = [0]
+        for k in range(1, self.max_lag + 1):
+            if n - k > 2:
+                r_k = np.nan_to_num(_row_correlation(curves[:, k:], curves[:, :-k]))
+            else:
+                r_k = np.zeros((s, s))
+            stack.extend([r_k, r_k.T])
+            lags.extend([k, -k])
+        stack_arr = np.stack(stack)
+        best = np.abs(stack_arr).argmax(axis=0)
+        best_r = np.take_along_axis(stack_arr, best[None], axis=0)[0]
+        best_lag = np.asarray(lags)[best]
+        np.fill_diagonal(best_lag, 0)
+        return best_r, best_lag
+
+    def _dtw_matrices(self, curves: np.ndarray):
+        s, n = curves.shape
+        series = [np.ascontiguousarray(row, dtype=np.double) for row in curves]
+        try:
+            try:
+                dist = dtw.distance_matrix_fast(series, compact=False)
+            except Exception:  # noqa: BLE001 - C 扩展不可用时退回纯 Python 版本
+                dist = dtw.distance_matrix(series, compact=False)
+            dist = np.asarray(dist, dtype=float)
+        except Exception as e:  # noqa: BLE001
+            print(f"DTW 距离矩阵计算失败: {e}")
+            nan = np.full((s, s), np.nan)
+            return nan, nan
+        max_possible = float(np.sqrt(n) * 2.0) or 1.0
+        sim = np.maximum(0.0, 1.0 - dist / max_possible)
+        return dist, sim
+
+
+def _row_correlation(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """a 的每一行与 b 的每一行之间的 Pearson 相关（常数行对应 NaN）。"""
+    a = a - a.mean(axis=1, keepdims=True)
+    b = b - b.mean(axis=1, keepdims=True)
+    na = np.sqrt((a * a).sum(axis=1))
+    nb = np.sqrt((b * b).sum(axis=1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = (a @ b.T) / np.outer(na, nb)
+    r[~np.isfinite(r)] = np.nan
+    return np.clip(r, -1.0, 1.0)
+
+
+def _round_or_none(v: float, digits: int) -> Optional[float]:
+    return None if not np.isfinite(v) else round(float(v), digits)
+
+
+def _matrix_to_list(m: np.ndarray, digits: int) -> List[List[Optional[float]]]:
+    return [[_round_or_none(v, digits) for v in row] for row in m]
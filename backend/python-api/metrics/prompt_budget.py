@@ -0,0 +1,218 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# 中日韩文字与全角标点：GPT-4o 系列分词下约 1 字 1 token；其余字符约 4 字符 1 token
+_WIDE_CHARS = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+ELISION = "……（中略）……"
+
+# 每百万 token 的美元价格 (输入, 输出)；CBT_LLM_PRICES 指向的 JSON 文件可覆盖 / 补充
+DEFAULT_PRICES: Dict[str, Tuple[float, float]] = {
+    "openai/gpt-4o": (2.50, 10.00),
+    "openai/gpt-4o-mini": (0.15, 0.60),
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """本地 token 估算（不依赖分词器，误差约 ±15%，用于预算而非计费）。"""
+    if not text:
+        return 0
+    other = len(_WIDE_CHARS.sub("", text))
+    return (len(text) - other) + math.ceil(other / 4)
+
+
+def fit_text(text: str, max_tokens: int) -> str:
+    """超出预算时保留开头约 2/3 与结尾约 1/3，中间以省略标记代替。"""
+    total = estimate_tokens(text)
+    if total <= max_tokens:
+        return text
+    room = max_tokens - estimate_tokens(ELISION)
+    if room <= 0:
+        return ""
+    keep = int(len(text) * room / total)
+    while keep > 0:
+        head = (keep * 2 + 2) // 3
+        tail = keep - head
+        clipped = text[:head] + ELISION + (text[-tail:] if tail else "")
+        if estimate_tokens(clipped) <= max_tokens:
+            return clipped
+        keep = int(keep * 0.9)
+    return ""
+
+
+def fit_lines(lines: Sequence[str], max_tokens: int, min_line_tokens: int = 16) -> List[str]:
+    """把多行文本压到预算内：每行分到同一个上限（max-min 公平分配），只截短超过上限的长行。
+
+    这样一段很长的独白只会被截短，不会挤掉其他发言；预算连每行 min_line_tokens 都不够时，
+    只保留前面的行。每行按多占 1 个 token（换行）计。
+    """
+    costs = [estimate_tokens(line) + 1 for line in lines]
+    if sum(costs) <= max_tokens:
+        return list(lines)
+    n_keep = min(len(lines), max(0, max_tokens // min_line_tokens))
+    lines, costs = list(lines[:n_keep]), costs[:n_keep]
+    if not lines or sum(costs) <= max_tokens:
+        return lines
+
+    cap = _fair_cap(costs, max_tokens)
+    return [line if cost <= cap else fit_text(line, cap - 1) for line, cost in zip(lines, costs)]
+
+
+def fill_template(template: str, max_tokens: int, **slots: Union[str, Sequence[str]]) -> Tuple[str, bool]:
+    """按 str.format 模板填充提示词，使估算总 token 不超过 max_tokens。
+
+    模板本身（指令、输出格式）不截短；可变内容按同样的公平分配在各 slot 间分摊预算：
+    slot 为字符串时整体截短（fit_text），为字符串列表时逐行截短（fit_lines）后以换行拼接。
+    返回 (提示词, 是否截短)。
+    """
+    joined = {k: v if isinstance(v, str) else "\n".join(v) for k, v in slots.items()}
+    room = max(0, max_tokens - estimate_tokens(template.format(**{k: "" for k in slots})))
+    costs = {k: estimate_tokens(v) for k, v in joined.items()}
+    if sum(costs.values()) <= room:
+        return template.format(**joined), False
+    cap = _fair_cap(list(costs.values()), room)
+    filled: Dict[str, str] = {}
+    for k, v in slots.items():
+        if costs[k] <= cap:
+            filled[k] = joined[k]
+        elif isinstance(v, str):
+            filled[k] = fit_text(v, cap)
+        else:
+            filled[k] = "\n".join(fit_lines(v, cap))
+    return template.format(**filled), True
+
+
+def _fair_cap(costs: Sequence[int], budget: int) -> int:
+    """最大的上限 cap，使 Σ min(cost, cap) ≤ budget（水位填充）。"""
+    remaining = budget
+    ordered = sorted(costs)
+    for i, c in enumerate(ordered):
+        share = remaining // (len(ordered) - i)
+        if c > share:
+            return share
+        remaining -= c
+    return ordered[-1] if ordered else 0
+
+
+def load_prices() -> Dict[str, Tuple[float, float]]:
+    prices = dict(DEFAULT_PRICES)
+    path = os.getenv("CBT_LLM_PRICES")
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            prices.update({model: (float(p[0]), float(p[1])) for model, p in json.load(f).items()})
+    return prices
+
+
+def estimate_cost(
+    model: Optional[str],
+    prompt_tokens: int,
+    completion_tokens: int,
+    prices: Optional[Dict[str, Tuple[float, float]]] = None,
+) -> Optional[float]:
+    """按价格表估算费用（美元）；价格表中没有该模型时返回 None。"""
+    table = _PRICES if prices is None else prices
+    price = table.get(model or "")
+    if price is None:
+        return None
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+
+_PRICES = load_prices()
+
+
+# =============================
+# 用量台账
+# =============================
+
+
+@dataclass
+class UsageRecord:
+    day: str
+    session_id: str
+    therapist_id: str
+    prompt_type: str
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    estimated: bool
+    cost_usd: float
+    latency_ms: float
+
+
+class UsageLedger:
+    """LLM 调用用量台账（内存版，保留最近 max_records 条），按会话 / 治疗师 / 日期汇总费用与延迟。"""
+
+    def __init__(self, max_records: int = 100_000) -> None:
+        self._records: Deque[UsageRecord] = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        decisions: Iterable[Dict[str, Any]],
+        session_id: str = "",
+        therapist_id: str = "",
+        when: Optional[datetime] = None,
+    ) -> None:
+        """写入一次分析 / 评估的路由决策（metrics.llm_routing.RoutingLog.decisions）。"""
+        day = (when or datetime.now()).date().isoformat()
+        rows = [
+            UsageRecord(
+                day=day,
+                session_id=session_id,
+                therapist_id=therapist_id,
+                prompt_type=d["prompt_type"],
+                model=d["model"] or "",
+                prompt_tokens=int(d.get("prompt_tokens", 0)),
+                completion_tokens=int(d.get("completion_tokens", 0)),
+                estimated=bool(d.get("usage_estimated", False)),
+                cost_usd=float(d.get("cost_usd") or 0.0),
+                latency_ms=float(d["latency_ms"]),
+            )
+            for d in decisions
+        ]
+        with self._lock:
+            self._records.extend(rows)
+
+    def report(self, by: str = "session", day: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """按 session / therapist / day / prompt_type / model 分组汇总；day 可只看某一天。"""
+        field_name = {"session": "session_id", "therapist": "therapist_id"}.get(by, by)
+        if field_name not in UsageRecord.__dataclass_fields__:
+            raise ValueError(f"不支持的分组维度: {by}")
+        with self._lock:
+            rows = [r for r in self._records if day is None or r.day == day]
+
+        groups: Dict[str, List[UsageRecord]] = {}
+        for r in rows:
+            groups.setdefault(getattr(r, field_name) or "(unknown)", []).append(r)
+        out: Dict[str, Dict[str, Any]] = {}
+        for key, items in sorted(groups.items()):
+            latencies = sorted(r.latency_ms for r in items)
+            p95 = latencies[min(len(latencies) - 1, int(math.ceil(0.95 * len(latencies))) - 1)]
+            out[key] = {
+                "calls": len(items),
+                "prompt_tokens": sum(r.prompt_tokens for r in items),
+                "completion_tokens": sum(r.completion_tokens for r in items),
+                "estimated_calls": sum(1 for r in items if r.estimated),
+                "cost_usd": round(sum(r.cost_usd for r in items), 6),
+                "latency_ms_total": round(sum(latencies), 2),
+                "latency_ms_p95": round(p95, 2),
+            }
+        return out
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+
+
+_ledger = UsageLedger()
+
+
+def get_usage_ledger() -> UsageLedger:
+    return _ledger
@@ -1,7 +1,40 @@
 import json
-from typing import List, Dict, Any
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple, Union
 
-from openai import OpenAI
+import numpy as np
+
+from metrics.llm_routing import (
+    CORE_ISSUES,
+    REFLECTIVE_LANGUAGE,
+    TURN_ALIGNMENT,
+    LLMRouter,
+    get_router,
+    routing_log,
+)
+from metrics.metric_graph import content_hash
+from metrics.prompt_budget import estimate_tokens
+from metrics.session_frame import PATIENT, THERAPIST, SessionFrame, as_session_frame
+from metrics.tracing import get_tracer
+from metrics.turn_intervals import analyze_frame_intervals
+
+if TYPE_CHECKING:  # 客户端由上层注入，本模块不需要在导入时加载 openai
+    from openai import OpenAI
+
+# 提示词模板或结果解析逻辑变化时递增，使依赖图与 LLM 结果缓存失效
+PROMPT_VERSION = "1"
+
+
+def _canonical_issues(core_issues: List[Dict]) -> "OrderedDict[str, Tuple[str, str]]":
+    """规范化核心议题：键为 ``名称|优先级``（去空白、小写），值为展示用的 (名称, 优先级)，按键排序。"""
+    entries: Dict[str, Tuple[str, str]] = {}
+    for issue in core_issues:
+        name = " ".join(str(issue.get("issue") or "").split())
+        priority = str(issue.get("priority") or "unknown").strip().lower()
+        if name:
+            entries.setdefault(f"{name.casefold()}|{priority}", (name, priority))
+    return OrderedDict(sorted(entries.items()))
 
 
 class AdvancedSemanticAlignmentCalculator:
@@ -11,22 +44,48 @@ class AdvancedSemanticAlignmentCalculator:
     - 依赖 OpenRouter 兼容的 OpenAI 客户端（传入时由上层注入）。
     - 采用多次 chat.completions 调用，返回结构化 JSON。
     - 这里完全按照你给出的设计拆分各个步骤。
+    - LLM 结果按内容缓存：核心议题按患者陈述、回应契合度按（议题, 单条回应）、
+      反映性语言按单句话语，转写更正后只对变化的部分重新调用 LLM。
+    - config_digest() 概括影响结果的配置（提示词版本、租户、路由表）；配置变化后
+      首次 calculate 时清空结果缓存，Agent 的依赖图也以它判断语义节点是否失效。
     """
 
-    def __init__(self, client: OpenAI) -> None:
+    def __init__(
+        self,
+        client: "OpenAI",
+        max_cache_entries: int = 4096,
+        router: Optional[LLMRouter] = None,
+        tenant: Optional[str] = None,
+    ) -> None:
         self.client = client
+        # 各步骤使用的模型由路由表决定（metrics.llm_routing），tenant 用于按机构覆盖
+        self.router = router if router is not None else get_router()
+        self.tenant = tenant
+        self.max_cache_entries = max_cache_entries
+        self._cache: "OrderedDict[str, Any]" = OrderedDict()
+        self._cache_config = ""
+        # HTTP 服务里多个会话的语义分析会在不同线程里并发调用
+        self._cache_lock = threading.Lock()
 
     # ===== 对外主入口 =====
 
-    def calculate(self, transcript: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """完整的语义契合度分析入口。"""
-        core_issues = self._extract_patient_core_issues(transcript)
-        alignment_analysis = self._evaluate_response_alignment(transcript, core_issues)
-        reflective_language = self._detect_reflective_language(transcript)
+    def calculate(self, transcript: Union[List[Dict[str, Any]], SessionFrame]) -> Dict[str, Any]:
+        """完整的语义契合度分析入口（接受 dict 列表或 SessionFrame）。"""
+        transcript = as_session_frame(transcript=transcript)
+        self._sync_cache_config()
+        tracer = get_tracer()
+        with routing_log() as routing:
+            with tracer.span("semantic.core_issues"):
+                core_issues = self._extract_patient_core_issues(transcript)
+            with tracer.span("semantic.turn_alignment"):
+                alignment_analysis = self._evaluate_response_alignment(transcript, core_issues)
+            with tracer.span("semantic.reflective_language"):
+                reflective_language = self._detect_reflective_language(transcript)
         cognitive_empathy = self._calculate_cognitive_empathy(
             transcript, core_issues, reflective_language
         )
-        response_appropriateness = self._analyze_response_timing(transcript)
+        with tracer.span("semantic.response_timing"):
+            response_appropriateness = self._analyze_response_timing(transcript)
 
         if alignment_analysis:
             overall_alignment = sum(
@@ -51,109 +110,203 @@ class AdvancedSemanticAlignmentCalculator:
             "off_topic_count": len(
                 [a for a in alignment_analysis if float(a.get("alignment_score", 0.0)) < 0.3]
             ),
+            # 本次实际发出的 LLM 调用的路由情况与 token 用量（命中缓存的步骤不出现）
+            "routing": routing.summary(),
+            "token_usage": routing.totals(),
         }
 
     # ===== 子步骤实现 =====
 
-    def _extract_patient_core_issues(self, transcript: List[Dict[str, Any]]) -> List[Dict]:
-        patient_turns = [t["text"] for t in transcript if t.get("speaker") == "patient"]
+    def _extract_patient_core_issues(self, transcript: SessionFrame) -> List[Dict]:
+        patient_turns = transcript.texts_of(PATIENT)
         if not patient_turns:
             return []
 
-        text_block = "\n".join(patient_turns[:20])
-        prompt = f"""你是资深 CBT 督导师。从患者的陈述中提取其核心关注议题（最多 3 个）。\n\n患者陈述：\n{text_block}\n\n提取标准：\n1. 出现频率高的主题\n2. 情绪强度大的话题\n3. 与 CBT 治疗目标相关的问题\n\n输出 JSON 格式：\n{{\n  \"core_issues\": [\n    {{\n      \"issue\": \"工作压力与自我价值感\",\n      \"evidence\": \"示例\",\n      \"priority\": \"high\",\n      \"cbt_relevance\": \"示例\"\n    }}\n  ]\n}}"""
+        cache_key = content_hash("core_issues", *patient_turns[:20])
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        # 逐句公平截短：单段很长的独白只会被截短，不会撑爆提示词或挤掉其他陈述
+        prompt = self.router.build_prompt(CORE_ISSUES, """你是资深 CBT 督导师。从患者的陈述中提取其核心关注议题（最多 3 个）。\n\n患者陈述：\n{text_block}\n\n提取标准：\n1. 出现频率高的主题\n2. 情绪强度大的话题\n3. 与 CBT 治疗目标相关的问题\n\n输出 JSON 格式：\n{{\n  \"core_issues\": [\n    {{\n      \"issue\": \"工作压力与自我价值感\",\n      \"evidence\": \"示例\",\n      \"priority\": \"high\",\n      \"cbt_relevance\": \"示例\"\n    }}\n  ]\n}}""", tenant=self.tenant, text_block=patient_turns[:20])
 
+        messages = [
+            {
+                "role": "system",
+                "content": "你是 CBT 督导专家，擅长识别患者核心议题",
+            },
+            {"role": "user", "content": prompt},
+        ]
         try:
-            resp = self.client.chat.completions.create(
-                model="openai/gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "你是 CBT 督导专家，擅长识别患者核心议题",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-                response_format={"type": "json_object"},
-            )
-            content = resp.choices[0].message.content
-            data = json.loads(content)
-            return data.get("core_issues", [])
+            data = self._chat_json(CORE_ISSUES, messages)
+            core_issues = data.get("core_issues", [])
+            self._cache_put(cache_key, core_issues)
+            return core_issues
         except Exception as e:  # noqa: BLE001
             print(f"核心议题抽取失败: {e}")
             return []
 
     def _evaluate_response_alignment(
-        self, transcript: List[Dict[str, Any]], core_issues: List[Dict]
+        self, transcript: SessionFrame, core_issues: List[Dict]
     ) -> List[Dict[str, Any]]:
-        therapist_turns = [t for t in transcript if t.get("speaker") == "therapist"]
+        therapist_turns = transcript.texts_of(THERAPIST)
         if not therapist_turns or not core_issues:
             return []
 
+        # 缓存键只取规范化后的议题集合（名称 + 优先级，排序去重），而不是患者原文或
+        # 摘要文本：修改前 20 句患者陈述会重新抽取核心议题，但只要抽出的议题不变，
+        # 逐句契合度结果全部复用；议题本身变化时才整体重算
+        canonical = _canonical_issues(core_issues)
         issues_summary = "\n".join(
-            f"- {issue.get('issue')} (优先级: {issue.get('priority', 'unknown')})"
-            for issue in core_issues
+            f"- {name} (优先级: {priority})" for name, priority in canonical.values()
         )
+        issues_key = "\n".join(canonical)
 
         results: List[Dict[str, Any]] = []
-        for idx, turn in enumerate(therapist_turns[:15]):
-            turn_text = turn.get("text", "")
-            prompt = f"""评估以下治疗师回应与患者核心议题的契合度。\n\n核心议题：\n{issues_summary}\n\n治疗师回应 #{idx + 1}：\n\"{turn_text}\"\n\n评估标准（0-1 分）：\n- 1.0: 直接回应核心议题，提供深度洞察或有效干预\n- 0.7: 与核心议题相关，展现理解\n- 0.5: 部分相关，但未深入\n- 0.3: 表面回应，未触及核心\n- 0.0: 完全偏离主题\n\n输出 JSON：\n{{\n  \"alignment_score\": 0.8,\n  \"addressed_issue\": \"工作压力与自我价值感\",\n  \"technique_used\": \"苏格拉底提问\",\n  \"reasoning\": \"示例\",\n  \"empathy_present\": true\n}}"""
+        for idx, turn_text in enumerate(therapist_turns[:15]):
+            cache_key = content_hash("alignment", issues_key, turn_text)
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                results.append(cached)
+                continue
+            prompt = self.router.build_prompt(TURN_ALIGNMENT, """评估以下治疗师回应与患者核心议题的契合度。\n\n核心议题：\n{issues_summary}\n\n治疗师回应 #{turn_no}：\n\"{turn_text}\"\n\n评估标准（0-1 分）：\n- 1.0: 直接回应核心议题，提供深度洞察或有效干预\n- 0.7: 与核心议题相关，展现理解\n- 0.5: 部分相关，但未深入\n- 0.3: 表面回应，未触及核心\n- 0.0: 完全偏离主题\n\n输出 JSON：\n{{\n  \"alignment_score\": 0.8,\n  \"addressed_issue\": \"工作压力与自我价值感\",\n  \"technique_used\": \"苏格拉底提问\",\n  \"reasoning\": \"示例\",\n  \"empathy_present\": true\n}}""", tenant=self.tenant, issues_summary=issues_summary, turn_no=str(idx + 1), turn_text=turn_text)
+            messages = [
+                {"role": "system", "content": "你是 CBT 督导专家"},
+                {"role": "user", "content": prompt},
+            ]
             try:
-                resp = self.client.chat.completions.create(
-                    model="openai/gpt-4o",
-                    messages=[
-                        {"role": "system", "content": "你是 CBT 督导专家"},
-                        {"role": "user", "content": prompt},
-                    ],
-                    response_format={"type": "json_object"},
-                    temperature=0.3,
-                )
-                content = resp.choices[0].message.content
-                data = json.loads(content)
+                with get_tracer().span("semantic.turn_alignment.llm", turn=idx):
+                    data = self._chat_json(TURN_ALIGNMENT, messages, temperature=0.3)
+                self._cache_put(cache_key, data)
                 results.append(data)
             except Exception as e:  # noqa: BLE001
                 print(f"回应契合度评估失败 (turn {idx}): {e}")
         return results
 
     def _detect_reflective_language(
-        self, transcript: List[Dict[str, Any]]
+        self, transcript: SessionFrame
     ) -> Dict[str, Any]:
-        therapist_utterances = [
-            t.get("text", "") for t in transcript if t.get("speaker") == "therapist"
-        ]
+        therapist_utterances = transcript.texts_of(THERAPIST)
         if not therapist_utterances:
             return {"reflective_rate": 0.0, "types": {}, "examples": []}
 
-        listing = "\n".join(
-            f"{i + 1}. {u}" for i, u in enumerate(therapist_utterances[:20])
-        )
-        prompt = f"""分析以下治疗师话语中的反映性语言使用情况。\n\n治疗师话语（前 20 句）：\n{listing}\n\n识别以下类型的反映性语言：\n1. 情绪标注（emotion labeling）\n2. 内容复述（content reflection）\n3. 验证性回应（validation）\n4. 开放式提问（open-ended questions）\n\n输出 JSON：\n{{\n  \"reflective_utterances\": [\n    {{\"index\": 3, \"type\": \"emotion_labeling\", \"content\": \"示例\"}}\n  ],\n  \"reflective_count\": 8,\n  \"total_count\": 20,\n  \"reflective_rate\": 0.40\n}}"""
+        # 逐句缓存标注结果（{} 表示非反映性），只把没见过的话语发给 LLM
+        listed = therapist_utterances[:20]
+        keys = [content_hash("reflective", u) for u in listed]
+        labels: List[Optional[Dict[str, Any]]] = [self._cache_get(k) for k in keys]
+        pending = [i for i, label in enumerate(labels) if label is None]
+        if pending:
+            fresh = self._label_reflective_utterances(listed, pending)
+            if fresh is None:
+                return {"reflective_rate": 0.0, "types": {}, "examples": []}
+            for i in pending:
+                labels[i] = fresh.get(i, {})
+                self._cache_put(keys[i], labels[i])
+
+        reflective = [(i, label) for i, label in enumerate(labels) if label]
+        types_count: Dict[str, int] = {}
+        for _, label in reflective:
+            rtype = label.get("type", "unknown")
+            types_count[rtype] = types_count.get(rtype, 0) + 1
+        return {
+            "reflective_rate": round(len(reflective) / len(listed), 2),
+            "reflective_count": len(reflective),
+            "total_count": len(listed),
+            "types": types_count,
+            "examples": [{"index": i + 1, **label} for i, label in reflective[:5]],
+        }
+
+    def _label_reflective_utterances(
+        self, listed: List[str], pending: List[int]
+    ) -> Optional[Dict[int, Dict[str, Any]]]:
+        """让 LLM 标注 pending 中的话语；返回 {下标: {"type", "content"}}，失败返回 None。"""
+        header = "前 20 句" if len(pending) == len(listed) else "节选，编号为原序号"
+        prompt = self.router.build_prompt(REFLECTIVE_LANGUAGE, """分析以下治疗师话语中的反映性语言使用情况。\n\n治疗师话语（{header}）：\n{listing}\n\n识别以下类型的反映性语言：\n1. 情绪标注（emotion labeling）\n2. 内容复述（content reflection）\n3. 验证性回应（validation）\n4. 开放式提问（open-ended questions）\n\n输出 JSON：\n{{\n  \"reflective_utterances\": [\n    {{\"index\": 3, \"type\": \"emotion_labeling\", \"content\": \"示例\"}}\n  ],\n  \"reflective_count\": 8,\n  \"total_count\": 20,\n  \"reflective_rate\": 0.40\n}}""", tenant=self.tenant, header=header, listing=[f"{i + 1}. {listed[i]}" for i in pending])
         try:
+            data = self._chat_json(REFLECTIVE_LANGUAGE, [{"role": "user", "content": prompt}])
+        except Exception as e:  # noqa: BLE001
+            print(f"反映性语言检测失败: {e}")
+            return None
+
+        wanted = set(pending)
+        labels: Dict[int, Dict[str, Any]] = {}
+        for item in data.get("reflective_utterances", []):
+            try:
+                idx = int(item.get("index", 0)) - 1
+            except (TypeError, ValueError):
+                continue
+            if idx in wanted:
+                labels[idx] = {
+                    "type": item.get("type", "unknown"),
+                    "content": item.get("content", listed[idx]),
+                }
+        return labels
+
+    def clear_cache(self) -> None:
+        """清空 LLM 结果缓存。"""
+        with self._cache_lock:
+            self._cache.clear()
+
+    def config_digest(self) -> str:
+        """影响 LLM 结果的配置摘要：提示词版本、租户与路由表（模型、token 上限等）。"""
+        return content_hash(PROMPT_VERSION, self.tenant or "", self.router.table.fingerprint())
+
+    def _sync_cache_config(self) -> None:
+        digest = self.config_digest()
+        with self._cache_lock:
+            if digest != self._cache_config:
+                self._cache.clear()
+                self._cache_config = digest
+
+    def _cache_get(self, key: str) -> Any:
+        with self._cache_lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+        if value is not None:
+            get_tracer().current_span().add("cache_hits", 1)
+        return value
+
+    def _cache_put(self, key: str, value: Any) -> None:
+        with self._cache_lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cache_entries:
+                self._cache.popitem(last=False)
+
+    def _chat_json(self, prompt_type: str, messages: List[Dict[str, str]], **kwargs: Any) -> Dict[str, Any]:
+        """按路由表选择模型发起 JSON 模式调用；调用失败或输出不是 JSON 时按回退链换模型。"""
+
+        def attempt(model: str, max_tokens: int, timeout: float):
             resp = self.client.chat.completions.create(
-                model="openai/gpt-4o",
-                messages=[{"role": "user", "content": prompt}],
+                model=model,
+                messages=messages,
                 response_format={"type": "json_object"},
+                max_tokens=max_tokens,
+                timeout=timeout,
+                **kwargs,
             )
-            content = resp.choices[0].message.content
-            data = json.loads(content)
-            types_count: Dict[str, int] = {}
-            for item in data.get("reflective_utterances", []):
-                rtype = item.get("type", "unknown")
-                types_count[rtype] = types_count.get(rtype, 0) + 1
-            return {
-                "reflective_rate": data.get("reflective_rate", 0.0),
-                "reflective_count": data.get("reflective_count", 0),
-                "total_count": data.get("total_count", len(therapist_utterances)),
-                "types": types_count,
-                "examples": data.get("reflective_utterances", [])[:5],
-            }
-        except Exception as e:  # noqa: BLE001
-            print(f"反映性语言检测失败: {e}")
-            return {"reflective_rate": 0.0, "types": {}, "examples": []}
+            usage = self._record_usage(resp)
+            return json.loads(resp.choices[0].message.content), usage
+
+        estimated = sum(estimate_tokens(m["content"]) for m in messages)
+        return self.router.call(prompt_type, attempt, tenant=self.tenant, prompt_tokens=estimated)
+
+    def _record_usage(self, resp: Any) -> Optional[Tuple[int, int]]:
+        """把响应中的 token 用量记到当前追踪 span 上，并返回 (prompt_tokens, completion_tokens)。"""
+        span = get_tracer().current_span()
+        span.add("llm_calls", 1)
+        usage = getattr(resp, "usage", None)
+        if usage is None:
+            return None
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        span.add("llm_prompt_tokens", prompt_tokens)
+        span.add("llm_completion_tokens", completion_tokens)
+        return prompt_tokens, completion_tokens
 
     def _calculate_cognitive_empathy(
         self,
-        transcript: List[Dict[str, Any]],
+        transcript: SessionFrame,
         core_issues: List[Dict[str, Any]],
         reflective_language: Dict[str, Any],
     ) -> Dict[str, Any]:
@@ -171,22 +324,24 @@ class AdvancedSemanticAlignmentCalculator:
         }
 
     def _analyze_response_timing(
-        self, transcript: List[Dict[str, Any]]
+        self, transcript: SessionFrame
     ) -> Dict[str, Any]:
-        latencies: List[float] = []
-        interruptions = 0
-        for i in range(len(transcript) - 1):
-            cur = transcript[i]
-            nxt = transcript[i + 1]
-            if cur.get("speaker") != nxt.get("speaker"):
-                latency = float(nxt.get("start", 0.0)) - float(cur.get("end", 0.0))
-                latencies.append(latency)
-                if latency < 0.2:
-                    interruptions += 1
-        avg_latency = sum(latencies) / len(latencies) if latencies else 0.0
+        # 相邻轮次换人时的间隔（向量化）
+        switch = transcript.turn_speaker[1:] != transcript.turn_speaker[:-1]
+        latencies = (transcript.turn_start[1:] - transcript.turn_end[:-1])[switch]
+        avg_latency = float(latencies.mean()) if len(latencies) else 0.0
+        # 打断 / 重叠 / 静默来自区间扫描：包括不相邻轮次之间的重叠
+        intervals = analyze_frame_intervals(transcript)
+        interruptions = intervals.interruption_count
+        by_initiator = intervals.interruptions_by_initiator()
         return {
             "avg_response_latency": round(avg_latency, 2),
             "interruption_count": interruptions,
+            "interruptions_by_initiator": {
+                transcript.speakers[c]: int(by_initiator[c]) for c in np.flatnonzero(by_initiator)
+            },
+            "overlap_seconds": round(intervals.overlap_seconds, 2),
+            "silence": intervals.silence_distribution(),
             "interpretation": self._interpret_timing(avg_latency, interruptions),
         }
 
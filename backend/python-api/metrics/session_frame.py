@@ -0,0 +1,236 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from metrics.metric_graph import content_hash
+
+# 说话人编码：0/1 固定为治疗师/患者，其余标签按出现顺序追加
+THERAPIST = 0
+PATIENT = 1
+DEFAULT_SPEAKERS = ("therapist", "patient")
+
+
+class TurnView:
+    """转写轮次的只读行视图（按需访问，不复制数据）。"""
+
+    __slots__ = ("_frame", "_i")
+
+    def __init__(self, frame: "SessionFrame", i: int) -> None:
+        self._frame = frame
+        self._i = i
+
+    @property
+    def speaker(self) -> str:
+        return self._frame.speakers[self._frame.turn_speaker[self._i]]
+
+    @property
+    def text(self) -> str:
+        return self._frame.texts[self._i]
+
+    @property
+    def start(self) -> float:
+        return float(self._frame.turn_start[self._i])
+
+    @property
+    def end(self) -> float:
+        return float(self._frame.turn_end[self._i])
+
+
+class EmotionView:
+    """情绪采样点的只读行视图。"""
+
+    __slots__ = ("_frame", "_i")
+
+    def __init__(self, frame: "SessionFrame", i: int) -> None:
+        self._frame = frame
+        self._i = i
+
+    @property
+    def speaker(self) -> str:
+        return self._frame.speakers[self._frame.emo_speaker[self._i]]
+
+    @property
+    def timestamp(self) -> float:
+        return float(self._frame.emo_timestamp[self._i])
+
+    @property
+    def valence(self) -> float:
+        return float(self._frame.emo_valence[self._i])
+
+    @property
+    def arousal(self) -> float:
+        return float(self._frame.emo_arousal[self._i])
+
+
+class SessionFrame:
+    """单次会话的列式表示，由各指标计算器共享。
+
+    转写：turn_speaker(int16) / turn_start / turn_end(float64) / texts(list[str])
+    情绪：emo_speaker(int16) / emo_timestamp / emo_valence / emo_arousal(float64)
+    speakers: 编码 → 标签词表（0=therapist, 1=patient）
+
+    会话只在入口处解析一次，之后所有指标直接读数组，不再反复构造 dataclass / dict。
+    """
+
+    __slots__ = (
+        "speakers",
+        "_speaker_index",
+        "turn_speaker",
+        "turn_start",
+        "turn_end",
+        "texts",
+        "emo_speaker",
+        "emo_timestamp",
+        "emo_valence",
+        "emo_arousal",
+    )
+
+    def __init__(
+        self,
+        speakers: Sequence[str],
+        turn_speaker: np.ndarray,
+        turn_start: np.ndarray,
+        turn_end: np.ndarray,
+        texts: List[str],
+        emo_speaker: np.ndarray,
+        emo_timestamp: np.ndarray,
+        emo_valence: np.ndarray,
+        emo_arousal: np.ndarray,
+    ) -> None:
+        self.speakers = list(speakers)
+        self._speaker_index = {s: i for i, s in enumerate(self.speakers)}
+        self.turn_speaker = turn_speaker
+        self.turn_start = turn_start
+        self.turn_end = turn_end
+        self.texts = texts
+        self.emo_speaker = emo_speaker
+        self.emo_timestamp = emo_timestamp
+        self.emo_valence = emo_valence
+        self.emo_arousal = emo_arousal
+
+    # ===== 构建 =====
+
+    @classmethod
+    def from_records(
+        cls,
+        transcript: Optional[Iterable[Dict[str, Any]]] = None,
+        emotion_timeline: Optional[Iterable[Dict[str, Any]]] = None,
+    ) -> "SessionFrame":
+        """从原始 dict 列表构建（字段缺失时抛出 KeyError，与 dataclass 构造保持同样的严格程度）。"""
+        speakers: List[str] = list(DEFAULT_SPEAKERS)
+        index = {s: i for i, s in enumerate(speakers)}
+
+        def code(label: str) -> int:
+            c = index.get(label)
+            if c is None:
+                c = index[label] = len(speakers)
+                speakers.append(label)
+            return c
+
+        t_speaker: List[int] = []
+        t_start: List[float] = []
+        t_end: List[float] = []
+        texts: List[str] = []
+        for t in transcript or ():
+            t_speaker.append(code(t["speaker"]))
+            texts.append(t["text"])
+            t_start.append(t["start"])
+            t_end.append(t["end"])
+
+        e_speaker: List[int] = []
+        e_ts: List[float] = []
+        e_val: List[float] = []
+        e_aro: List[float] = []
+        for e in emotion_timeline or ():
+            e_speaker.append(code(e["speaker"]))
+            e_ts.append(e["timestamp"])
+            e_val.append(e["valence"])
+            e_aro.append(e.get("arousal", 0.0))
+
+        return cls(
+            speakers=speakers,
+            turn_speaker=np.asarray(t_speaker, dtype=np.int16),
+            turn_start=np.asarray(t_start, dtype=np.float64),
+            turn_end=np.asarray(t_end, dtype=np.float64),
+            texts=texts,
+            emo_speaker=np.asarray(e_speaker, dtype=np.int16),
+            emo_timestamp=np.asarray(e_ts, dtype=np.float64),
+            emo_valence=np.asarray(e_val, dtype=np.float64),
+            emo_arousal=np.asarray(e_aro, dtype=np.float64),
+        )
+
+    @classmethod
+    def from_session(cls, session: Any) -> "SessionFrame":
+        """从 SessionInput（或任何带 transcript/emotion_timeline 属性的对象）构建。"""
+        return cls.from_records(session.transcript, session.emotion_timeline)
+
+    # ===== 访问 =====
+
+    def speaker_code(self, label: str) -> int:
+        """标签 → 编码；会话中未出现的标签返回 -1（与任何行都不匹配）。"""
+        return self._speaker_index.get(label, -1)
+
+    @property
+    def n_turns(self) -> int:
+        return len(self.texts)
+
+    @property
+    def n_emotions(self) -> int:
+        return len(self.emo_timestamp)
+
+    def turns(self) -> Iterator[TurnView]:
+        for i in range(self.n_turns):
+            yield TurnView(self, i)
+
+    def emotions(self) -> Iterator[EmotionView]:
+        for i in range(self.n_emotions):
+            yield EmotionView(self, i)
+
+    def transcript_digest(self) -> str:
+        """转写内容（说话人、时间、文本）的摘要，用于增量重算时判断是否失效。"""
+        return content_hash(
+            "\x1f".join(self.speakers),
+            self.turn_speaker,
+            self.turn_start,
+            self.turn_end,
+            *self.texts,
+        )
+
+    def emotion_digest(self) -> str:
+        """情绪时间线的摘要。"""
+        return content_hash(
+            "\x1f".join(self.speakers),
+            self.emo_speaker,
+            self.emo_timestamp,
+            self.emo_valence,
+            self.emo_arousal,
+        )
+
+    def emotion_only(self) -> "SessionFrame":
+        """只保留情绪列的副本（转写列置空），发往进程池时减少序列化的数据量。"""
+        return SessionFrame(
+            speakers=self.speakers,
+            turn_speaker=np.zeros(0, dtype=np.int16),
+            turn_start=np.zeros(0, dtype=np.float64),
+            turn_end=np.zeros(0, dtype=np.float64),
+            texts=[],
+            emo_speaker=self.emo_speaker,
+            emo_timestamp=self.emo_timestamp,
+            emo_valence=self.emo_valence,
+            emo_arousal=self.emo_arousal,
+        )
+
+    def texts_of(self, code: int) -> List[str]:
+        """某位说话人的全部发言（保持原顺序）。"""
+        return [self.texts[i] for i in np.flatnonzero(self.turn_speaker == code)]
+
+
+def as_session_frame(
+    transcript: Any = None, emotion_timeline: Any = None
+) -> SessionFrame:
+    """兼容入口：已是 SessionFrame 则原样返回，否则按 dict 列表构建。"""
+    if isinstance(transcript, SessionFrame):
+        return transcript
+    if isinstance(emotion_timeline, SessionFrame):
+        return emotion_timeline
+    return SessionFrame.from_records(transcript, emotion_timeline)
@@ -0,0 +1,381 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("cbt.tracing")
+
+
+class Span:
+    """单个阶段的计时记录。
+
+    - attributes: 任意标注（模型名、轮次序号等）
+    - counters: 可累加的数值（LLM token 数、缓存命中数等）
+    """
+
+    __slots__ = ("name", "parent", "start_ns", "wall_start_ns", "duration_ns", "attributes", "counters", "error")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]) -> None:
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.counters: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self.start_ns = 0
+        self.wall_start_ns = 0
+        self.duration_ns = 0
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def add(self, key: str, value: float = 1) -> None:
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    @property
+    def duration_ms(self) -> float:
+        return self.duration_ns / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "parent": self.parent.name if self.parent is not None else None,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "counters": self.counters,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """关闭追踪时返回的空实现：不计时、不分配，保证开销接近于零。"""
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def add(self, key: str, value: float = 1) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("cbt_current_span", default=None)
+_current_trace: contextvars.ContextVar[Optional[List[Span]]] = contextvars.ContextVar("cbt_current_trace", default=None)
+
+
+class _SpanContext:
+    __slots__ = ("_tracer", "_span", "_is_root", "_span_token", "_trace_token")
+
+    def __init__(self, tracer: "Tracer", span: Span, is_root: bool) -> None:
+        self._tracer = tracer
+        self._span = span
+        self._is_root = is_root
+        self._span_token = None
+        self._trace_token = None
+
+    def __enter__(self) -> Span:
+        span = self._span
+        if self._is_root:
+            self._trace_token = _current_trace.set([])
+        self._span_token = _current_span.set(span)
+        span.wall_start_ns = time.time_ns()
+        span.start_ns = time.perf_counter_ns()
+        return span
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        span = self._span
+        span.duration_ns = time.perf_counter_ns() - span.start_ns
+        if exc_type is not None:
+            span.error = exc_type.__name__
+        _current_span.reset(self._span_token)
+        spans = _current_trace.get()
+        if spans is not None:
+            spans.append(span)
+        self._tracer._record(span)
+        if self._is_root:
+            _current_trace.reset(self._trace_token)
+            self._tracer._export(span, spans or [span])
+        return False
+
+
+# =============================
+# Prometheus 风格的聚合指标
+# =============================
+
+_DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class MetricsRegistry:
+    """按阶段名聚合耗时直方图与计数器，渲染为 Prometheus 文本格式。"""
+
+    def __init__(self, buckets: Tuple[float, ...] = _DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._hist: Dict[str, List[float]] = {}
+        self._sum: Dict[str, float] = {}
+        self._count: Dict[str, int] = {}
+        self._errors: Dict[str, int] = {}
+        self._counters: Dict[Tuple[str, str], float] = {}
+        self._gauges: Dict[str, Callable[[], Dict[str, float]]] = {}
+
+    def observe(self, span: Span) -> None:
+        seconds = span.duration_ns / 1e9
+        with self._lock:
+            hist = self._hist.get(span.name)
+            if hist is None:
+                hist = self._hist[span.name] = [0] * len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    hist[i] += 1
+            self._sum[span.name] = self._sum.get(span.name, 0.0) + seconds
+            self._count[span.name] = self._count.get(span.name, 0) + 1
+            if span.error is not None:
+                self._errors[span.name] = self._errors.get(span.name, 0) + 1
+            for key, value in span.counters.items():
+                self._counters[(span.name, key)] = self._counters.get((span.name, key), 0) + value
+
+    def register_gauges(self, name: str, collect: Callable[[], Dict[str, float]]) -> None:
+        """注册外部数值（例如合并请求数、队列深度），渲染时调用 collect() 读取。"""
+        self._gauges[name] = collect
+
+    def render(self) -> str:
+        lines: List[str] = [
+            "# HELP cbt_stage_duration_seconds 各分析阶段耗时",
+            "# TYPE cbt_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for stage in sorted(self._hist):
+                for bound, count in zip(self.buckets, self._hist[stage]):
+                    lines.append(f'cbt_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'cbt_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {self._count[stage]}')
+                lines.append(f'cbt_stage_duration_seconds_sum{{stage="{stage}"}} {self._sum[stage]:.6f}')
+                lines.append(f'cbt_stage_duration_seconds_count{{stage="{stage}"}} {self._count[stage]}')
+            lines.append("# HELP cbt_stage_errors_total 各阶段异常次数")
+            lines.append("# TYPE cbt_stage_errors_total counter")
+            for stage in sorted(self._errors):
+                lines.append(f'cbt_stage_errors_total{{stage="{stage}"}} {self._errors[stage]}')
+            lines.append("# HELP cbt_stage_counter_total 阶段内累加计数（LLM token、缓存命中等）")
+            lines.append("# TYPE cbt_stage_counter_total counter")
+            for (stage, key) in sorted(self._counters):
+                lines.append(f'cbt_stage_counter_total{{stage="{stage}",key="{key}"}} {self._counters[(stage, key)]:g}')
+            gauges = dict(self._gauges)
+        for name in sorted(gauges):
+            try:
+                values = gauges[name]()
+            except Exception:  # noqa: BLE001
+                continue
+            lines.append(f"# TYPE cbt_{name} gauge")
+            for key in sorted(values):
+                lines.append(f'cbt_{name}{{key="{key}"}} {float(values[key]):g}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._hist.clear()
+            self._sum.clear()
+            self._count.clear()
+            self._errors.clear()
+            self._counters.clear()
+
+
+# =============================
+# 导出器
+# =============================
+
+
+def log_exporter(root: Span, spans: List[Span]) -> None:
+    """把一次完整追踪输出为一行结构化 JSON 日志。"""
+    totals: Dict[str, float] = {}
+    for s in spans:
+        for key, value in s.counters.items():
+            totals[key] = totals.get(key, 0) + value
+    logger.info(
+        json.dumps(
+            {
+                "event": "trace",
+                "trace": root.name,
+                "duration_ms": round(root.duration_ms, 3),
+                "attributes": root.attributes,
+                "totals": totals,
+                "spans": [s.to_dict() for s in spans],
+            },
+            ensure_ascii=False,
+            default=str,
+        )
+    )
+
+
+class OpenTelemetryExporter:
+    """可选的 OpenTelemetry 导出器（需要安装 opentelemetry-api/sdk）。
+
+    追踪结束后按记录的起止时间回放为 OTel span，父子关系保持不变。
+    """
+
+    def __init__(self, tracer_name: str = "cbt.metrics") -> None:
+        try:
+            from opentelemetry import trace as otel_trace
+        except ImportError as e:  # pragma: no cover - 可选依赖
+            raise ImportError("OpenTelemetry 导出需要安装 opentelemetry-api 与 opentelemetry-sdk") from e
+        self._otel_trace = otel_trace
+        self._tracer = otel_trace.get_tracer(tracer_name)
+
+    def __call__(self, root: Span, spans: List[Span]) -> None:
+        otel_spans: Dict[int, Any] = {}
+
+        def emit(span: Span) -> Any:
+            key = id(span)
+            if key in otel_spans:
+                return otel_spans[key]
+            context = None
+            if span.parent is not None and id(span.parent) in otel_spans:
+                context = self._otel_trace.set_span_in_context(otel_spans[id(span.parent)])
+            attrs = {k: v for k, v in span.attributes.items() if isinstance(v, (str, bool, int, float))}
+            attrs.update(span.counters)
+            otel_span = self._tracer.start_span(
+                span.name, context=context, start_time=span.wall_start_ns, attributes=attrs
+            )
+            otel_spans[key] = otel_span
+            return otel_span
+
+        # spans 按结束顺序排列（子在前），父 span 需先创建
+        ordered = sorted(spans, key=lambda s: s.wall_start_ns)
+        for span in ordered:
+            emit(span)
+        for span in ordered:
+            otel_spans[id(span)].end(end_time=span.wall_start_ns + span.duration_ns)
+
+
+# =============================
+# Tracer
+# =============================
+
+
+class Tracer:
+    """轻量的阶段追踪器。
+
+    用法：
+        tracer = get_tracer()
+        with tracer.trace("analyze_session", session_id=...):
+            with tracer.span("metrics.emotion_synchrony") as span:
+                span.add("llm_prompt_tokens", 120)
+
+    关闭时 span()/trace() 直接返回共享的空上下文，不做任何计时。
+    """
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.registry = MetricsRegistry()
+        self.exporters: List[Callable[[Span, List[Span]], None]] = []
+
+    def span(self, name: str, **attributes: Any):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _SpanContext(self, Span(name, _current_span.get(), attributes), is_root=False)
+
+    def trace(self, name: str, **attributes: Any):
+        """开启一次完整追踪（根 span），结束时交给各导出器。"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _SpanContext(self, Span(name, _current_span.get(), attributes), is_root=True)
+
+    def current_span(self):
+        """返回当前 span（未开启或不在 span 内时返回空实现），便于在深层补充计数。"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _current_span.get() or _NOOP_SPAN
+
+    def _record(self, span: Span) -> None:
+        self.registry.observe(span)
+
+    def _export(self, root: Span, spans: List[Span]) -> None:
+        for exporter in self.exporters:
+            try:
+                exporter(root, spans)
+            except Exception as e:  # noqa: BLE001
+                logger.warning(f"追踪导出失败: {e}")
+
+
+_tracer = Tracer(enabled=os.getenv("CBT_TRACING", "0") == "1")
+if _tracer.enabled:
+    _tracer.exporters.append(log_exporter)
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+# =============================
+# 跨进程合并（进程池中计算的阶段）
+# =============================
+
+
+@contextmanager
+def capture_spans() -> Iterator[List[Span]]:
+    """在工作进程里开启追踪并收集本次任务的 span（不导出），配合 span_records 传回父进程。"""
+    previous = _tracer.enabled
+    _tracer.enabled = True
+    trace_token = _current_trace.set([])
+    span_token = _current_span.set(None)
+    try:
+        yield _current_trace.get()
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        _tracer.enabled = previous
+
+
+def span_records(spans: List[Span]) -> List[Dict[str, Any]]:
+    """把 span 转成可 pickle 的记录；parent 为记录下标，顶层为 None。"""
+    index = {id(s): i for i, s in enumerate(spans)}
+    return [
+        {
+            "name": s.name,
+            "parent": index.get(id(s.parent)) if s.parent is not None else None,
+            "wall_start_ns": s.wall_start_ns,
+            "duration_ns": s.duration_ns,
+            "attributes": s.attributes,
+            "counters": s.counters,
+            "error": s.error,
+        }
+        for s in spans
+    ]
+
+
+def merge_span_records(records: List[Dict[str, Any]]) -> None:
+    """把工作进程传回的记录挂到当前 span 下，计入当前追踪与聚合指标。"""
+    if not _tracer.enabled or not records:
+        return
+    parent = _current_span.get()
+    spans = [Span(r["name"], None, dict(r["attributes"])) for r in records]
+    for span, r in zip(spans, records):
+        span.parent = spans[r["parent"]] if r["parent"] is not None else parent
+        span.wall_start_ns = r["wall_start_ns"]
+        span.duration_ns = r["duration_ns"]
+        span.counters = dict(r["counters"])
+        span.error = r["error"]
+    trace = _current_trace.get()
+    for span in spans:
+        if trace is not None:
+            trace.append(span)
+        _tracer._record(span)
+
+
+def configure_tracing(enabled: bool = True, log: bool = True, otel: bool = False) -> Tracer:
+    """开启/关闭全局追踪并设置导出器（Prometheus 聚合始终随追踪开启）。"""
+    _tracer.enabled = enabled
+    _tracer.exporters = []
+    if enabled and log:
+        _tracer.exporters.append(log_exporter)
+    if enabled and (otel or os.getenv("CBT_TRACING_OTEL", "0") == "1"):
+        _tracer.exporters.append(OpenTelemetryExporter())
+    return _tracer
@@ -0,0 +1,179 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+from metrics.session_frame import SessionFrame
+
+# 静默时长分布的分桶边界（秒）
+SILENCE_BUCKETS = (0.0, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+
+@dataclass
+class TurnIntervalStats:
+    """转写区间的扫描结果（按说话人编码索引的数组）。
+
+    - talk_seconds：每位说话人自身区间并集的时长（同一人的分段重叠不会重复计时）
+    - exclusive_seconds：只有该说话人在说话的时长
+    - overlap_seconds：两人及以上同时说话的总时长
+    - silence_gaps：所有人都不说话的间隙（首个区间开始到最后一个区间结束之间）
+    - interruption_*：某人在他人说话期间开口的事件；target 为 -1 表示当时不止一人在说话
+    """
+
+    talk_seconds: np.ndarray
+    exclusive_seconds: np.ndarray
+    overlap_seconds: float
+    speech_seconds: float
+    silence_gaps: np.ndarray
+    interruption_time: np.ndarray
+    interruption_initiator: np.ndarray
+    interruption_target: np.ndarray
+    interruption_overlap: np.ndarray
+
+    @property
+    def interruption_count(self) -> int:
+        return len(self.interruption_time)
+
+    def interruptions_by_initiator(self) -> np.ndarray:
+        return np.bincount(self.interruption_initiator, minlength=len(self.talk_seconds))
+
+    def silence_distribution(self) -> Dict[str, Any]:
+        gaps = self.silence_gaps
+        if len(gaps) == 0:
+            return {"count": 0, "total_seconds": 0.0, "mean": 0.0, "p50": 0.0, "p90": 0.0, "max": 0.0, "histogram": {}}
+        edges = np.asarray(SILENCE_BUCKETS + (np.inf,))
+        counts = np.histogram(gaps, bins=edges)[0]
+        labels = [f"{lo:g}-{hi:g}s" for lo, hi in zip(SILENCE_BUCKETS[:-1], SILENCE_BUCKETS[1:])]
+        labels.append(f">{SILENCE_BUCKETS[-1]:g}s")
+        p50, p90 = np.percentile(gaps, [50, 90])
+        return {
+            "count": int(len(gaps)),
+            "total_seconds": round(float(gaps.sum()), 2),
+            "mean": round(float(gaps.mean()), 3),
+            "p50": round(float(p50), 3),
+            "p90": round(float(p90), 3),
+            "max": round(float(gaps.max()), 3),
+            "histogram": {label: int(c) for label, c in zip(labels, counts)},
+        }
+
+    def to_dict(self, speakers: Sequence[str]) -> Dict[str, Any]:
+        """转成 JSON 友好的字典；speakers 为编码 → 标签词表。"""
+        present = np.flatnonzero(self.talk_seconds > 0)
+        by_initiator = self.interruptions_by_initiator()
+        return {
+            "talk_seconds": {speakers[c]: round(float(self.talk_seconds[c]), 2) for c in present},
+            "exclusive_seconds": {speakers[c]: round(float(self.exclusive_seconds[c]), 2) for c in present},
+            "overlap_seconds": round(self.overlap_seconds, 2),
+            "speech_seconds": round(self.speech_seconds, 2),
+            "interruption_count": self.interruption_count,
+            "interruptions_by_initiator": {
+                speakers[c]: int(by_initiator[c]) for c in np.flatnonzero(by_initiator)
+            },
+            "silence": self.silence_distribution(),
+        }
+
+
+def analyze_turn_intervals(
+    speaker: Sequence[int],
+    start: Sequence[float],
+    end: Sequence[float],
+    n_speakers: Optional[int] = None,
+) -> TurnIntervalStats:
+    """对转写区间做一次排序 + 一次扫描，O(n log n)，可直接用于词级 ASR 分段。
+
+    步骤：
+    1. 按 (说话人, 开始时间) 排序一次，分组累计最大结束时间，把同一人相互重叠/相接的分段合并为块
+    2. 所有块的开始(+1) / 结束(-1) 事件按时间排序（同一时刻先结束后开始），累加得到
+       每段时间内的活跃人数；同时累加说话人编码，活跃人数为 1 时它就是当前唯一说话人
+    3. 活跃人数为 0 / 1 / ≥2 的时间段分别计入静默、独占说话、重叠说话
+    """
+    sp = np.asarray(speaker, dtype=np.int64)
+    st = np.asarray(start, dtype=np.float64)
+    en = np.asarray(end, dtype=np.float64)
+    n_codes = int(n_speakers) if n_speakers is not None else (int(sp.max()) + 1 if len(sp) else 0)
+    # 零长度或倒置的区间不占用时间，直接丢弃
+    keep = en > st
+    if not keep.all():
+        sp, st, en = sp[keep], st[keep], en[keep]
+    n = len(st)
+    if n == 0:
+        empty_f, empty_i = np.zeros(0), np.zeros(0, dtype=np.int64)
+        return TurnIntervalStats(
+            np.zeros(n_codes), np.zeros(n_codes), 0.0, 0.0, empty_f, empty_f, empty_i, empty_i, empty_f
+        )
+
+    # 1. 每位说话人的区间合并为不相交的块
+    order = np.lexsort((st, sp))
+    sp_o, st_o, en_o = sp[order], st[order], en[order]
+    group_starts = np.flatnonzero(np.r_[True, sp_o[1:] != sp_o[:-1]])
+    group_ends = np.r_[group_starts[1:], n]
+    run_end = np.empty(n)
+    for a, b in zip(group_starts, group_ends):
+        run_end[a:b] = np.maximum.accumulate(en_o[a:b])
+    new_block = np.ones(n, dtype=bool)
+    new_block[1:] = (st_o[1:] > run_end[:-1]) | (sp_o[1:] != sp_o[:-1])
+    block_first = np.flatnonzero(new_block)
+    b_sp = sp_o[block_first]
+    b_start = st_o[block_first]
+    b_end = np.maximum.reduceat(en_o, block_first)
+    talk_seconds = np.bincount(b_sp, weights=b_end - b_start, minlength=n_codes)
+
+    # 2. 事件扫描
+    m = len(b_start)
+    times = np.concatenate((b_start, b_end))
+    delta = np.concatenate((np.ones(m, dtype=np.int64), -np.ones(m, dtype=np.int64)))
+    code_delta = np.concatenate((b_sp, -b_sp))
+    block_of = np.concatenate((np.arange(m), np.arange(m)))
+    ev = np.lexsort((delta, times))  # 同一时刻 -1 排在 +1 前：首尾相接不算重叠
+    t, d, cd, blk = times[ev], delta[ev], code_delta[ev], block_of[ev]
+    active = np.cumsum(d)
+    code_sum = np.cumsum(cd)
+
+    # 3. 相邻事件之间的时间段按活跃人数归类
+    dt = np.diff(t)
+    state = active[:-1]
+    overlap_seconds = float(dt[state >= 2].sum())
+    speech_seconds = float(dt[state >= 1].sum())
+    silence_gaps = dt[(state == 0) & (dt > 0)]
+    solo = state == 1
+    exclusive_seconds = np.bincount(code_sum[:-1][solo], weights=dt[solo], minlength=n_codes)
+
+    # 4. 打断：开始时刻之前已有他人在说话（同一人的分段已合并，活跃者必为他人）；
+    #    同一时刻同时开口的几个人互不算打断，因此取该时刻第一条开始事件之前的状态
+    run_head = np.r_[True, (t[1:] != t[:-1]) | (d[1:] != d[:-1])]
+    first_of_run = np.maximum.accumulate(np.where(run_head, np.arange(len(t)), 0))
+    before = active[first_of_run] - d[first_of_run]
+    code_before = code_sum[first_of_run] - cd[first_of_run]
+    is_int = (d > 0) & (before >= 1)
+    int_time = t[is_int]
+    initiator = cd[is_int]
+    target = np.where(before[is_int] == 1, code_before[is_int], -1)
+
+    # 重叠时长：打断者当前块与被打断者当前块的较早结束时间 - 打断时刻
+    own_end = b_end[blk[is_int]]
+    other_end = np.full(len(int_time), np.nan)
+    for code in np.unique(target[target >= 0]):
+        sel = np.flatnonzero(target == code)
+        blocks = np.flatnonzero(b_sp == code)  # 该说话人的块，按开始时间有序
+        pos = np.searchsorted(b_start[blocks], int_time[sel], side="right") - 1
+        other_end[sel] = b_end[blocks[pos]]
+    int_overlap = np.where(np.isnan(other_end), np.nan, np.minimum(own_end, other_end) - int_time)
+
+    return TurnIntervalStats(
+        talk_seconds=talk_seconds,
+        exclusive_seconds=exclusive_seconds,
+        overlap_seconds=overlap_seconds,
+        speech_seconds=speech_seconds,
+        silence_gaps=silence_gaps,
+        interruption_time=int_time,
+        interruption_initiator=initiator,
+        interruption_target=target,
+        interruption_overlap=int_overlap,
+    )
+
+
+def analyze_frame_intervals(frame: SessionFrame) -> TurnIntervalStats:
+    """SessionFrame 的便捷入口（说话人编码与 frame.speakers 一致）。"""
+    return analyze_turn_intervals(
+        frame.turn_speaker, frame.turn_start, frame.turn_end, n_speakers=len(frame.speakers)
+    )
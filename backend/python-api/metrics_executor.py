@@ -0,0 +1,193 @@
+"""CPU 密集指标的进程池执行层（供 HTTP 服务使用）。
+
+情绪同步的置换检验、DTW 与相关系数计算都是纯 CPU 计算且持有 GIL，直接在事件循环
+线程里运行会卡住所有其他请求。MetricsExecutor 把这部分交给常驻的进程池：
+- 工作进程启动时预先导入 NumPy / dtaidistance（指标模块里是延迟导入），并用一个小会话跑一遍，
+  之后的请求不再承担导入和首次调用的开销
+- 每个任务有超时（默认 CBT_METRICS_TIMEOUT 秒），超时抛 MetricsTaskTimeout
+- 同时在池中排队 / 运行的任务数有上限（默认 CBT_METRICS_MAX_PENDING），超出时立即抛
+  MetricsExecutorBusy，突发的一批长会话不会把后来的请求无限期压在队列后面
+- 开启追踪时，工作进程里的阶段 span（emotion_sync.dtw、permutation_test 等）随结果传回，
+  挂在父进程追踪的 executor.* span 下
+
+LLM 语义分析是 I/O 等待，不经过进程池（见 CompatibilityMetricsAgent.analyze_session_async）。
+"""
+
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from metrics.session_frame import SessionFrame
+from metrics.tracing import capture_spans, get_tracer, merge_span_records, span_records
+
+
+class MetricsExecutorBusy(RuntimeError):
+    """进程池排队任务已达上限。"""
+
+
+class MetricsTaskTimeout(TimeoutError):
+    """单个指标任务超过超时时间。"""
+
+
+# ===== 工作进程侧 =====
+
+# 每个工作进程里常驻的指标 Agent（只使用其中的 CPU 指标，不配置 LLM 客户端）
+_worker_agent: Any = None
+
+
+def _init_worker() -> None:
+    """进程池 initializer：预加载依赖并预热一次计算。"""
+    global _worker_agent
+    import numpy  # noqa: F401
+
+    from compatibility_agent import CompatibilityMetricsAgent
+    from metrics.lazy_deps import preload
+
+    preload()
+
+    _worker_agent = CompatibilityMetricsAgent(multi_speaker=True)
+    warmup = SessionFrame.from_records(
+        [
+            {"speaker": "therapist", "text": "warmup", "start": 0.0, "end": 30.0},
+            {"speaker": "patient", "text": "warmup", "start": 31.0, "end": 60.0},
+        ],
+        [
+            {"speaker": speaker, "timestamp": float(t), "valence": ((t * k) % 7) / 7.0 - 0.5}
+            for t in range(0, 120, 2)
+            for speaker, k in (("therapist", 3), ("patient", 5))
+        ],
+    )
+    _worker_agent._node_emotion_sync(warmup)
+    _worker_agent._node_multi_party(warmup, warmup)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _emotion_sync_task(frame: SessionFrame) -> Any:
+    return _worker_agent._node_emotion_sync(frame)
+
+
+def _multi_party_task(frame: SessionFrame) -> Any:
+    return _worker_agent._node_multi_party(frame, frame)
+
+
+def _traced_task(fn: Callable[..., Any], *args: Any) -> Any:
+    """在工作进程中执行 fn 并收集其 span，返回 (结果, span 记录)。"""
+    with capture_spans() as spans:
+        result = fn(*args)
+    return result, span_records(spans)
+
+
+# ===== 服务侧 =====
+
+
+class MetricsExecutor:
+    """CPU 指标的异步执行器。
+
+    max_workers=0 时不启动进程，任务在线程中执行（本地调试 / 无法创建子进程的环境）；
+    这种模式下计算仍会争用 GIL，只保证事件循环不被直接阻塞。
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        task_timeout: Optional[float] = None,
+        max_pending: Optional[int] = None,
+        start_method: str = "spawn",
+    ) -> None:
+        if max_workers is None:
+            max_workers = int(os.getenv("CBT_METRICS_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+        if task_timeout is None:
+            task_timeout = float(os.getenv("CBT_METRICS_TIMEOUT", "60"))
+        if max_pending is None:
+            max_pending = int(os.getenv("CBT_METRICS_MAX_PENDING", max(1, max_workers) * 4))
+        self.max_workers = max_workers
+        self.task_timeout = task_timeout
+        self.max_pending = max_pending
+        # 默认 spawn：服务进程里已有线程（uvicorn / OpenAI 客户端），fork 后子进程可能继承被占用的锁
+        self.start_method = start_method
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    # ===== 生命周期 =====
+
+    def start(self) -> None:
+        """创建进程池并等待每个工作进程完成预热（在服务启动阶段调用）。"""
+        if self._pool is not None:
+            return
+        if self.max_workers <= 0:
+            _init_worker()
+            return
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context(self.start_method),
+            initializer=_init_worker,
+        )
+        # 进程按需创建：同时提交 max_workers 个任务，促使所有工作进程都启动并执行 initializer
+        for f in [self._pool.submit(_ping) for _ in range(self.max_workers)]:
+            f.result()
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "task_timeout": self.task_timeout,
+        }
+
+    # ===== 任务 =====
+
+    async def emotion_sync(self, frame: SessionFrame, timeout: Optional[float] = None) -> Any:
+        """情绪同步节点的 (值, 明细)；只把情绪列发给工作进程。"""
+        with get_tracer().span("executor.emotion_sync", samples=frame.n_emotions):
+            return await self.run(_emotion_sync_task, frame.emotion_only(), timeout=timeout)
+
+    async def multi_party(self, frame: SessionFrame, timeout: Optional[float] = None) -> Any:
+        with get_tracer().span("executor.multi_party", turns=frame.n_turns):
+            return await self.run(_multi_party_task, frame, timeout=timeout)
+
+    async def run(self, fn: Callable[..., Any], *args: Any, timeout: Optional[float] = None) -> Any:
+        """在进程池中执行 fn(*args)；fn 必须是可 pickle 的模块级函数。"""
+        if self._pool is None and self.max_workers > 0:
+            raise RuntimeError("MetricsExecutor 尚未启动，请先调用 start()")
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise MetricsExecutorBusy(f"指标任务排队已满（{self.max_pending}）")
+            self._pending += 1
+
+        # 进程池模式下开启追踪时，工作进程收集阶段 span 随结果一起传回（线程模式直接沿用当前上下文）
+        traced = self._pool is not None and get_tracer().enabled
+        if self._pool is None:
+            future = asyncio.ensure_future(asyncio.to_thread(fn, *args))
+            future.add_done_callback(lambda _: self._release())
+        else:
+            cf = self._pool.submit(_traced_task, fn, *args) if traced else self._pool.submit(fn, *args)
+            # 计数在任务真正结束时才释放：超时后仍在运行的任务继续占用名额
+            cf.add_done_callback(lambda _: self._release())
+            future = asyncio.wrap_future(cf)
+
+        limit = self.task_timeout if timeout is None else timeout
+        try:
+            # 超时会取消尚在排队的任务；已在运行的任务无法中断，其结果被丢弃
+            result = await asyncio.wait_for(future, limit)
+        except asyncio.TimeoutError:
+            raise MetricsTaskTimeout(f"指标任务 {getattr(fn, '__name__', fn)} 超过 {limit} 秒") from None
+        if traced:
+            result, records = result
+            merge_span_records(records)
+        return result
+
+    def _release(self) -> None:
+        with self._lock:
+            self._pending -= 1
@@ -0,0 +1,57 @@
+"""进行中请求合并（single-flight）。
+
+同一个键的请求在第一个请求（leader）完成之前再次到达时，不再重新执行，而是等待
+leader 的结果（成功或异常都共享）。leader 完成后键即被移除，之后的同键请求会重新执行。
+
+用于 /evaluate_cbt：患者端超时重试、治疗师多个标签页同时打开同一份作业时，
+相同的作业文本只调用一次 LLM。
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """按键合并并发的异步调用（只能在同一个事件循环内使用）。"""
+
+    def __init__(self) -> None:
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """执行 fn()；若同键调用正在进行，则等待它的结果。"""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            future = asyncio.ensure_future(fn())
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._finish(key, f))
+        # shield：某个调用方断开（被取消）时，不影响仍在等待同一结果的其他请求
+        return await asyncio.shield(future)
+
+    def _finish(self, key: str, future: asyncio.Future) -> None:
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.errors += 1
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def stats(self) -> Dict[str, float]:
+        """供 MetricsRegistry.register_gauges 使用的计数。"""
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "inflight": self.inflight,
+            "errors": self.errors,
+        }
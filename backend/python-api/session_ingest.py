@@ -0,0 +1,703 @@
+"""录音系统会话导出的流式导入（JSONL / JSON 数组 → SessionFrame）。
+
+录音系统的导出文件往往有上百个会话、数 GB。analyze_session 需要先把整个会话变成
+Python dict 再构造 SessionInput；这里改为逐条读取、按列校验，直接得到列式的
+SessionFrame，再通过 CompatibilityMetricsAgent.analyze_frame 送入分析，任何时候内存中
+只有当前这一个会话的列数据。
+
+支持的输入（format="auto" 时按首个非空白字节判断）：
+- JSONL，每行一个完整会话：{"session_id": ..., "transcript": [...], "emotion_timeline": [...]}
+- JSONL，按行类型拆开的记录（同一会话的行连续，新的 session 行开始下一个会话）：
+    {"type": "session", "session_id": "s1", "patient_id": ..., "therapist_id": ..., "session_date": ...}
+    {"type": "turn", "speaker": "therapist", "text": "...", "start": 0.0, "end": 2.5}
+    {"type": "emotion", "speaker": "patient", "timestamp": 1.0, "valence": -0.2, "arousal": 0.6}
+- JSON 数组 [{会话}, {会话}, ...]：按块读取并扫描括号，逐个切出会话对象再解析
+
+解析优先用 orjson（未安装时退回标准库 json）。校验按列进行：先整列检查类型，
+再转成 NumPy 数组检查有限值、取值范围与 start ≤ end；只有整列检查不通过时才逐行定位。
+不合格的行被剔除并记录精确位置（记录序号 + 字段），会话元数据不合格时整个会话被拒绝；
+strict=True 时遇到第一个错误即抛出 IngestError。
+"""
+
+import json
+import math
+import os
+import sys
+from dataclasses import dataclass, field
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from compatibility_agent import CompatibilityMetricsAgent, CompatibilityOutput, SessionInput
+from metrics.session_frame import DEFAULT_SPEAKERS, SessionFrame
+
+try:  # 可选依赖：orjson 解析速度约为标准库的数倍
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:  # pragma: no cover - 取决于部署环境
+    orjson = None
+    _loads = json.loads
+
+META_FIELDS = ("session_id", "patient_id", "therapist_id", "session_date")
+VALENCE_RANGE = (-1.0, 1.0)
+AROUSAL_RANGE = (-1.0, 1.0)
+
+_MISSING = object()
+_NUMBER_TYPES = {int, float}
+_STR_TYPES = {str}
+# JSON 数组扫描用到的字节
+_QUOTE, _BACKSLASH = ord('"'), ord("\\")
+_LBRACE, _RBRACE, _LBRACKET, _RBRACKET = ord("{"), ord("}"), ord("["), ord("]")
+_SEPARATORS = b" \t\r\n,\xef\xbb\xbf"
+
+Source = Union[str, "os.PathLike[str]", IO[bytes], Iterable[bytes]]
+
+
+class IngestError(ValueError):
+    """导出数据格式错误。record：JSONL 为行号，JSON 数组为元素序号（均从 1 开始）。"""
+
+    def __init__(
+        self,
+        message: str,
+        record: Optional[int] = None,
+        session_id: Optional[str] = None,
+        location: Optional[str] = None,
+    ) -> None:
+        self.message = message
+        self.record = record
+        self.session_id = session_id
+        self.location = location
+        super().__init__(str(self))
+
+    def __str__(self) -> str:
+        where = []
+        if self.record is not None:
+            where.append(f"记录 {self.record}")
+        if self.session_id:
+            where.append(f"会话 {self.session_id}")
+        if self.location:
+            where.append(self.location)
+        return f"{' / '.join(where)}：{self.message}" if where else self.message
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "record": self.record,
+            "session_id": self.session_id,
+            "location": self.location,
+            "message": self.message,
+        }
+
+
+@dataclass
+class IngestedSession:
+    """一次导入的会话。session 只携带元数据（transcript / emotion_timeline 为空列表），内容在 frame 中。"""
+
+    session: SessionInput
+    frame: SessionFrame
+    record: int
+    rejected_rows: List[IngestError] = field(default_factory=list)
+    # 超出 max_row_errors 而未保留明细的被拒行数
+    rejected_overflow: int = 0
+
+    @property
+    def n_rejected(self) -> int:
+        return len(self.rejected_rows) + self.rejected_overflow
+
+
+@dataclass
+class IngestStats:
+    records: int = 0
+    sessions: int = 0
+    sessions_rejected: int = 0
+    turns: int = 0
+    emotions: int = 0
+    rows_rejected: int = 0
+
+
+class _Section:
+    """一个会话中转写或情绪部分的列缓冲。refs：每行的来源（行模式为行号，嵌套模式为列表下标）。"""
+
+    def __init__(self, name: str, fields: Tuple[str, ...], defaults: Dict[str, Any]) -> None:
+        self.name = name
+        self.fields = fields
+        self.defaults = defaults
+        self.columns: Dict[str, List[Any]] = {f: [] for f in fields}
+        self.refs: List[int] = []
+
+    def append(self, row: Any, ref: int) -> None:
+        self.refs.append(ref)
+        if not isinstance(row, dict):
+            # 非对象的行：所有字段记为缺失，由校验统一报错
+            for f in self.fields:
+                self.columns[f].append(_MISSING)
+            return
+        for f in self.fields:
+            self.columns[f].append(row.get(f, self.defaults.get(f, _MISSING)))
+
+    def extend(self, rows: List[Any]) -> None:
+        """嵌套模式：整列表按字段成列提取（refs 为列表下标）。"""
+        if set(map(type, rows)) <= {dict}:
+            base = len(self.refs)
+            self.refs.extend(range(base, base + len(rows)))
+            for f in self.fields:
+                default = self.defaults.get(f, _MISSING)
+                self.columns[f].extend([row.get(f, default) for row in rows])
+            return
+        for i, row in enumerate(rows):
+            self.append(row, i)
+
+    def __len__(self) -> int:
+        return len(self.refs)
+
+
+class _SessionBuilder:
+    def __init__(self, meta: Dict[str, Any], record: int, nested: bool) -> None:
+        self.meta = meta
+        self.record = record
+        # nested：转写 / 情绪以列表嵌在会话对象里（行位置用下标表示）
+        self.nested = nested
+        self.turns = _Section("transcript", ("speaker", "text", "start", "end"), {})
+        self.emotions = _Section("emotion_timeline", ("speaker", "timestamp", "valence", "arousal"), {"arousal": 0.0})
+
+
+class SessionIngestor:
+    """流式导入器。
+
+    strict：遇到第一个错误即抛 IngestError；否则剔除坏行 / 坏会话并继续。
+    max_row_errors：每个会话最多保留的坏行明细条数（其余只计数），
+    max_errors：errors（被拒会话与不属于任何会话的坏行）最多保留的条数，均用于限制内存。
+    """
+
+    def __init__(
+        self,
+        strict: bool = False,
+        chunk_size: int = 1 << 20,
+        max_row_errors: int = 100,
+        max_errors: int = 1000,
+    ) -> None:
+        self.strict = strict
+        self.chunk_size = chunk_size
+        self.max_row_errors = max_row_errors
+        self.max_errors = max_errors
+        self.errors: List[IngestError] = []
+        self._stats = IngestStats()
+
+    # ===== 入口 =====
+
+    def iter_sessions(self, source: Source, format: str = "auto") -> Iterator[IngestedSession]:
+        """逐个产出校验后的会话。source 为文件路径、二进制文件对象或 bytes 行的可迭代对象。"""
+        if format not in {"auto", "jsonl", "json"}:
+            raise ValueError(f"未知的导入格式: {format}")
+        with _open_source(source) as stream:
+            if format == "auto":
+                format = "json" if _peek_first_byte(stream) == b"[" else "jsonl"
+            records = _iter_jsonl(stream) if format == "jsonl" else _iter_json_array(stream, self.chunk_size)
+            yield from self._iter_records(records)
+
+    def stats(self) -> Dict[str, float]:
+        s = self._stats
+        return {
+            "records": s.records,
+            "sessions": s.sessions,
+            "sessions_rejected": s.sessions_rejected,
+            "turns": s.turns,
+            "emotions": s.emotions,
+            "rows_rejected": s.rows_rejected,
+        }
+
+    # ===== 记录 → 会话 =====
+
+    def _iter_records(self, records: Iterator[Tuple[int, Any]]) -> Iterator[IngestedSession]:
+        current: Optional[_SessionBuilder] = None
+        for record, raw in records:
+            self._stats.records += 1
+            try:
+                obj = _loads(raw)
+            except ValueError as e:
+                error = IngestError(f"JSON 解析失败：{e}", record)
+                # 行模式的会话进行中时按坏行处理，否则（整会话记录）拒绝该会话
+                if current is not None and current.meta:
+                    error.session_id = current.meta["session_id"]
+                    self._reject_row(error)
+                else:
+                    self._reject_session(error)
+                continue
+            kind = obj.get("type") if isinstance(obj, dict) else None
+
+            if kind in ("turn", "emotion"):
+                if current is None:
+                    self._reject_row(IngestError("在任何 session 行之前出现", record, None, kind))
+                    continue
+                if not current.meta:
+                    # 所属会话已被拒绝（会话级错误已记录），行直接丢弃
+                    continue
+                sid = obj.get("session_id", current.meta["session_id"])
+                if sid != current.meta["session_id"]:
+                    self._reject_row(
+                        IngestError(
+                            f"session_id={sid!r} 与当前会话不一致（同一会话的行必须连续）",
+                            record,
+                            current.meta["session_id"],
+                            kind,
+                        ),
+                    )
+                    continue
+                (current.turns if kind == "turn" else current.emotions).append(obj, record)
+                continue
+
+            # 新会话开始：先完成上一个
+            if current is not None:
+                done = self._finish(current)
+                if done is not None:
+                    yield done
+                current = None
+
+            if not isinstance(obj, dict) or kind not in (None, "session"):
+                self._reject_session(IngestError(f"未知的记录类型：{kind!r}" if kind else "记录不是 JSON 对象", record))
+                # 之后属于该会话的 turn / emotion 行一并作废
+                current = _SessionBuilder({}, record, nested=False)
+                continue
+            meta, error = _validate_meta(obj, record)
+            if error is not None:
+                self._reject_session(error)
+                current = _SessionBuilder({}, record, nested=False)
+                continue
+            current = _SessionBuilder(meta, record, nested=kind is None)
+            if kind is None:
+                # 整会话记录：就地完成，之后出现的 turn / emotion 行不属于任何会话
+                builder, current = current, None
+                for section, key in ((builder.turns, "transcript"), (builder.emotions, "emotion_timeline")):
+                    rows = obj.get(key) or []
+                    if not isinstance(rows, list):
+                        self._reject_session(IngestError(f"{key} 应为数组", record, meta["session_id"], key))
+                        break
+                    section.extend(rows)
+                else:
+                    yield self._finish(builder)
+        if current is not None:
+            done = self._finish(current)
+            if done is not None:
+                yield done
+
+    def _finish(self, builder: _SessionBuilder) -> Optional[IngestedSession]:
+        if not builder.meta:
+            # 已被拒绝的会话：丢弃它的行
+            return None
+        rejected: List[IngestError] = []
+        sid = builder.meta["session_id"]
+        t_cols, t_errors = _validate_section(builder.turns, builder, sid)
+        e_cols, e_errors = _validate_section(builder.emotions, builder, sid)
+        errors = t_errors + e_errors
+        if errors and self.strict:
+            raise errors[0]
+        rejected.extend(errors[: self.max_row_errors])
+
+        frame = _build_frame(t_cols, e_cols)
+        meta = builder.meta
+        session = SessionInput(
+            session_id=meta["session_id"],
+            patient_id=meta["patient_id"],
+            therapist_id=meta["therapist_id"],
+            session_date=meta["session_date"],
+            transcript=[],
+            emotion_timeline=[],
+            cbt_indicators=meta.get("cbt_indicators") or {},
+            homework_quality=meta.get("homework_quality") or {},
+        )
+        self._stats.sessions += 1
+        self._stats.turns += frame.n_turns
+        self._stats.emotions += frame.n_emotions
+        self._stats.rows_rejected += len(errors)
+        return IngestedSession(session, frame, builder.record, rejected, len(errors) - len(rejected))
+
+    def _reject_session(self, error: IngestError) -> None:
+        if self.strict:
+            raise error
+        self._stats.sessions_rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(error)
+
+    def _reject_row(self, error: IngestError) -> None:
+        if self.strict:
+            raise error
+        # 行模式下未能归入会话的坏行：计入被拒行数，明细与会话级错误一起保留
+        self._stats.rows_rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(error)
+
+
+# ===== 会话元数据 / 列校验 =====
+
+
+def _validate_meta(obj: Dict[str, Any], record: int) -> Tuple[Dict[str, Any], Optional[IngestError]]:
+    sid = obj.get("session_id")
+    sid_label = sid if isinstance(sid, str) else None
+    for name in META_FIELDS:
+        value = obj.get(name, _MISSING)
+        if value is _MISSING:
+            return {}, IngestError("缺少字段", record, sid_label, name)
+        if not isinstance(value, str) or not value:
+            return {}, IngestError(f"应为非空字符串，实际为 {_describe(value)}", record, sid_label, name)
+    meta = {name: obj[name] for name in META_FIELDS}
+    for name in ("cbt_indicators", "homework_quality"):
+        value = obj.get(name)
+        if value is not None and not isinstance(value, dict):
+            return {}, IngestError(f"应为对象，实际为 {_describe(value)}", record, sid, name)
+        meta[name] = value
+    return meta, None
+
+
+def _validate_section(
+    section: _Section, builder: _SessionBuilder, session_id: str
+) -> Tuple[Dict[str, Any], List[IngestError]]:
+    """按列校验，返回 (剔除坏行后的列, 坏行错误)。每个坏行只报告第一个不合格的字段。"""
+    n = len(section)
+    bad = np.zeros(n, dtype=bool)
+    reasons: Dict[int, Tuple[str, str]] = {}
+
+    def flag(mask: np.ndarray, name: str, message: Union[str, Any]) -> None:
+        for i in np.flatnonzero(mask & ~bad):
+            col = section.columns[name]
+            reasons[int(i)] = (name, message(col[i]) if callable(message) else message)
+        bad[mask] = True
+
+    out: Dict[str, Any] = {}
+    for name in section.fields:
+        col = section.columns[name]
+        if name in ("speaker", "text"):
+            if set(map(type, col)) <= _STR_TYPES:
+                ok = np.ones(n, dtype=bool)
+            else:
+                ok = np.fromiter((type(v) is str for v in col), dtype=bool, count=n)
+            flag(~ok, name, lambda v: "缺少字段" if v is _MISSING else f"应为字符串，实际为 {_describe(v)}")
+            if name == "speaker":
+                empty = ok & np.fromiter((v == "" if type(v) is str else False for v in col), dtype=bool, count=n)
+                flag(empty, name, "说话人不能为空")
+            out[name] = col
+            continue
+
+        if set(map(type, col)) <= _NUMBER_TYPES:
+            values = np.array(col, dtype=np.float64) if n else np.zeros(0, dtype=np.float64)
+        else:
+            ok = np.fromiter((type(v) in _NUMBER_TYPES for v in col), dtype=bool, count=n)
+            flag(~ok, name, lambda v: "缺少字段" if v is _MISSING else f"应为数字，实际为 {_describe(v)}")
+            values = np.array([v if ok_i else math.nan for v, ok_i in zip(col, ok)], dtype=np.float64)
+        with np.errstate(invalid="ignore"):
+            flag(~np.isfinite(values) & ~bad, name, lambda v: f"应为有限数值，实际为 {v!r}")
+            if name in ("start", "end", "timestamp"):
+                flag(values < 0, name, lambda v: f"时间不能为负：{v!r}")
+            elif name in ("valence", "arousal"):
+                lo, hi = VALENCE_RANGE if name == "valence" else AROUSAL_RANGE
+                flag((values < lo) | (values > hi), name, lambda v: f"超出范围 [{lo}, {hi}]：{v!r}")
+        out[name] = values
+
+    if section.name == "transcript" and n:
+        with np.errstate(invalid="ignore"):
+            flag(out["end"] < out["start"], "end", "end 早于 start")
+
+    errors = [
+        _row_error(section, builder, session_id, i, name, message)
+        for i, (name, message) in sorted(reasons.items())
+    ]
+    if bad.any():
+        keep = ~bad
+        for name in section.fields:
+            col = out[name]
+            out[name] = col[keep] if isinstance(col, np.ndarray) else [v for v, k in zip(col, keep) if k]
+    return out, errors
+
+
+def _row_error(
+    section: _Section, builder: _SessionBuilder, session_id: str, i: int, name: str, message: str
+) -> IngestError:
+    ref = section.refs[i]
+    if builder.nested:
+        return IngestError(message, builder.record, session_id, f"{section.name}[{ref}].{name}")
+    kind = "turn" if section.name == "transcript" else "emotion"
+    return IngestError(message, ref, session_id, f"{kind}.{name}")
+
+
+def _build_frame(turns: Dict[str, Any], emotions: Dict[str, Any]) -> SessionFrame:
+    """由校验后的列构建 SessionFrame（说话人编码规则与 SessionFrame.from_records 相同）。"""
+    speakers: List[str] = list(DEFAULT_SPEAKERS)
+    index = {s: i for i, s in enumerate(speakers)}
+
+    def encode(labels: List[str]) -> np.ndarray:
+        for label in dict.fromkeys(labels):
+            if label not in index:
+                index[label] = len(speakers)
+                speakers.append(label)
+        return np.fromiter((index[s] for s in labels), dtype=np.int16, count=len(labels))
+
+    return SessionFrame(
+        speakers=speakers,
+        turn_speaker=encode(turns["speaker"]),
+        turn_start=turns["start"],
+        turn_end=turns["end"],
+        texts=list(turns["text"]),
+        emo_speaker=encode(emotions["speaker"]),
+        emo_timestamp=emotions["timestamp"],
+        emo_valence=emotions["valence"],
+        emo_arousal=emotions["arousal"],
+    )
+
+
+def _describe(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "布尔值"
+    return type(value).__name__
+
+
+# ===== 读取 =====
+
+
+class _open_source:
+    """路径则打开文件（结束时关闭），文件对象 / 可迭代对象原样使用。"""
+
+    def __init__(self, source: Source) -> None:
+        self._source = source
+        self._owned: Optional[IO[bytes]] = None
+
+    def __enter__(self) -> Any:
+        if isinstance(self._source, (str, os.PathLike)):
+            self._owned = open(self._source, "rb")
+            return _PeekableStream(self._owned)
+        if hasattr(self._source, "read"):
+            return _PeekableStream(self._source)
+        return _PeekableStream(_IterReader(iter(self._source)))
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self._owned is not None:
+            self._owned.close()
+
+
+class _IterReader:
+    """把 bytes 块的迭代器包装成带 read / readline 的对象。"""
+
+    def __init__(self, chunks: Iterator[bytes]) -> None:
+        self._chunks = chunks
+        self._buf = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buf) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buf += chunk
+        if size < 0:
+            out, self._buf = self._buf, b""
+        else:
+            out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+    def readline(self) -> bytes:
+        while b"\n" not in self._buf:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                out, self._buf = self._buf, b""
+                return out
+            self._buf += chunk
+        cut = self._buf.index(b"\n") + 1
+        out, self._buf = self._buf[:cut], self._buf[cut:]
+        return out
+
+
+class _PeekableStream:
+    """记下判断格式时预读的字节，之后的 read / readline 先返回它们。"""
+
+    def __init__(self, raw: Any) -> None:
+        self._raw = raw
+        self._pending = b""
+
+    def peek_into(self, data: bytes) -> None:
+        self._pending = data + self._pending
+
+    def read(self, size: int = -1) -> bytes:
+        if self._pending:
+            if size < 0:
+                out, self._pending = self._pending + self._raw.read(), b""
+                return out
+            out, self._pending = self._pending[:size], self._pending[size:]
+            return out
+        return self._raw.read(size)
+
+    def readline(self) -> bytes:
+        if self._pending:
+            if b"\n" in self._pending:
+                cut = self._pending.index(b"\n") + 1
+                out, self._pending = self._pending[:cut], self._pending[cut:]
+                return out
+            out, self._pending = self._pending + self._raw.readline(), b""
+            return out
+        return self._raw.readline()
+
+
+def _peek_first_byte(stream: _PeekableStream) -> bytes:
+    seen = b""
+    while True:
+        chunk = stream.read(4096)
+        if not chunk:
+            stream.peek_into(seen)
+            return b""
+        seen += chunk
+        stripped = seen.lstrip(b" \t\r\n\xef\xbb\xbf")
+        if stripped:
+            stream.peek_into(seen)
+            return stripped[:1]
+
+
+def _iter_jsonl(stream: _PeekableStream) -> Iterator[Tuple[int, bytes]]:
+    lineno = 0
+    while True:
+        line = stream.readline()
+        if not line:
+            return
+        lineno += 1
+        if line.strip():
+            yield lineno, line
+
+
+def _iter_json_array(stream: _PeekableStream, chunk_size: int) -> Iterator[Tuple[int, bytes]]:
+    """扫描顶层 JSON 数组，逐个切出元素对象的原始字节（缓冲区只保留未完成的那个元素）。
+
+    每读入一块，用 NumPy 一次算出块内每个字节是否在字符串内（未被转义的引号的累计奇偶）
+    以及字符串外括号的嵌套深度，只在深度回到数组层的位置切分，Python 层的循环次数
+    与会话数成正比，与字节数无关。
+    """
+    buf = b""
+    scanned = 0  # buf 中已扫描的字节数
+    depth = 0
+    in_string = False
+    backslashes = 0  # 已扫描部分末尾连续反斜杠的个数
+    start = -1  # 当前元素（顶层数组中的对象）的起始位置
+    last_end = 0  # 上一个元素（或 "["）的结束位置，其后到下一个元素之间只允许空白和逗号
+    element = 0
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            raise IngestError("JSON 导出在数组结束前被截断", element + 1)
+        buf += chunk
+        c = np.frombuffer(buf, dtype=np.uint8, offset=scanned)
+
+        quote = c == _QUOTE
+        if backslashes or buf.find(b"\\", scanned) >= 0:
+            # 引号前连续反斜杠为奇数个时该引号被转义（上一块末尾的反斜杠也算在内）
+            is_bs = c == _BACKSLASH
+            idx = np.arange(len(c), dtype=np.int64)
+            last_other = np.maximum.accumulate(np.where(is_bs, -1, idx))
+            q = np.flatnonzero(quote)
+            q = q[q > 0]
+            run_before = q - 1 - last_other[q - 1] + np.where(last_other[q - 1] < 0, backslashes, 0)
+            quote[q[run_before % 2 == 1]] = False
+            if quote[0] and backslashes % 2 == 1:
+                quote[0] = False
+            tail = len(c) - 1 - int(last_other[-1])
+            backslashes = tail + (backslashes if last_other[-1] < 0 else 0)
+        # 截至每个位置（含）未转义引号个数的奇偶：1 为字符串内（开引号本身记为内，闭引号记为外）
+        inside = np.bitwise_xor.accumulate(quote.view(np.uint8))
+        if in_string:
+            inside ^= 1
+        bracket = np.flatnonzero(
+            ((c == _LBRACE) | (c == _RBRACE) | (c == _LBRACKET) | (c == _RBRACKET)) & (inside == 0) & ~quote
+        )
+        is_open = (c[bracket] == _LBRACE) | (c[bracket] == _LBRACKET)
+        depth_after = depth + np.cumsum(np.where(is_open, 1, -1))
+
+        boundary = (is_open & (depth_after <= 2)) | (~is_open & (depth_after <= 1))
+        for pos, d in zip(bracket[boundary].tolist(), depth_after[boundary].tolist()):
+            at = scanned + pos
+            ch = buf[at : at + 1]
+            if ch in (b"{", b"["):
+                # 数组层之外（d == 1）或数组层的元素（d == 2）
+                if buf[last_end:at].strip(_SEPARATORS):
+                    raise IngestError("JSON 导出的顶层应为会话对象的数组", element + 1)
+                if (d == 1) != (ch == b"["):
+                    raise IngestError("JSON 导出的顶层应为会话对象的数组", element + 1)
+                if d == 1:
+                    last_end = at + 1
+                else:
+                    start = at
+            else:
+                if d < 0 or d == 1 and ch != b"}" or d == 0 and (ch != b"]" or start >= 0):
+                    raise IngestError("JSON 括号不匹配", element + 1)
+                if d == 0:
+                    if buf[last_end:at].strip(_SEPARATORS):
+                        raise IngestError("JSON 导出的顶层应为会话对象的数组", element + 1)
+                    return
+                element += 1
+                yield element, buf[start : at + 1]
+                start = -1
+                last_end = at + 1
+        if len(depth_after):
+            depth = int(depth_after[-1])
+        in_string = bool(inside[-1])
+        # 丢弃已处理的前缀，只保留未完成的元素（或元素之间尚未检查的分隔符）
+        keep = start if start >= 0 else last_end
+        buf = buf[keep:]
+        scanned = len(buf)
+        last_end = max(0, last_end - keep)
+        if start >= 0:
+            start = 0
+
+
+# ===== 送入分析 =====
+
+
+def iter_sessions(source: Source, format: str = "auto", strict: bool = False) -> Iterator[IngestedSession]:
+    return SessionIngestor(strict=strict).iter_sessions(source, format)
+
+
+def analyze_export(
+    source: Source,
+    agent: Optional[CompatibilityMetricsAgent] = None,
+    ingestor: Optional[SessionIngestor] = None,
+    format: str = "auto",
+) -> Iterator[Tuple[IngestedSession, CompatibilityOutput]]:
+    """逐个会话导入并分析；调用方边迭代边处理（例如写入 ArchiveWriter），不会累积全部结果。"""
+    agent = agent or CompatibilityMetricsAgent()
+    ingestor = ingestor or SessionIngestor()
+    for item in ingestor.iter_sessions(source, format):
+        yield item, agent.analyze_frame(item.session, item.frame)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="导入录音系统的会话导出并逐个分析")
+    parser.add_argument("path", help="JSONL 或 JSON 数组文件")
+    parser.add_argument("--format", choices=["auto", "jsonl", "json"], default="auto")
+    parser.add_argument("--strict", action="store_true", help="遇到第一个格式错误即退出")
+    parser.add_argument("--archive", help="把每个会话的归档数据写入该目录（archive_store）")
+    args = parser.parse_args()
+
+    agent = CompatibilityMetricsAgent()
+    ingestor = SessionIngestor(strict=args.strict)
+    writer = None
+    if args.archive:
+        from archive_store import ArchiveWriter
+
+        writer = ArchiveWriter(args.archive)
+    try:
+        for item, output in analyze_export(args.path, agent, ingestor, args.format):
+            for error in item.rejected_rows:
+                print(f"⚠️ {error}", file=sys.stderr)
+            if writer is not None:
+                detail = agent._last_emotion_detail or {}
+                writer.append(output.archive_data, detail.get("visualization_data"))
+            print(
+                f"✅ {item.session.session_id}: {item.frame.n_turns} 轮 / {item.frame.n_emotions} 个情绪采样，"
+                f"剔除 {item.n_rejected} 行"
+            )
+    except IngestError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if writer is not None:
+            writer.close()
+    for error in ingestor.errors:
+        print(f"⚠️ {error}", file=sys.stderr)
+    print(json.dumps(ingestor.stats(), ensure_ascii=False))